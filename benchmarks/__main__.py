@@ -0,0 +1,174 @@
+"""
+Benchmarks of the API hot paths
+
+    python -m benchmarks                                # in-process, all scenarios
+    python -m benchmarks --mode load --workers 4        # uvicorn with 4 workers
+    python -m benchmarks --compare benchmarks/results/old.json
+
+Every run seeds a new database in a temporary directory and saves results as JSON
+(benchmarks/results/ by default), so runs can be compared with --compare
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import config
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIRECTORY = os.path.join(REPOSITORY, 'benchmarks', 'results')
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of the API hot paths')
+    parser.add_argument('--mode', choices=('inprocess', 'load'), default='inprocess',
+                        help='inprocess - httpx ASGI transport, load - uvicorn and client processes')
+    parser.add_argument('--scenarios', default='catalog_page,catalog_full,photo,sale,supply',
+                        help='comma separated scenarios')
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--photos', type=int, default=200, help='products with a photo')
+    parser.add_argument('--sales', type=int, default=50_000)
+    parser.add_argument('--requests', type=int, default=1000, help='measured operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent operations (per client process)')
+    parser.add_argument('--workers', type=int, default=2, help='uvicorn workers (load mode)')
+    parser.add_argument('--clients', type=int, default=2, help='client processes (load mode)')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<mode>-<time>.json)')
+    parser.add_argument('--compare', help='previous results file to compare with')
+    return parser.parse_args()
+
+def _settings(directory: str, mode: str, workers: int) -> dict:
+    """
+    :return:    config overrides of the run
+    """
+    settings = {'DATABASE_PATH': os.path.join(directory, 'main.db')}
+    if mode == 'load' and workers > 1:
+        # Admin scenarios log in on one worker and continue on others
+        settings['SESSION_BACKEND'] = 'sqlite'
+        settings['DRAFT_BACKEND']   = 'sqlite'
+    return settings
+
+def _write_server_config(directory: str, settings: dict):
+    """
+    Writes config.py for the uvicorn server: repository config with overrides of the run
+    """
+    lines = [
+        'import importlib.util',
+        f"_spec = importlib.util.spec_from_file_location('_config', {os.path.join(REPOSITORY, 'config.py')!r})",
+        '_config = importlib.util.module_from_spec(_spec)',
+        '_spec.loader.exec_module(_config)',
+        "globals().update({name: value for name, value in vars(_config).items() if name.isupper()})",
+    ]
+    lines += [f'{name} = {value!r}' for name, value in settings.items()]
+
+    with open(os.path.join(directory, 'config.py'), 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def _metadata(arguments) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    import images
+    from responses import orjson
+
+    return {
+        'timestamp':    datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit':       commit,
+        'python':       platform.python_version(),
+        'sqlite':       sqlite3.sqlite_version,
+        'platform':     platform.platform(),
+        'cpus':         os.cpu_count(),
+        'orjson':       orjson is not None,
+        'pillow':       images.Image is not None,
+        'arguments':    vars(arguments),
+    }
+
+def _compare(results: dict, path: str):
+    with open(path) as file:
+        previous = json.load(file)['results']
+
+    print(f'\nCompared with {path}:')
+    for name, summary in results.items():
+        if name not in previous:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms', 'throughput'):
+            before, after = previous[name][key], summary[key]
+            change = f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+            changes.append(f'{key} {before} -> {after} ({change})')
+        print(f'  {name:14} ' + ', '.join(changes))
+
+
+def main():
+    arguments = _parse_arguments()
+    scenarios = [name.strip() for name in arguments.scenarios.split(',') if name.strip()]
+
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        settings = _settings(directory, arguments.mode, arguments.workers)
+        # Modules copy settings on import, so config is patched before the app is imported
+        for name, value in settings.items():
+            setattr(config, name, value)
+
+        from benchmarks import runner, seed, scenarios as available
+        from database.pool import close_pool
+
+        unknown = set(scenarios) - set(available.SCENARIOS)
+        if unknown:
+            sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        started = time.perf_counter()
+        seeded = seed.seed(arguments.products, arguments.photos, arguments.sales)
+        print(f'Seeded {arguments.products} products, {arguments.photos} photos, {arguments.sales} sales '
+              f'in {time.perf_counter() - started:.1f} s')
+
+        context = {
+            'product_ids':          seeded['product_ids'],
+            'photo_product_ids':    seeded['photo_product_ids'] or seeded['product_ids'],
+            'admin':                seeded['admin'].model_dump(),
+            'photo':                seed.make_photo(-1, size=320),
+        }
+
+        if arguments.mode == 'inprocess':
+            results = asyncio.run(runner.run_inprocess(scenarios, context, arguments.requests,
+                                                       arguments.concurrency))
+        else:
+            close_pool()
+            _write_server_config(directory, settings)
+            results = runner.run_load(scenarios, context, arguments.requests, arguments.concurrency,
+                                      directory, arguments.workers, arguments.clients)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {'metadata': _metadata(arguments), 'results': results}
+
+    output = arguments.output
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"{arguments.mode}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print(f"\n{'scenario':14} {'count':>7} {'errors':>7} {'ops/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for name, summary in results.items():
+        print(f"{name:14} {summary['count']:>7} {summary['errors']:>7} {summary['throughput']:>9} "
+              f"{summary['p50_ms']:>9} {summary['p90_ms']:>9} {summary['p99_ms']:>9}")
+    print(f'\nResults saved to {output}')
+
+    if arguments.compare:
+        _compare(results, arguments.compare)
+
+
+if __name__ == '__main__':
+    main()
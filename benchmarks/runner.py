@@ -0,0 +1,208 @@
+"""
+Running scenarios and collecting latencies
+
+run_inprocess() calls the app through httpx ASGI transport (no network, one process),
+run_load() starts uvicorn with several workers and hits it from several client processes
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.scenarios import SCENARIOS, ADMIN_SCENARIOS, login
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    :param values:      sorted values
+    :param fraction:    0.5 for median, 0.99 for p99...
+    :return:            value below which the given fraction of values falls
+
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    """
+    :param latencies:   latencies of operations in seconds
+    :param errors:      number of failed operations
+    :param elapsed:     wall time of the run in seconds
+    :return:            dict with count, errors, throughput and latency percentiles in milliseconds
+
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    return {
+        'count':        count,
+        'errors':       errors,
+        'throughput':   round(count / elapsed, 2) if elapsed else 0.0,
+        'mean_ms':      round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'p50_ms':       round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms':       round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms':       round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms':       round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, context: dict, requests: int,
+                       concurrency: int, seed: int = 0, warmup: int = 0) -> tuple:
+    """
+    :param client:      HTTP client
+    :param name:        scenario name (see SCENARIOS)
+    :param context:     seeded data (product_ids, photo_product_ids, admin, photo)
+    :param requests:    number of measured operations
+    :param concurrency: number of concurrent workers
+    :param seed:        seed of workers' random generators
+    :param warmup:      number of operations made before measuring
+    :return:            (latencies, errors, started_at, finished_at), times are time.time()
+
+    """
+    scenario = SCENARIOS[name]
+    context = dict(context)
+
+    if name in ADMIN_SCENARIOS:
+        context['tokens'] = await asyncio.gather(*[login(client, context['admin']) for _ in range(concurrency)])
+
+    latencies = []
+    errors = 0
+
+    async def operate(count: int, measure: bool):
+        remaining = count
+
+        async def worker(number: int):
+            nonlocal remaining, errors
+            rng = random.Random(f'{seed}-{number}-{measure}')
+
+            while remaining > 0:
+                remaining -= 1
+
+                started = time.perf_counter()
+                try:
+                    succeeded = await scenario(client, context, number, rng)
+                except httpx.HTTPError:
+                    succeeded = False
+                latency = time.perf_counter() - started
+
+                if not measure:
+                    continue
+                if succeeded:
+                    latencies.append(latency)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*[worker(number) for number in range(concurrency)])
+
+    await operate(warmup, measure=False)
+
+    started_at = time.time()
+    await operate(requests, measure=True)
+    finished_at = time.time()
+
+    return latencies, errors, started_at, finished_at
+
+
+async def run_inprocess(scenarios: list, context: dict, requests: int, concurrency: int) -> dict:
+    """
+    :param scenarios:   scenario names
+    :param context:     seeded data
+    :param requests:    operations per scenario
+    :param concurrency: concurrent workers
+    :return:            dict scenario -> summary
+
+    The app is started with its lifespan, requests go through httpx ASGI transport
+    """
+    import main
+
+    results = {}
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=60) as client:
+            for name in scenarios:
+                latencies, errors, started_at, finished_at = await run_scenario(
+                    client, name, context, requests, concurrency, warmup=min(requests // 10, 50))
+                results[name] = summarize(latencies, errors, finished_at - started_at)
+
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise Exception(f'Server exited with code {server.returncode}')
+        try:
+            if httpx.get(base_url + '/products', params={'limit': 1}).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise Exception('Server did not start in time')
+
+def _client_process(arguments: tuple) -> tuple:
+    base_url, name, context, requests, concurrency, seed = arguments
+
+    async def run():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            return await run_scenario(client, name, context, requests, concurrency, seed=seed,
+                                      warmup=min(requests // 10, 20))
+
+    return asyncio.run(run())
+
+def run_load(scenarios: list, context: dict, requests: int, concurrency: int, directory: str,
+             workers: int, clients: int) -> dict:
+    """
+    :param scenarios:   scenario names
+    :param context:     seeded data
+    :param requests:    operations per scenario (split between client processes)
+    :param concurrency: concurrent connections of every client process
+    :param directory:   directory of benchmark run with config.py for the server
+    :param workers:     uvicorn worker processes
+    :param clients:     client processes
+    :return:            dict scenario -> summary
+
+    The server runs in the given directory, so its config.py overrides the repository one
+    """
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([directory, repository]))
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                               '--workers', str(workers), '--log-level', 'warning'],
+                              cwd=directory, env=environment)
+
+    results = {}
+    try:
+        _wait_until_ready(base_url, server)
+
+        with multiprocessing.get_context('spawn').Pool(clients) as pool:
+            for name in scenarios:
+                shares = [requests // clients + (1 if number < requests % clients else 0)
+                          for number in range(clients)]
+                runs = pool.map(_client_process, [(base_url, name, context, share, concurrency, number)
+                                                  for number, share in enumerate(shares)])
+
+                latencies = [latency for run in runs for latency in run[0]]
+                errors = sum(run[1] for run in runs)
+                elapsed = max(run[3] for run in runs) - min(run[2] for run in runs)
+                results[name] = summarize(latencies, errors, elapsed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return results
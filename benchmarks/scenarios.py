@@ -0,0 +1,97 @@
+"""
+Benchmark scenarios
+
+A scenario is an async function making one operation with httpx.AsyncClient
+and returning True if it succeeded. Operations of one scenario run concurrently
+(see runner.run_scenario), every worker gets its own random generator and,
+for admin scenarios, its own session
+"""
+import random
+
+import httpx
+
+
+CUSTOMER = {
+    'name':     'Benchmark',
+    'email':    'benchmark@example.com',
+    'city':     'City',
+    'address':  'Address'
+}
+
+
+async def login(client: httpx.AsyncClient, admin: dict) -> str:
+    """
+    :param client:  HTTP client
+    :param admin:   dict with id and password
+    :return:        session token
+
+    """
+    response = await client.post('/admin-panel/login', json=admin)
+    result = response.json()
+    if result['error']:
+        raise Exception(f"Login failed: {result['details']}")
+    return result['data'][0]['token']
+
+def _session(context: dict, worker: int) -> dict:
+    # Session cookie is secure, clients don't send it over plain HTTP themselves
+    return {'Cookie': f"session_token={context['tokens'][worker]}"}
+
+
+async def catalog_page(client: httpx.AsyncClient, context: dict, worker: int, rng: random.Random) -> bool:
+    response = await client.get('/products', params={'limit': 100})
+    return response.status_code == 200
+
+async def catalog_full(client: httpx.AsyncClient, context: dict, worker: int, rng: random.Random) -> bool:
+    response = await client.get('/products')
+    return response.status_code == 200
+
+async def photo(client: httpx.AsyncClient, context: dict, worker: int, rng: random.Random) -> bool:
+    product_id = rng.choice(context['photo_product_ids'])
+    response = await client.get(f'/products/{product_id}/photo_1', params={'size': 'thumb'})
+    return response.status_code == 200
+
+async def sale(client: httpx.AsyncClient, context: dict, worker: int, rng: random.Random) -> bool:
+    product = {
+        'id':       rng.choice(context['product_ids']),
+        'name':     '',
+        'quantity': 1,
+        'price':    0,
+        'photos':   {}
+    }
+    response = await client.post('/sale', json={'data': product, 'customer': CUSTOMER})
+    return response.status_code == 200 and not response.json()['error']
+
+async def supply(client: httpx.AsyncClient, context: dict, worker: int, rng: random.Random) -> bool:
+    """
+    Whole supply flow: text, photo upload and confirmation (3 requests)
+    """
+    headers = _session(context, worker)
+    product = {
+        'id':       '',
+        'name':     f'Supplied {rng.randrange(1_000_000)}',
+        'quantity': 10,
+        'price':    rng.randint(1, 10_000),
+        'photos':   {}
+    }
+
+    for response in (
+        await client.post('/admin-panel/transfer_text', json=product, headers=headers),
+        await client.post('/admin-panel/upload_photo/photo_1', content=context['photo'],
+                          headers={**headers, 'Content-Type': 'image/jpeg'}),
+        await client.post('/admin-panel/supply', headers=headers),
+    ):
+        if response.status_code != 200 or response.json()['error']:
+            return False
+    return True
+
+
+SCENARIOS = {
+    'catalog_page': catalog_page,
+    'catalog_full': catalog_full,
+    'photo':        photo,
+    'sale':         sale,
+    'supply':       supply,
+}
+
+# Scenarios whose workers need an admin session
+ADMIN_SCENARIOS = {'supply'}
@@ -0,0 +1,97 @@
+"""
+Benchmark database
+
+Products, photos and sales are inserted directly (executemany), photos go through
+the image pipeline, so photo endpoints have thumb and medium variants to serve
+"""
+import datetime
+import io
+import random
+
+from classes import Admin
+from database import API
+from database.ids import generate_id, claim_node
+from database.pool import get_connection, transaction
+from database.schema import migrate
+import images
+
+
+ADMIN           = Admin(id='bench', password='bench')
+STOCK_QUANTITY  = 1_000_000     # enough for every sale made by benchmarks
+
+
+def make_photo(seed: int, size: int = 640) -> bytes:
+    """
+    :param seed:    number making the photo unique
+    :param size:    width and height in pixels
+    :return:        JPG image
+
+    Without Pillow the result is only a JPG signature with random bytes, which is enough
+    for the store (photos are not resized then)
+    """
+    rng = random.Random(seed)
+
+    if images.Image is None:
+        return b'\xff\xd8\xff\xe0' + rng.randbytes(size * 64)
+
+    image = images.Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(20):
+        x, y = rng.randrange(size), rng.randrange(size)
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + size // 8, y + size // 8))
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+def seed(products: int, photos: int, sales: int, rng: random.Random = None) -> dict:
+    """
+    :param products:    number of products
+    :param photos:      number of products with a photo (each one is unique)
+    :param sales:       number of sales spread over the last year
+    :param rng:         random generator (seeded one gives the same data every run)
+    :return:            dict with product_ids, photo_product_ids and admin
+
+    The database is taken from config.DATABASE_PATH and migrated first
+    """
+    rng = rng or random.Random(0)
+
+    with get_connection() as connection:
+        migrate(connection)
+    claim_node()
+
+    API.add_admin(ADMIN)
+
+    product_ids = ['PR' + generate_id() for _ in range(products)]
+
+    with get_connection() as connection:
+        with transaction(connection):
+            connection.executemany('''
+                INSERT INTO Products (id, name, price, quantity)
+                VALUES (?, ?, ?, ?)
+            ''', [(product_id, f'Product {number}', rng.randint(1, 10_000), STOCK_QUANTITY)
+                  for number, product_id in enumerate(product_ids)])
+
+    photo_product_ids = product_ids[:photos]
+    for number, product_id in enumerate(photo_product_ids):
+        photo_hash = API.store_photo(images.process_photo(make_photo(number)))
+
+        with get_connection() as connection:
+            with transaction(connection):
+                API._link_photos(connection, product_id, {'photo_1': photo_hash})
+
+    today = datetime.date.today()
+    with get_connection() as connection:
+        with transaction(connection):
+            connection.executemany('''
+                INSERT INTO Sales (id, product_id, quantity, price, user_email, city, address, operation_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [('SL' + generate_id(), rng.choice(product_ids), rng.randint(1, 5), rng.randint(1, 10_000),
+                   f'customer{rng.randrange(1000)}@example.com', 'City', 'Address',
+                   (today - datetime.timedelta(days=rng.randrange(365))).isoformat())
+                  for _ in range(sales if product_ids else 0)])
+
+    return {
+        'product_ids':          product_ids,
+        'photo_product_ids':    photo_product_ids,
+        'admin':                ADMIN
+    }
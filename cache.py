@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-memory LRU cache limited by total size of stored values in bytes
+
+    :param max_bytes:   size budget. Least recently used entries are evicted when it's exceeded
+    :param ttl:         entry lifetime in seconds (None - entries never expire)
+    :param sizeof:      function returning size of a value in bytes
+
+    The cache counts hits, misses and evictions. Values can be loaded on miss with get_or_load()
+    Every invalidation bumps cache generation, so values loaded before it are not stored
+
+    """
+    def __init__(self, max_bytes: int, ttl: float = None, sizeof=len):
+        self.max_bytes  = max_bytes
+        self.ttl        = ttl
+        self.sizeof     = sizeof
+
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+        self.size       = 0
+        self.generation = 0
+
+        self._entries   = OrderedDict()     # key -> (value, size, expires_at)
+        self._loading   = {}                # key -> future of running load
+        self._lock      = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry) -> bool:
+        return entry[2] is not None and entry[2] < time.monotonic()
+
+    def _remove(self, key):
+        value, size, expires_at = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, key, default=None):
+        """
+        :param key:     cache key
+        :param default: value returned on miss
+        :return:        cached value or default
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        :param key:     cache key
+        :param value:   value to store
+        :return:        Nothing
+
+        The function stores value and evicts least recently used entries until the cache fits
+        its budget. Values larger than the whole budget are not stored
+        """
+        size = self.sizeof(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    async def get_or_load(self, key, loader):
+        """
+        :param key:     cache key
+        :param loader:  async function loading value for the key (None - nothing to cache)
+        :return:        cached or loaded value
+
+        Concurrent misses for the same key share one load. If the loading request is cancelled
+        (e.g. its client disconnected), one of the waiting ones loads the value again
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            future = self._loading.get(key)
+            if future is None:
+                break
+
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Only the leader was cancelled, not this request
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self.generation
+        try:
+            value = await loader(key)
+            # Value is outdated if the cache was invalidated while it was loading
+            if value is not None and generation == self.generation:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except Exception as error:
+            future.set_exception(error)
+            # Mark exception as retrieved if there were no concurrent waiters
+            future.exception()
+            raise
+        finally:
+            # Leader was cancelled: waiters retry the load
+            if not future.done():
+                future.cancel()
+            del self._loading[key]
+
+    def invalidate(self, key):
+        """
+        :param key:     cache key
+        :return:        Nothing
+
+        """
+        with self._lock:
+            self.generation += 1
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """
+        :return:    dict with cache counters and current size
+
+        """
+        requests = self.hits + self.misses
+
+        return {
+            'entries':      len(self._entries),
+            'bytes':        self.size,
+            'max_bytes':    self.max_bytes,
+            'hits':         self.hits,
+            'misses':       self.misses,
+            'evictions':    self.evictions,
+            'hit_ratio':    self.hits / requests if requests else 0.0
+        }
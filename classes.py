@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Dict, List
 
+from config import BATCH_SALE_MAX_ITEMS
+
 
 # Product class
 class Product(BaseModel):
@@ -35,8 +37,20 @@ class Supply(Operation):
 class Sale(Operation):
     customer: Customer
 
+# Line of batch sale
+class SaleItem(BaseModel):
+    id:         str
+    quantity:   int
+
+# Batch sale (cart checkout) class
+class BatchSale(BaseModel):
+    customer:   Customer
+    items:      List[SaleItem] = Field(max_length=BATCH_SALE_MAX_ITEMS)
+
 
 class JSONDefaultResponse:
+    __slots__ = ('data', 'error', 'details')
+
     data:       List
     error:      bool
     details:    str
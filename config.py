@@ -1,3 +1,93 @@
+DATABASE_PATH = 'database/main.db'
 
+# Connection pool
+DATABASE_POOL_SIZE      = 8
+DATABASE_POOL_TIMEOUT   = 10    # seconds to wait for a free connection
+DATABASE_PRAGMAS        = {
+    'synchronous':  'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size':   -16000,     # 16 MB page cache per connection
+    'temp_store':   'MEMORY',
+    'mmap_size':    268435456,  # 256 MB
+}
 
-DATABASE_PATH = 'database/main.db'
\ No newline at end of file
+# Node number (0-1023) put into generated IDs. Every process writing to the database
+# should have its own one. None - every process leases a free node in the database on startup
+ID_NODE                 = None
+ID_NODE_LEASE_TTL       = 600                       # seconds a leased node stays taken without renewal
+ID_NODE_RENEW_INTERVAL  = ID_NODE_LEASE_TTL // 3    # seconds between renewals, so two may fail before the lease expires
+
+# Threads running blocking database calls for async handlers
+DATABASE_EXECUTOR_WORKERS = DATABASE_POOL_SIZE
+
+# Group commit of sales and supplies (database/writer.py): one writer task per worker
+WRITER_MAX_BATCH    = 64        # commands per transaction
+WRITER_MAX_DELAY    = 0.002     # seconds to wait for more commands after the first one, 0 - don't wait
+
+# Product photos
+PHOTO_CACHE_CONTROL     = 'public, max-age=86400'  # photos of a product never change
+PHOTO_CACHE_MAX_BYTES   = 64 * 1024 * 1024          # in-memory photo cache budget
+PHOTO_CACHE_TTL         = 3600                      # seconds, None - no expiration
+PHOTO_ORPHAN_TTL        = 24 * 3600                 # seconds an uploaded photo waits for a supply before removal
+PHOTO_SWEEP_INTERVAL    = 3600                      # seconds between removals of photos of no product
+
+# Image pipeline (images.py) for uploaded photos
+PHOTO_MAX_BYTES     = 10 * 1024 * 1024
+PHOTO_MAX_PIXELS    = 40_000_000
+PHOTO_VARIANTS      = {                 # variant -> max width and height in pixels
+    'thumb':    200,
+    'medium':   800,
+}
+PHOTO_WEBP          = True              # also store WebP copies of variants
+PHOTO_QUALITY       = 85
+IMAGE_WORKERS       = 2                 # processes resizing images
+
+# Streaming photo uploads (/admin-panel/upload_photo)
+UPLOAD_CHUNK_SIZE   = 64 * 1024
+UPLOAD_SPOOL_DIR    = None              # directory for temporary files, None - system default
+UPLOAD_FORM_BYTES   = 64 * 1024         # multipart headers and text fields allowed on top of photos
+
+# Bulk import of products (/admin-panel/import, importer.py)
+IMPORT_BATCH_SIZE   = 500               # rows validated and supplied in one transaction
+IMPORT_MAX_ROWS     = 100_000
+IMPORT_MAX_BYTES    = 256 * 1024 * 1024 # CSV/NDJSON sent as request body
+
+# Idempotency-Key of sales and supplies (idempotency.py)
+IDEMPOTENCY_TTL             = 24 * 3600         # seconds a key is remembered
+IDEMPOTENCY_MAX_BYTES       = 8 * 1024 * 1024   # responses kept in worker memory
+IDEMPOTENCY_KEY_MAX_LENGTH  = 255
+
+# Admin sessions (sessions.py)
+SESSION_BACKEND             = 'memory'      # 'memory' - one worker, 'sqlite' - shared by all workers
+SESSION_TTL                 = 1200          # seconds, also lifetime of session cookie
+SESSION_MAX_COUNT           = 10000
+SESSION_SWEEP_INTERVAL      = 60            # seconds between removals of expired sessions and drafts
+PRINCIPAL_CACHE_TTL         = 30            # seconds a worker trusts a session found in shared store
+PRINCIPAL_CACHE_MAX_BYTES   = 1024 * 1024
+
+# Admin passwords are stored as PBKDF2-SHA256 hashes (database/passwords.py)
+PASSWORD_HASH_ITERATIONS = 600_000
+
+# Drafts of supplied products (drafts.py), one per admin session
+DRAFT_BACKEND   = 'memory'      # 'memory' - one worker, 'sqlite' - shared by all workers
+DRAFT_TTL       = 1200          # seconds after the last change
+DRAFT_MAX_COUNT = 1000
+DRAFT_MAX_BYTES = 16 * 1024     # serialized draft (text fields and photo hashes)
+
+# Catalog snapshots (GET /products). Supplies and sales made by this worker rebuild them at once,
+# TTL limits how long changes made by other workers stay unseen
+CATALOG_CACHE_MAX_BYTES = 16 * 1024 * 1024
+CATALOG_CACHE_TTL       = 5
+CATALOG_MAX_PAGE_SIZE   = 500
+
+# Lines in one order of /sales/batch
+BATCH_SALE_MAX_ITEMS = 1000
+
+# Full-text search of products (GET /products/search)
+SEARCH_MAX_LIMIT = 100
+
+# Rows fetched from database at once by NDJSON exports
+EXPORT_BATCH_SIZE = 500
+
+# Analytics (database/analytics.py): max products in top sellers and stock turnover
+ANALYTICS_MAX_LIMIT = 1000
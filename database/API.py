@@ -1,80 +1,88 @@
 import sqlite3
 import base64
-import uuid
 import datetime
+import hashlib
+import json
+import re
+import time
 
 from classes import Admin, Customer, Product, JSONDefaultResponse
-from config import DATABASE_PATH
+from config import PHOTO_ORPHAN_TTL
+from database.analytics import record_sales, record_supplies
+from database.pool import get_connection, transaction, savepoint
+from database.ids import generate_id
+from database.passwords import hash_password, verify_password
+from metrics import query_timer
 
 
-def _generate_id(connection: sqlite3.Connection):
+PHOTO_SLOTS         = ('photo_1', 'photo_2', 'photo_3')
+PHOTO_CHUNK_SIZE    = 64 * 1024
+
+
+def _get_admin_password_hash(connection: sqlite3.Connection, admin_id: str) -> str:
     """
     :param connection:  SQLite3 connection with database
-    :return:            unique ID
-    """
-    sql_query_products = '''
-        SELECT COUNT (*)
-        FROM Products
-        WHERE id = ?
-    '''
-
-    sql_query_sales = '''
-        SELECT COUNT (*)
-        FROM Sales
-        WHERE id = ?
-    '''
+    :param admin_id:    admin ID
+    :return:            salted password hash of admin or None if there is no such admin
 
-    sql_query_supplies = '''
-        SELECT COUNT (*)
-        FROM Supplies
+    """
+    sql_query = '''
+        SELECT password_hash
+        FROM Admins
         WHERE id = ?
     '''
 
-    def generate():
-        return str(uuid.uuid4())[-10:].upper()
-
-    cursor = connection.cursor()
-
-    result = 1
-    generated_id = ''
-    while result:
-        generated_id = generate()
-
-        cursor.execute(sql_query_products, (generated_id, ))
-        result = int(cursor.fetchone()[0])
+    try:
+        cursor = connection.cursor()
+        with query_timer('admin'):
+            cursor.execute(sql_query, (admin_id, ))
+        row = cursor.fetchone()
 
-        cursor.execute(sql_query_sales, (generated_id, ))
-        result += int(cursor.fetchone()[0])
+        return row[0] if row else None
+    except Exception as error:
+        raise Exception('Database error: failed to check admin')
 
-        cursor.execute(sql_query_supplies, (generated_id, ))
-        result += int(cursor.fetchone()[0])
+def get_admin_password_hash(admin_id: str) -> str:
+    """
+    :param admin_id:    admin ID
+    :return:            salted password hash of admin or None if there is no such admin
 
-    return generated_id
+    """
+    with get_connection() as connection:
+        return _get_admin_password_hash(connection, admin_id)
 
 def check_admin_password(admin: Admin) -> bool:
     """
     :param admin:   admin data
-    :return:        True if admin exists and False otherwise
+    :return:        True if admin exists and the password is correct and False otherwise
+
+    """
+    return verify_password(admin.password, get_admin_password_hash(admin.id))
+
+def add_admin(admin: Admin):
+    """
+    :param admin:   new admin data
+    :return:        JSONDefaultResponse
+
+    The password is stored as salted hash
 
     """
     sql_query = '''
-        SELECT COUNT (*)
-        FROM Admins
-        WHERE id = ? AND password = ?
+        INSERT INTO Admins
+        (id, password_hash)
+        VALUES (?, ?)
     '''
 
-    admin_id        = admin.id
-    admin_password  = admin.password
+    password_hash = hash_password(admin.password)
 
-    with sqlite3.connect(DATABASE_PATH) as connection:
+    with get_connection() as connection:
         try:
-            cursor = connection.cursor()
-            cursor.execute(sql_query, (admin_id, admin_password))
-            result = bool(cursor.fetchone()[0])
+            with transaction(connection):
+                connection.execute(sql_query, (admin.id, password_hash))
 
-            return result
-        except Exception as error:
-            raise Exception('Database error: failed to check admin')
+            return JSONDefaultResponse(error=False, details=f'Admin {admin.id} successfully added').json()
+        except sqlite3.IntegrityError:
+            return JSONDefaultResponse(error=True, details=f'Admin {admin.id} already exists').json()
 
 def _get_actual_quantity(connection: sqlite3.Connection, product: Product):
 
@@ -105,27 +113,31 @@ def _update_quantity(connection: sqlite3.Connection, product: Product):
 
     The function updates product's quantity with given ID
 
+    Stock is checked and decremented by one conditional UPDATE, so concurrent sales
+    can't sell more products than there are in stock
 
     """
     sql_query = '''
         UPDATE Products
         SET quantity = quantity - ?
-        WHERE id = ?
+        WHERE id = ? AND quantity >= ?
     '''
 
     product_quantity = product.quantity if product.quantity > 0 else 0
     product_id       = product.id
 
-    if product_quantity > _get_actual_quantity(connection, product):
-        raise Exception(f'You are trying to buy too much products with ID {product_id}')
-
     try:
         cursor = connection.cursor()
-        cursor.execute(sql_query, (product_quantity, product_id))
-        connection.commit()
+        with query_timer('update_quantity'):
+            cursor.execute(sql_query, (product_quantity, product_id, product_quantity))
     except Exception:
         raise Exception('Database error: failed to update product info')
 
+    if cursor.rowcount == 0:
+        # Raises an exception if there is no such product
+        _get_actual_quantity(connection, product)
+        raise Exception(f'You are trying to buy too much products with ID {product_id}')
+
 def _insert_customer(connection: sqlite3.Connection, customer: Customer):
     """
     :param connection:      SQLite3 connection with database
@@ -148,27 +160,183 @@ def _insert_customer(connection: sqlite3.Connection, customer: Customer):
 
     try:
         cursor = connection.cursor()
-        cursor.execute(sql_query, (customer_email, customer_name))
-        connection.commit()
+        with query_timer('insert_customer'):
+            cursor.execute(sql_query, (customer_email, customer_name))
 
     except Exception:
         raise Exception('Database error: place customer error')
 
-def _insert_product(connection: sqlite3.Connection, product: Product):
+def _touch_photo(cursor: sqlite3.Cursor, photo_hash: str):
+    """
+    :param cursor:      cursor of SQLite3 connection with database
+    :param photo_hash:  hash of the photo uploaded once more
+    :return:            Nothing
+
+    Upload time of a photo of no product is refreshed, so sweep_photos doesn't remove it
+    while it waits for a supply again. Photos of products keep their time (Last-Modified)
+    """
+    sql_query = '''
+        UPDATE ProductPhotos
+        SET created_at = CURRENT_TIMESTAMP
+        WHERE hash = ? AND hash NOT IN (SELECT hash FROM ProductPhotoLinks)
+    '''
+    cursor.execute(sql_query, (photo_hash, ))
+
+def _insert_photo(connection: sqlite3.Connection, photo: bytes, media_type: str = 'image/jpeg') -> str:
+    """
+    :param connection:  SQLite3 connection with database
+    :param photo:       raw image bytes
+    :param media_type:  MIME type of the image
+    :return:            SHA-256 hash of the photo (its key in the photo store)
+
+    The function puts the photo into content-addressed store. Identical photos are stored once
+
+    In case of problems it will raise an exception
+    """
+    sql_query = '''
+        INSERT OR IGNORE INTO ProductPhotos
+        (hash, data, size, media_type)
+        VALUES (?, ?, ?, ?)
+    '''
+
+    photo_hash = hashlib.sha256(photo).hexdigest()
+
+    try:
+        cursor = connection.cursor()
+        with query_timer('insert_photo'):
+            cursor.execute(sql_query, (photo_hash, photo, len(photo), media_type))
+            if cursor.rowcount == 0:
+                _touch_photo(cursor, photo_hash)
+    except Exception:
+        raise Exception('Database error: place photo error')
+
+    return photo_hash
+
+def _insert_photo_file(connection: sqlite3.Connection, path: str, media_type: str) -> str:
+    """
+    :param connection:  SQLite3 connection with database
+    :param path:        path to image file
+    :param media_type:  MIME type of the image
+    :return:            SHA-256 hash of the photo (its key in the photo store)
+
+    The function copies the file into the photo store chunk by chunk with incremental BLOB I/O,
+    so the image is never held in memory as a whole
+
+    In case of problems it will raise an exception
+    """
+    sql_query = '''
+        INSERT OR IGNORE INTO ProductPhotos
+        (hash, data, size, media_type)
+        VALUES (?, zeroblob(?), ?, ?)
+    '''
+
+    photo_hash = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        while chunk := file.read(PHOTO_CHUNK_SIZE):
+            photo_hash.update(chunk)
+            size += len(chunk)
+    photo_hash = photo_hash.hexdigest()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql_query, (photo_hash, size, size, media_type))
+
+        # The same photo is already stored
+        if cursor.rowcount == 0:
+            _touch_photo(cursor, photo_hash)
+            return photo_hash
+
+        # Incremental BLOB I/O is available since Python 3.11
+        if hasattr(connection, 'blobopen'):
+            with connection.blobopen('ProductPhotos', 'data', cursor.lastrowid) as blob, open(path, 'rb') as file:
+                while chunk := file.read(PHOTO_CHUNK_SIZE):
+                    blob.write(chunk)
+        else:
+            with open(path, 'rb') as file:
+                cursor.execute('UPDATE ProductPhotos SET data = ? WHERE rowid = ?', (file.read(), cursor.lastrowid))
+    except Exception:
+        raise Exception('Database error: place photo error')
+
+    return photo_hash
+
+def _insert_photo_variants(connection: sqlite3.Connection, variants: dict) -> str:
+    """
+    :param connection:  SQLite3 connection with database
+    :param variants:    dict variant -> {'data': bytes, 'media_type': str}, see images.process_photo.
+                        The original may be given as {'path': str, 'media_type': str} instead
+    :return:            hash of the original photo
+
+    The function stores the original photo and all its variants
+
+    In case of problems it will raise an exception
+    """
+    sql_query = '''
+        INSERT OR IGNORE INTO ProductPhotoVariants
+        (hash, variant, variant_hash)
+        VALUES (?, ?, ?)
+    '''
+
+    original = variants['original']
+    if 'path' in original:
+        original_hash = _insert_photo_file(connection, original['path'], original['media_type'])
+    else:
+        original_hash = _insert_photo(connection, original['data'], original['media_type'])
+
+    links = []
+    for name, variant in variants.items():
+        if name != 'original':
+            links.append((original_hash, name, _insert_photo(connection, variant['data'], variant['media_type'])))
+
+    try:
+        cursor = connection.cursor()
+        with query_timer('insert_photo'):
+            cursor.executemany(sql_query, links)
+    except Exception:
+        raise Exception('Database error: place photo error')
+
+    return original_hash
+
+def _link_photos(connection: sqlite3.Connection, product_id: str, photo_hashes: dict):
+    """
+    :param connection:      SQLite3 connection with database
+    :param product_id:      product ID
+    :param photo_hashes:    dict photo_N -> hash of photo in the store
+    :return:                Nothing
+
+    In case of problems it will raise an exception
+    """
+    sql_query = '''
+        INSERT INTO ProductPhotoLinks
+        (product_id, slot, hash)
+        VALUES (?, ?, ?)
+    '''
+
+    try:
+        cursor = connection.cursor()
+        with query_timer('link_photos'):
+            cursor.executemany(sql_query, [(product_id, PHOTO_SLOTS.index(key) + 1, photo_hash)
+                                           for key, photo_hash in photo_hashes.items()])
+    except Exception:
+        raise Exception('Database error: place photo error')
+
+def _insert_product(connection: sqlite3.Connection, product: Product, photo_hashes: dict = None):
     """
     :param connection:      SQLite3 connection with database
     :param product:         product data
+    :param photo_hashes:    dict photo_N -> hash of photo already put into the photo store (see store_photo).
+                            If not given, base64 encoded product.photos are stored as they are
     :return:                Nothing
 
-    The function inserts new product into database
+    The function inserts new product into database and links its photos
 
     In case of problems the function will raise an exception
 
     """
     sql_query = '''
         INSERT INTO Products
-        (id, name, price, quantity, photo_1, photo_2, photo_3)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        (id, name, price, quantity)
+        VALUES (?, ?, ?, ?)
     '''
 
     product_id          = product.id
@@ -176,36 +344,33 @@ def _insert_product(connection: sqlite3.Connection, product: Product):
     product_price       = product.price
     product_quantity    = product.quantity
 
-
-    photo_1 = product.photos.get('photo_1')
-    photo_2 = product.photos.get('photo_2')
-    photo_3 = product.photos.get('photo_3')
-
-    if photo_1 is not None:
-        photo_1 = base64.b64decode(photo_1)
-    if photo_2 is not None:
-        photo_2 = base64.b64decode(photo_2)
-    if photo_3 is not None:
-        photo_3 = base64.b64decode(photo_3)
-
     try:
         cursor = connection.cursor()
-        cursor.execute(sql_query, (product_id, product_name,
-                                   product_price, product_quantity,
-                                   photo_1, photo_2, photo_3))
-        connection.commit()
+        with query_timer('insert_product'):
+            cursor.execute(sql_query, (product_id, product_name,
+                                       product_price, product_quantity))
 
     except Exception:
         raise Exception('Database error: place product error')
 
-def _insert_supply_operation(connection: sqlite3.Connection, product: Product, admin: Admin):
+    if photo_hashes is None:
+        photo_hashes = {}
+        for key in PHOTO_SLOTS:
+            if product.photos.get(key) is not None:
+                photo_hashes[key] = _insert_photo(connection, base64.b64decode(product.photos[key]))
+
+    _link_photos(connection, product_id, {key: photo_hash for key, photo_hash in photo_hashes.items()
+                                          if key in PHOTO_SLOTS and photo_hash is not None})
+
+def _insert_supply_operation(connection: sqlite3.Connection, product: Product, admin_id: str):
     """
     :param connection:  SQLite3 connection with database
     :param product:     product data
-    :param admin:       admin data
+    :param admin_id:    ID of admin supplier
     :return:            Nothing
 
     The function inserts new supply operation with given admin and product info
+    and adds it to the daily supplies rollup
 
     In case of problems it will raise an exception
 
@@ -216,19 +381,20 @@ def _insert_supply_operation(connection: sqlite3.Connection, product: Product, a
         VALUES (?, ?, ?, ?, ?, ?)
     '''
 
-    supply_id           = 'SP' + _generate_id(connection)
+    supply_id           = 'SP' + generate_id()
     supply_product_id   = product.id
-    supply_admin_id     = admin.id
+    supply_admin_id     = admin_id
     supply_quantity     = product.quantity
     supply_price        = product.price
     supply_date         = str(datetime.datetime.today())[:10]
 
     try:
         cursor = connection.cursor()
-        cursor.execute(sql_query, (supply_id, supply_product_id,
-                                   supply_admin_id, supply_quantity,
-                                   supply_price, supply_date))
-        connection.commit()
+        with query_timer('insert_supply'):
+            cursor.execute(sql_query, (supply_id, supply_product_id,
+                                       supply_admin_id, supply_quantity,
+                                       supply_price, supply_date))
+        record_supplies(connection, [(supply_date, supply_product_id, supply_quantity, supply_price)])
 
     except Exception:
         raise Exception('Database error: place supply operation')
@@ -243,6 +409,7 @@ def _insert_sale_operation(connection: sqlite3.Connection, product: Product, cus
     :return:            Nothing
 
     The function inserts sale operation for given customer and product info
+    and adds it to the daily sales rollup
 
     In case of problems it will raise an exception
 
@@ -253,7 +420,7 @@ def _insert_sale_operation(connection: sqlite3.Connection, product: Product, cus
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     '''
 
-    sale_id         = 'SL' + _generate_id(connection)
+    sale_id         = 'SL' + generate_id()
     sale_product_id = product.id
     sale_quantity   = product.quantity
     sale_price      = product.price
@@ -264,11 +431,12 @@ def _insert_sale_operation(connection: sqlite3.Connection, product: Product, cus
 
     try:
         cursor = connection.cursor()
-        cursor.execute(sql_query, (sale_id, sale_product_id,
-                                   sale_quantity, sale_price,
-                                   sale_user_email, sale_city,
-                                   sale_address, sale_date))
-        connection.commit()
+        with query_timer('insert_sale'):
+            cursor.execute(sql_query, (sale_id, sale_product_id,
+                                       sale_quantity, sale_price,
+                                       sale_user_email, sale_city,
+                                       sale_address, sale_date))
+        record_sales(connection, [(sale_date, sale_product_id, sale_city, sale_quantity, sale_price)])
 
     except Exception:
         raise Exception('Database error: place order operation')
@@ -276,127 +444,842 @@ def _insert_sale_operation(connection: sqlite3.Connection, product: Product, cus
     # connection.commit()
 
 
-def get_available_products():
+def _insert_sale_operations(connection: sqlite3.Connection, lines: list, customer: Customer):
     """
-    :return:    JSONDefaultResponse
+    :param connection:  SQLite3 connection with database
+    :param lines:       list of dicts with product_id, quantity and price
+    :param customer:    customer data (address and personal info)
+    :return:            list of sale IDs in the same order as lines
 
-    The function returns list of available products
+    The function inserts sale operations for all lines with one executemany call
+    and adds them to the daily sales rollup
 
     In case of problems it will raise an exception
     """
     sql_query = '''
-        SELECT id, name, price, quantity
+        INSERT INTO Sales
+        (id, product_id, quantity, price, user_email, city, address, operation_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    sale_date = str(datetime.datetime.today())[:10]
+    sale_ids  = ['SL' + generate_id() for line in lines]
+
+    try:
+        cursor = connection.cursor()
+        with query_timer('insert_sale'):
+            cursor.executemany(sql_query, [(sale_id, line['product_id'],
+                                            line['quantity'], line['price'],
+                                            customer.email, customer.city,
+                                            customer.address, sale_date)
+                                           for sale_id, line in zip(sale_ids, lines)])
+        record_sales(connection, [(sale_date, line['product_id'], customer.city, line['quantity'], line['price'])
+                                  for line in lines])
+
+    except Exception:
+        raise Exception('Database error: place order operation')
+
+    return sale_ids
+
+
+PRODUCT_FIELDS  = ('id', 'name', 'price', 'quantity')
+PRODUCT_SORTS   = ('id', 'price')
+
+
+def _encode_cursor(sort_value, product_id: str) -> str:
+    """
+    :param sort_value:  value of sort column of the last product on the page
+    :param product_id:  ID of the last product on the page
+    :return:            opaque cursor string
+
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort_value, product_id]).encode('utf-8')).decode('utf-8')
+
+def _decode_cursor(cursor: str):
+    """
+    :param cursor:  cursor returned with previous page
+    :return:        (sort value, product ID)
+
+    In case of malformed cursor it will raise ValueError
+    """
+    try:
+        sort_value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(product_id, str):
+        raise ValueError('Invalid cursor')
+    return sort_value, product_id
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """
+    :param prefix:  name prefix
+    :return:        smallest string greater than all strings starting with prefix
+
+    Range condition (name >= prefix AND name < bound) can use index on name, unlike LIKE
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def catalog_query(limit: int = None, after: tuple = None, sort: str = 'id', order: str = 'asc',
+                  min_price: int = None, max_price: int = None, name_prefix: str = None,
+                  min_quantity: int = None, fields: list = None) -> tuple:
+    """
+    :param after:   (sort value, product ID) of the last product of previous page (decoded cursor)
+    :return:        (SQL query, parameters, selected columns, returned fields) of get_available_products,
+                    see it for other parameters
+
+    Used by get_available_products and by the index check of the schema (see schema.HOT_QUERIES)
+
+    In case of invalid parameters it will raise ValueError
+    """
+    if sort not in PRODUCT_SORTS:
+        raise ValueError(f'Unknown sort field {sort}')
+    if order not in ('asc', 'desc'):
+        raise ValueError(f'Unknown sort order {order}')
+
+    fields = list(fields) if fields else list(PRODUCT_FIELDS)
+    for field in fields:
+        if field not in PRODUCT_FIELDS:
+            raise ValueError(f'Unknown field {field}')
+
+    # Sort column and ID are always selected to build the cursor
+    columns = list(fields)
+    for column in ('id', sort):
+        if column not in columns:
+            columns.append(column)
+
+    conditions = ['quantity != 0']
+    parameters = []
+
+    if min_price is not None:
+        conditions.append('price >= ?')
+        parameters.append(min_price)
+    if max_price is not None:
+        conditions.append('price <= ?')
+        parameters.append(max_price)
+    if min_quantity is not None:
+        conditions.append('quantity >= ?')
+        parameters.append(min_quantity)
+    if name_prefix:
+        conditions.append('name >= ? AND name < ?')
+        parameters.extend([name_prefix, _prefix_upper_bound(name_prefix)])
+
+    comparison = '>' if order == 'asc' else '<'
+    if after is not None:
+        sort_value, last_id = after
+        # Cursor of another sort (or forged one) would silently compare with values of other type
+        expected = str if sort == 'id' else int
+        if not isinstance(sort_value, expected) or isinstance(sort_value, bool):
+            raise ValueError('Invalid cursor')
+
+        if sort == 'id':
+            conditions.append(f'id {comparison} ?')
+            parameters.append(last_id)
+        else:
+            conditions.append(f'(price, id) {comparison} (?, ?)')
+            parameters.extend([sort_value, last_id])
+
+    order_by = 'id' if sort == 'id' else 'price, id'
+    if order == 'desc':
+        order_by = ', '.join(f'{column} DESC' for column in order_by.split(', '))
+
+    sql_query = f'''
+        SELECT {', '.join(columns)}
         FROM Products
-        WHERE quantity != 0
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order_by}
     '''
+    if limit is not None:
+        sql_query += ' LIMIT ?'
+        # One extra row tells if there is the next page
+        parameters.append(limit + 1)
+
+    return sql_query, parameters, columns, fields
+
+def get_available_products(limit: int = None, page_cursor: str = None, sort: str = 'id', order: str = 'asc',
+                           min_price: int = None, max_price: int = None, name_prefix: str = None,
+                           min_quantity: int = None, fields: list = None):
+    """
+    :param limit:           page size (None - all products)
+    :param page_cursor:     cursor returned with previous page (keyset pagination)
+    :param sort:            sort column: id or price
+    :param order:           asc or desc
+    :param min_price:       include products with price >= min_price
+    :param max_price:       include products with price <= max_price
+    :param name_prefix:     include products whose name starts with prefix (case-sensitive)
+    :param min_quantity:    include products with quantity >= min_quantity
+    :param fields:          list of fields to return (id, name, price, quantity). All by default
+    :return:                JSONDefaultResponse
+
+    The function returns list of available products
+    If limit is given the response also contains next_cursor (None on the last page)
+
+    In case of invalid parameters (sort, order, fields, cursor) it will raise ValueError,
+    database errors are returned as JSONDefaultResponse with error
+    """
+    after = _decode_cursor(page_cursor) if page_cursor is not None else None
+    sql_query, parameters, columns, fields = catalog_query(limit, after, sort, order, min_price,
+                                                           max_price, name_prefix, min_quantity, fields)
 
-    with sqlite3.connect(DATABASE_PATH) as connection:
+    with get_connection() as connection:
         try:
-            cursor = connection.cursor()
-            cursor.execute(sql_query)
+            with query_timer('catalog'):
+                cursor = connection.cursor()
+                cursor.execute(sql_query, parameters)
+                products = cursor.fetchall()
 
-            products = cursor.fetchall()
+            next_cursor = None
+            if limit is not None and len(products) > limit:
+                products = products[:limit]
+                last = dict(zip(columns, products[-1]))
+                next_cursor = _encode_cursor(last[sort], last['id'])
 
             result = JSONDefaultResponse()
             for product in products:
                 result.data.append({
-                    'id':           product[0],
-                    'name':         product[1],
-                    'price':        product[2],
-                    'quantity':     product[3]
+                    field: value for field, value in zip(columns, product) if field in fields
                 })
 
             result.error = False
             result.details = 'Executed successfully'
 
-            return result.json()
+            response = result.json()
+            if limit is not None:
+                response['next_cursor'] = next_cursor
+
+            return response
         except Exception as error:
             result = JSONDefaultResponse(data=[], error=True, details=f'Database error: {error.args[0]}')
             return result.json()
 
-def get_photos(product_id: str):
+def _match_query(query: str, prefix: bool) -> str:
+    """
+    :param query:   search text typed by user
+    :param prefix:  match the last word as beginning of a word (autocomplete)
+    :return:        FTS5 MATCH expression: all words of the query, each quoted
+                    (so FTS5 operators typed by user are searched as text), or None if there are no words
+
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def search_products(query: str, limit: int = 20, in_stock: bool = True, prefix: bool = True):
+    """
+    :param query:       search text (words of product name)
+    :param limit:       max number of products
+    :param in_stock:    return only products in stock
+    :param prefix:      match the last word as beginning of a word (autocomplete: "green te" finds "Green tea")
+    :return:            JSONDefaultResponse with products (id, name, price, quantity), the most relevant first
+
+    Products are found by ProductsSearch full-text index of names (FTS5, case and diacritics insensitive)
+    and ranked by BM25
+
+    """
+    sql_query = '''
+        SELECT Products.id, Products.name, Products.price, Products.quantity
+        FROM ProductsSearch
+        JOIN Products ON Products.search_rowid = ProductsSearch.rowid
+        WHERE ProductsSearch MATCH ? AND (? = 0 OR Products.quantity != 0)
+        ORDER BY ProductsSearch.rank, Products.id
+        LIMIT ?
+    '''
+
+    match = _match_query(query, prefix)
+    if match is None:
+        return JSONDefaultResponse(data=[], error=True, details='Query should contain letters or digits').json()
+
+    with get_connection() as connection:
+        try:
+            with query_timer('search'):
+                products = connection.execute(sql_query, (match, int(in_stock), limit)).fetchall()
+        except Exception as error:
+            return JSONDefaultResponse(data=[], error=True, details=f'Database error: {error}').json()
+
+    return JSONDefaultResponse(data=[{
+        'id':       id,
+        'name':     name,
+        'price':    price,
+        'quantity': quantity
+    } for id, name, price, quantity in products], error=False, details='Executed successfully').json()
+
+# Queries of a batch of export (keyset pagination): (keyset columns, query, query with updated_since).
+# Every query takes the keyset of the last exported row, dates of updated_since (if any) and batch size.
+# Sales and supplies are ordered by (operation_date, id), so updated_since is the start of the keyset
+# and the query seeks in the (operation_date, id) index
+EXPORT_QUERIES = {
+    'products': (
+        ('id', ),
+        '''
+            SELECT id, name, price, quantity
+            FROM Products
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''',
+        '''
+            SELECT id, name, price, quantity
+            FROM Products
+            WHERE id > ?
+            AND (EXISTS (SELECT 1 FROM Supplies WHERE product_id = Products.id AND operation_date >= ?)
+                 OR EXISTS (SELECT 1 FROM Sales WHERE product_id = Products.id AND operation_date >= ?))
+            ORDER BY id
+            LIMIT ?
+        '''
+    ),
+    'sales': (
+        ('operation_date', 'id'),
+        '''
+            SELECT id, product_id, quantity, price, user_email, city, address, operation_date
+            FROM Sales
+            WHERE (operation_date, id) > (?, ?)
+            ORDER BY operation_date, id
+            LIMIT ?
+        ''',
+        None
+    ),
+    'supplies': (
+        ('operation_date', 'id'),
+        '''
+            SELECT id, product_id, admin_id, quantity, price, operation_date
+            FROM Supplies
+            WHERE (operation_date, id) > (?, ?)
+            ORDER BY operation_date, id
+            LIMIT ?
+        ''',
+        None
+    ),
+}
+
+
+def iter_export(table: str, updated_since: str = None, batch_size: int = 500):
+    """
+    :param table:           products, sales or supplies
+    :param updated_since:   date (YYYY-MM-DD). Only rows changed since this date are exported
+    :param batch_size:      number of rows fetched from database at once
+    :return:                generator of row batches (lists of dicts)
+
+    The function reads the table batch by batch, so memory usage doesn't depend on table size.
+    For products "changed" means supplied or sold since given date, for sales and supplies
+    it is operation date. Products are ordered by ID, sales and supplies by operation date and ID
+
+    Every batch is read with its own pooled connection starting after the last exported row,
+    so no connection or read transaction is held while the client downloads the stream.
+    Rows changed during the export are exported as they are when their batch is read
+
+    In case of problems it will raise an exception
+    """
+    if table not in EXPORT_QUERIES:
+        raise Exception(f'Unknown table {table}')
+
+    keyset, sql_query, since_query = EXPORT_QUERIES[table]
+
+    last = ('', ) * len(keyset)
+    parameters = ()
+    if updated_since is not None:
+        if since_query is None:
+            # Keyset starts with operation_date
+            last = (updated_since, ) + last[1:]
+        else:
+            sql_query = since_query
+            parameters = (updated_since, ) * (since_query.count('?') - len(keyset) - 1)
+
+    while True:
+        with get_connection() as connection:
+            try:
+                with query_timer('export'):
+                    cursor = connection.execute(sql_query, last + parameters + (batch_size, ))
+                    rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+            except Exception as error:
+                raise Exception(f'Database error: failed to export {table}')
+
+        if rows:
+            yield [dict(zip(columns, row)) for row in rows]
+        if len(rows) < batch_size:
+            break
+
+        last = tuple(rows[-1][columns.index(column)] for column in keyset)
+
+def get_photos(product_id: str, size: str = 'original'):
     """
     :param product_id:  product ID
-    :return:            list of base64 UTF-8 strings
+    :param size:        photo variant: original, thumb, medium (or thumb_webp, medium_webp)
+    :return:            list of 3 photos or None if there is no product with such ID
 
-    The function gets all available photos of product from database in base64 encoding
+    The function gets all available photos of product from the photo store as they are stored
+    If the photo has no such variant (i.e. it was uploaded without image pipeline) the original is returned
+    Every photo is a dict {'data': bytes, 'hash': SHA-256 hex, 'media_type': str,
+    'created_at': 'YYYY-MM-DD HH:MM:SS'} or None if the product has no photo in this slot
 
     In case of problems it will raise an exception
     """
     sql_query = '''
-        SELECT photo_1, photo_2, photo_3
+        SELECT ProductPhotoLinks.slot, ProductPhotos.data, ProductPhotos.hash,
+               ProductPhotos.media_type, ProductPhotos.created_at
         FROM Products
-        WHERE id = ?
+        LEFT JOIN ProductPhotoLinks ON ProductPhotoLinks.product_id = Products.id
+        LEFT JOIN ProductPhotoVariants ON ProductPhotoVariants.hash = ProductPhotoLinks.hash
+                                      AND ProductPhotoVariants.variant = ?
+        LEFT JOIN ProductPhotos ON ProductPhotos.hash = COALESCE(ProductPhotoVariants.variant_hash,
+                                                                 ProductPhotoLinks.hash)
+        WHERE Products.id = ?
     '''
 
-    with sqlite3.connect(DATABASE_PATH) as connection:
+    with get_connection() as connection:
 
         try:
-            cursor = connection.cursor()
-            cursor.execute(sql_query, (product_id,))
-            photos = cursor.fetchone()
-
-            result = []
-            for photo in photos:
-                if photo is not None:
-                    photo = base64.b64encode(photo).decode('utf-8')
-                result.append(photo)
+            with query_timer('photos'):
+                cursor = connection.cursor()
+                cursor.execute(sql_query, (size, product_id))
+                rows = cursor.fetchall()
+
+            if not rows:
+                return None
+
+            result = [None] * len(PHOTO_SLOTS)
+            for slot, data, photo_hash, media_type, created_at in rows:
+                if slot is not None and data is not None:
+                    result[slot - 1] = {
+                        'data':         data,
+                        'hash':         photo_hash,
+                        'media_type':   media_type,
+                        'created_at':   created_at
+                    }
 
             return result
         except Exception as error:
             raise Exception('Database error: failed to get images')
 
 
-def supply_product(product: Product, admin: Admin):
+def store_photo(variants: dict) -> str:
+    """
+    :param variants:    photo processed by image pipeline (see images.process_photo)
+    :return:            hash of the original photo in the photo store
+
+    The function puts uploaded photo with its variants into the photo store.
+    It becomes visible when a product is supplied with this hash
+
+    In case of problems it will raise an exception
+    """
+    with get_connection() as connection:
+        with transaction(connection):
+            return _insert_photo_variants(connection, variants)
+
+def sweep_photos(max_age: int = PHOTO_ORPHAN_TTL) -> int:
+    """
+    :param max_age: seconds a photo of no product is kept (it may wait in a draft for /supply)
+    :return:        number of removed photos (originals and variants)
+
+    The function removes photos uploaded but never supplied (photos of expired drafts,
+    of failed supplies and imports) together with their variants. Only hashes are scanned
+    to find them, rows with image data are read just for the found ones
+
+    In case of problems it will raise an exception
+    """
+    sql_query_orphans = '''
+        SELECT hash
+        FROM ProductPhotos
+        WHERE hash NOT IN (SELECT hash FROM ProductPhotoLinks)
+          AND hash NOT IN (
+              SELECT variant_hash
+              FROM ProductPhotoVariants
+              JOIN ProductPhotoLinks ON ProductPhotoLinks.hash = ProductPhotoVariants.hash
+          )
+    '''
+    # Recent uploads and their variants are kept
+    sql_query_recent = '''
+        SELECT hash
+        FROM ProductPhotos
+        WHERE hash IN (SELECT value FROM json_each(?))
+          AND created_at >= datetime('now', ?)
+    '''
+    sql_query_recent_variants = '''
+        SELECT variant_hash
+        FROM ProductPhotoVariants
+        WHERE hash IN (SELECT value FROM json_each(?))
+    '''
+    sql_query_delete = '''
+        DELETE FROM ProductPhotos
+        WHERE hash IN (SELECT value FROM json_each(?))
+    '''
+    sql_query_delete_variants = '''
+        DELETE FROM ProductPhotoVariants
+        WHERE hash IN (SELECT value FROM json_each(?))
+    '''
+
+    with get_connection() as connection:
+        with transaction(connection):
+            cursor = connection.cursor()
+            with query_timer('sweep_photos'):
+                orphans = {row[0] for row in cursor.execute(sql_query_orphans)}
+                if not orphans:
+                    return 0
+
+                recent = {row[0] for row in cursor.execute(sql_query_recent,
+                                                           (json.dumps(list(orphans)), f'-{max_age} seconds'))}
+                recent |= {row[0] for row in cursor.execute(sql_query_recent_variants, (json.dumps(list(recent)), ))}
+
+                removed = json.dumps(list(orphans - recent))
+                cursor.execute(sql_query_delete_variants, (removed, ))
+                cursor.execute(sql_query_delete, (removed, ))
+                return cursor.rowcount
+
+
+def _supply_product(connection: sqlite3.Connection, product: Product, admin_id: str, photo_hashes: dict = None):
+    """
+    :param connection:      SQLite3 connection with database (in a transaction)
+    :param product:         product to supply data
+    :param admin_id:        ID of admin supplier
+    :param photo_hashes:    dict photo_N -> hash of uploaded photo
+    :return:                JSONDefaultResponse
+
+    Write command of supply_product (see apply_writes)
+
+    In case of problems it will raise an exception
+    """
+    product.id = 'PR' + generate_id()
+
+    _insert_product(connection, product, photo_hashes)
+    _insert_supply_operation(connection, product, admin_id)
+
+    return JSONDefaultResponse(
+        data={'product_id': product.id},
+        error=False,
+        details=f'Product {product.id} successfully added'
+    ).json()
+
+def _sale_product(connection: sqlite3.Connection, product: Product, customer: Customer):
     """
-    :param product:     product to supply data
-    :param admin:       admin supplier data
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param product:     product to sale data
+    :param customer:    customer data (address and contact information)
     :return:            JSONDefaultResponse
 
-    The function gets new product (name, price, quantity and photos) without ID
-    and supplies it into the database.
+    Write command of sale_product (see apply_writes)
 
-    In case of problems it will return JSONDefaultResponse with errors
+    In case of problems it will raise an exception
+    """
+    _update_quantity(connection, product)  # Update product quantity
+    _insert_customer(connection, customer)  # Insert customer if not already tracked
+    _insert_sale_operation(connection, product, customer)  # Insert sale operation
+
+    # Successful response with product and customer details
+    return JSONDefaultResponse(
+        data=[{
+            'product_id': product.id,
+            'customer_name': customer.name  # Or other relevant details
+        }],
+        error=False,
+        details=f'Product {product.id} successfully bought by {customer.name}'
+    ).json()
+
+def _sale_products(connection: sqlite3.Connection, items: list, customer: Customer):
+    """
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param items:       list of SaleItem (product ID and quantity)
+    :param customer:    customer data (address and contact information)
+    :return:            JSONDefaultResponse
 
+    Write command of sale_products (see apply_writes). If some items can't be sold
+    nothing is written and JSONDefaultResponse with errors is returned
+
+    In case of problems it will raise an exception
     """
-    with sqlite3.connect(DATABASE_PATH) as connection:
-        try:
-            if not check_admin_password(admin):
-                return JSONDefaultResponse(
-                    data=[],
-                    error=True,
-                    details='Not authorized'
-                ).json()
+    # IDs are passed as one JSON array, not a parameter per product (SQLite limits their number)
+    sql_query_products = '''
+        SELECT id, price, quantity
+        FROM Products
+        WHERE id IN (SELECT value FROM json_each(?))
+    '''
+
+    # Stock is checked again by the UPDATE itself, so the order never oversells
+    sql_query_update = '''
+        UPDATE Products
+        SET quantity = quantity - ?
+        WHERE id = ? AND quantity >= ?
+    '''
+
+    if not items:
+        return JSONDefaultResponse(data=[], error=True, details='No items to sell').json()
+
+    requested = {}
+    for item in items:
+        requested[item.id] = requested.get(item.id, 0) + item.quantity
+
+    with query_timer('batch_stock'):
+        cursor = connection.cursor()
+        cursor.execute(sql_query_products, (json.dumps(list(requested)), ))
+        stock = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    results = []
+    for item in items:
+        line = {
+            'product_id':   item.id,
+            'quantity':     item.quantity,
+            'price':        None,
+            'sale_id':      None,
+            'error':        False,
+            'details':      'OK'
+        }
+
+        if item.id not in stock:
+            line.update(error=True, details=f'No products with ID {item.id}')
+        elif item.quantity <= 0:
+            line.update(error=True, details='Quantity should be positive')
+        elif requested[item.id] > stock[item.id][1]:
+            line.update(error=True, details=f'You are trying to buy too much products with ID {item.id}')
+        else:
+            line['price'] = stock[item.id][0]
+
+        results.append(line)
+
+    if any(line['error'] for line in results):
+        return JSONDefaultResponse(data=results, error=True,
+                                   details='Order is not placed: some items are not available').json()
+
+    with query_timer('update_quantity'):
+        cursor.executemany(sql_query_update, [(quantity, product_id, quantity)
+                                              for product_id, quantity in requested.items()])
+    if cursor.rowcount != len(requested):
+        raise Exception('Products were sold out during the order, try again')
+
+    _insert_customer(connection, customer)
+    sale_ids = _insert_sale_operations(connection, results, customer)
+
+    for line, sale_id in zip(results, sale_ids):
+        line['sale_id'] = sale_id
+
+    return JSONDefaultResponse(
+        data=results,
+        error=False,
+        details=f'{len(results)} items successfully bought by {customer.name}'
+    ).json()
+
+def _import_products(connection: sqlite3.Connection, products: list, admin_id: str):
+    """
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param products:    list of dicts with name, price, quantity and photo_hashes (photo_N -> hash)
+    :param admin_id:    ID of admin supplier
+    :return:            JSONDefaultResponse with product_id of every product in the same order
+
+    Write command of import_products (see apply_writes): products, their photo links
+    and supply operations are inserted with one executemany call each
+
+    In case of problems it will raise an exception
+    """
+    sql_query_products = '''
+        INSERT INTO Products
+        (id, name, price, quantity)
+        VALUES (?, ?, ?, ?)
+    '''
+
+    sql_query_links = '''
+        INSERT INTO ProductPhotoLinks
+        (product_id, slot, hash)
+        VALUES (?, ?, ?)
+    '''
+
+    sql_query_supplies = '''
+        INSERT INTO Supplies
+        (id, product_id, admin_id, quantity, price, operation_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+
+    supply_date = str(datetime.datetime.today())[:10]
+    product_ids = ['PR' + generate_id() for product in products]
+
+    try:
+        cursor = connection.cursor()
+        with query_timer('insert_product'):
+            cursor.executemany(sql_query_products, [(product_id, product['name'], product['price'], product['quantity'])
+                                                    for product_id, product in zip(product_ids, products)])
+        with query_timer('link_photos'):
+            cursor.executemany(sql_query_links, [(product_id, PHOTO_SLOTS.index(key) + 1, photo_hash)
+                                                 for product_id, product in zip(product_ids, products)
+                                                 for key, photo_hash in product['photo_hashes'].items()
+                                                 if key in PHOTO_SLOTS and photo_hash is not None])
+        with query_timer('insert_supply'):
+            cursor.executemany(sql_query_supplies, [('SP' + generate_id(), product_id, admin_id,
+                                                     product['quantity'], product['price'], supply_date)
+                                                    for product_id, product in zip(product_ids, products)])
+        record_supplies(connection, [(supply_date, product_id, product['quantity'], product['price'])
+                                     for product_id, product in zip(product_ids, products)])
+
+    except Exception:
+        raise Exception('Database error: import products')
+
+    return JSONDefaultResponse(
+        data=[{'product_id': product_id} for product_id in product_ids],
+        error=False,
+        details=f'{len(product_ids)} products successfully added'
+    ).json()
+
+IDEMPOTENCY_CONFLICT = 'Idempotency-Key was already used with another request'
+
+def _idempotent(connection: sqlite3.Connection, key: str, fingerprint: str, expires_at: float, command: str, *args):
+    """
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param key:         idempotency key
+    :param fingerprint: hash of the request. None - the request can't be fingerprinted
+                        (e.g. its data was consumed by the first request), the key is not checked against it
+    :param expires_at:  time the key expires at
+    :param command:     write command to apply once per key (see WRITE_COMMANDS)
+    :return:            JSONDefaultResponse of the command applied with this key
+
+    Write command applying another command once: if the key is known, the saved response
+    is returned and nothing else is read or written. Otherwise the command is applied and
+    its response, if successful, is saved with the key in the same transaction
+
+    In case of problems it will raise an exception
+    """
+    sql_query_select = '''
+        SELECT fingerprint, response
+        FROM IdempotencyKeys
+        WHERE key = ? AND expires_at >= ?
+    '''
+
+    sql_query_insert = '''
+        INSERT OR REPLACE INTO IdempotencyKeys
+        (key, fingerprint, response, expires_at)
+        VALUES (?, ?, ?, ?)
+    '''
+
+    with query_timer('idempotency_key'):
+        row = connection.execute(sql_query_select, (key, time.time())).fetchone()
+
+    if row is not None:
+        if fingerprint is not None and row[0] != fingerprint:
+            return JSONDefaultResponse(data=[], error=True, details=IDEMPOTENCY_CONFLICT).json()
+        return json.loads(row[1])
+
+    result = WRITE_COMMANDS[command](connection, *args)
+    if not result['error'] and fingerprint is not None:
+        connection.execute(sql_query_insert, (key, fingerprint, json.dumps(result), expires_at))
+
+    return result
+
+def _reject(connection: sqlite3.Connection, details: str):
+    """
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param details:     error details
+    :return:            JSONDefaultResponse with the error
+
+    Write command writing nothing. Used with idempotent command for requests which can't be
+    applied, so a saved response of the key is returned instead of the error if there is one
+    """
+    return JSONDefaultResponse(data=[], error=True, details=details).json()
+
+def _error_response(error: Exception):
+    """
+    :param error:   exception raised by a write command
+    :return:        JSONDefaultResponse with error details
+
+    """
+    if isinstance(error, sqlite3.IntegrityError):
+        # Specific database issues, such as quantity constraints
+        details = f'Database integrity error: {str(error)}'
+    elif isinstance(error, sqlite3.OperationalError):
+        # Failed database operations (e.g. database is locked)
+        details = f'Operational error: {str(error)}'
+    else:
+        details = f'Unexpected error: {str(error)}'
+
+    return JSONDefaultResponse(data=[], error=True, details=details).json()
+
+def _aborts_batch(error: Exception) -> bool:
+    """
+    :param error:   exception raised by a write command
+    :return:        True if the whole transaction should be rolled back, not only the command
+
+    """
+    code = getattr(error, 'sqlite_errorcode', None)
+    # Extended result codes (e.g. SQLITE_IOERR_WRITE) keep the primary code in the lowest byte
+    return code is not None and (code & 0xff) in BATCH_ERROR_CODES
+
+
+# Errors of the database itself (locked, I/O error, disk is full) failing every command of a group commit.
+# Other errors (constraints, too many SQL variables, ...) fail only their command
+BATCH_ERROR_CODES = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_IOERR, sqlite3.SQLITE_FULL)
+
+# Write commands which can be queued for group commit (see database.writer)
+WRITE_COMMANDS = {
+    'supply_product':   _supply_product,
+    'sale_product':     _sale_product,
+    'sale_products':    _sale_products,
+    'import_products':  _import_products,
+    'idempotent':       _idempotent,
+    'reject':           _reject,
+}
+
 
-            product.id = 'PR' + _generate_id(connection)
+def apply_write(command: str, *args):
+    """
+    :param command:     name of write command (see WRITE_COMMANDS)
+    :return:            JSONDefaultResponse of the command
+
+    The function applies one write command in its own transaction
 
-            with connection:
-                _insert_product(connection, product)
-                _insert_supply_operation(connection, product, admin)
+    In case of problems it will return JSONDefaultResponse with errors
+    """
+    with get_connection() as connection:
+        try:
+            with transaction(connection):
+                return WRITE_COMMANDS[command](connection, *args)
+        except Exception as error:
+            return _error_response(error)
 
-            return JSONDefaultResponse(
-                data={'product_id': product.id},
-                error=False,
-                details=f'Product {product.id} successfully added'
-            ).json()
+def apply_writes(commands: list) -> list:
+    """
+    :param commands:    list of (command name, args) (see WRITE_COMMANDS)
+    :return:            list of JSONDefaultResponse in the same order as commands
 
-        except sqlite3.IntegrityError as integrity_error:
+    The function applies all commands in one transaction (group commit), every command
+    in its own savepoint: a failed command is rolled back alone and gets its error response,
+    others are committed together. Only errors of the database itself (see BATCH_ERROR_CODES)
+    or a failed commit abort the transaction: then nothing is written and every command gets the error
 
-            return JSONDefaultResponse(
-                data=[],
-                error=True,
-                details=f"Database integrity error: {str(integrity_error)}"
-            ).json()
+    """
+    results = []
 
+    with get_connection() as connection:
+        try:
+            with transaction(connection):
+                for command, args in commands:
+                    try:
+                        with savepoint(connection):
+                            results.append(WRITE_COMMANDS[command](connection, *args))
+                    except Exception as error:
+                        if _aborts_batch(error):
+                            # Database is locked, broken or full, no sense to continue
+                            raise
+                        results.append(_error_response(error))
         except Exception as error:
+            return [_error_response(error)] * len(commands)
+
+    return results
 
-            return JSONDefaultResponse(
-                data=[],
-                error=True,
-                details=f"Unexpected error: {str(error)}"
-            ).json()
 
+def supply_product(product: Product, admin_id: str, photo_hashes: dict = None):
+    """
+    :param product:         product to supply data
+    :param admin_id:        ID of admin supplier. The admin should be already authorized
+                            (i.e. have a valid session), the password is not checked again
+    :param photo_hashes:    dict photo_N -> hash of uploaded photo (see store_photo)
+    :return:                JSONDefaultResponse
+
+    The function gets new product (name, price, quantity and photos) without ID
+    and supplies it into the database.
+
+    In case of problems it will return JSONDefaultResponse with errors
 
+    """
+    return apply_write('supply_product', product, admin_id, photo_hashes)
 
 def sale_product(product: Product, customer: Customer):
     """
@@ -410,44 +1293,36 @@ def sale_product(product: Product, customer: Customer):
     In case of problems it will return JSONDefaultResponse with errors
 
     """
-    with sqlite3.connect(DATABASE_PATH) as connection:
-        try:
-            # Use a transaction to ensure atomicity of operations
-            with connection:
-                _update_quantity(connection, product)  # Update product quantity
-                _insert_customer(connection, customer)  # Insert customer if not already tracked
-                _insert_sale_operation(connection, product, customer)  # Insert sale operation
-
-            # Successful response with product and customer details
-            return JSONDefaultResponse(
-                data=[{
-                    'product_id': product.id,
-                    'customer_name': customer.name  # Or other relevant details
-                }],
-                error=False,
-                details=f'Product {product.id} successfully bought by {customer.name}'
-            ).json()
-
-        except sqlite3.IntegrityError as integrity_error:
-            # Handle specific database issues, such as quantity constraints
-            return JSONDefaultResponse(
-                data=[],
-                error=True,
-                details=f"Database integrity error: {str(integrity_error)}"
-            ).json()
-
-        except sqlite3.OperationalError as operational_error:
-            # Handle operational errors, such as failed database operations
-            return JSONDefaultResponse(
-                data=[],
-                error=True,
-                details=f"Operational error: {str(operational_error)}"
-            ).json()
+    return apply_write('sale_product', product, customer)
 
-        except Exception as error:
-            # General exception handler for unexpected issues
-            return JSONDefaultResponse(
-                data=[],
-                error=True,
-                details=f"Unexpected error: {str(error)}"
-            ).json()
+def sale_products(items: list, customer: Customer):
+    """
+    :param items:       list of SaleItem (product ID and quantity)
+    :param customer:    customer data (address and contact information)
+    :return:            JSONDefaultResponse
+
+    The function sells all items to the customer in one transaction: either every line
+    is sold or nothing is changed. Lines with the same product are summed up.
+    Prices are taken from the catalog
+
+    Data contains result for every line: product_id, quantity, price, sale_id (on success)
+    and error details (if the line can't be sold)
+
+    In case of problems it will return JSONDefaultResponse with errors
+
+    """
+    return apply_write('sale_products', items, customer)
+
+def import_products(products: list, admin_id: str):
+    """
+    :param products:    list of dicts with name, price, quantity and photo_hashes (photo_N -> hash)
+    :param admin_id:    ID of admin supplier. The admin should be already authorized
+    :return:            JSONDefaultResponse with product_id of every product
+
+    The function supplies all products in one transaction: either all of them are added
+    or none. Large deliveries should be split into batches (see importer.py)
+
+    In case of problems it will return JSONDefaultResponse with errors
+
+    """
+    return apply_write('import_products', products, admin_id)
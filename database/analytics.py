@@ -0,0 +1,236 @@
+"""
+Sales and supply analytics
+
+Every sale and supply is added to daily rollup tables (SalesDaily, SuppliesDaily) in the same
+transaction, so analytics read a row per day and product instead of the whole history.
+Rollups can be rebuilt from Sales and Supplies with `python -m database.analytics`
+"""
+import sqlite3
+
+from classes import JSONDefaultResponse
+from database.pool import get_connection, transaction
+from metrics import query_timer
+
+
+REVENUE_GROUPS  = ('day', 'product', 'city')
+TOP_SELLERS_BY  = ('revenue', 'units')
+
+FIRST_DAY       = '0000-01-01'
+LAST_DAY        = '9999-12-31'
+
+
+def record_sales(connection: sqlite3.Connection, rows: list):
+    """
+    :param connection:  SQLite3 connection with database
+    :param rows:        list of (day, product_id, city, quantity, price) of new sales
+    :return:            Nothing
+
+    Should be called in the transaction inserting the sales
+    """
+    sql_query = '''
+        INSERT INTO SalesDaily
+        (day, product_id, city, units, revenue, sales)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT (day, product_id, city) DO UPDATE
+        SET units   = units + excluded.units,
+            revenue = revenue + excluded.revenue,
+            sales   = sales + 1
+    '''
+
+    with query_timer('rollup_sales'):
+        connection.executemany(sql_query, [(day, product_id, city or '', quantity, quantity * price)
+                                           for day, product_id, city, quantity, price in rows])
+
+def record_supplies(connection: sqlite3.Connection, rows: list):
+    """
+    :param connection:  SQLite3 connection with database
+    :param rows:        list of (day, product_id, quantity, price) of new supplies
+    :return:            Nothing
+
+    Should be called in the transaction inserting the supplies
+    """
+    sql_query = '''
+        INSERT INTO SuppliesDaily
+        (day, product_id, units, cost, supplies)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (day, product_id) DO UPDATE
+        SET units       = units + excluded.units,
+            cost        = cost + excluded.cost,
+            supplies    = supplies + 1
+    '''
+
+    with query_timer('rollup_supplies'):
+        connection.executemany(sql_query, [(day, product_id, quantity, quantity * price)
+                                           for day, product_id, quantity, price in rows])
+
+def rebuild_rollups(connection: sqlite3.Connection) -> dict:
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            dict with numbers of rollup rows
+
+    The function recalculates rollup tables from the whole Sales and Supplies history.
+    Should be called in a transaction (migration or backfill), so new sales wait for it
+    """
+    connection.execute('DELETE FROM SalesDaily')
+    connection.execute('''
+        INSERT INTO SalesDaily (day, product_id, city, units, revenue, sales)
+        SELECT operation_date, product_id, COALESCE(city, ''), SUM(quantity), SUM(quantity * price), COUNT(*)
+        FROM Sales
+        GROUP BY operation_date, product_id, COALESCE(city, '')
+    ''')
+
+    connection.execute('DELETE FROM SuppliesDaily')
+    connection.execute('''
+        INSERT INTO SuppliesDaily (day, product_id, units, cost, supplies)
+        SELECT operation_date, product_id, SUM(quantity), SUM(quantity * price), COUNT(*)
+        FROM Supplies
+        GROUP BY operation_date, product_id
+    ''')
+
+    return {
+        'SalesDaily':       connection.execute('SELECT COUNT(*) FROM SalesDaily').fetchone()[0],
+        'SuppliesDaily':    connection.execute('SELECT COUNT(*) FROM SuppliesDaily').fetchone()[0],
+    }
+
+
+def get_revenue(group_by: str = 'day', date_from: str = None, date_to: str = None):
+    """
+    :param group_by:    day, product or city
+    :param date_from:   first day (YYYY-MM-DD), None - since the first sale
+    :param date_to:     last day (YYYY-MM-DD), None - till today
+    :return:            JSONDefaultResponse with list of {key, units, revenue, sales}
+
+    """
+    if group_by not in REVENUE_GROUPS:
+        return JSONDefaultResponse(data=[], error=True,
+                                   details=f"group_by should be one of: {', '.join(REVENUE_GROUPS)}").json()
+
+    column = {'day': 'day', 'product': 'product_id', 'city': 'city'}[group_by]
+    order = 'key' if group_by == 'day' else 'revenue DESC, key'
+
+    sql_query = f'''
+        SELECT {column} AS key, SUM(units), SUM(revenue) AS revenue, SUM(sales)
+        FROM SalesDaily
+        WHERE day >= ? AND day <= ?
+        GROUP BY key
+        ORDER BY {order}
+    '''
+
+    with get_connection() as connection:
+        try:
+            with query_timer('analytics_revenue'):
+                rows = connection.execute(sql_query, (date_from or FIRST_DAY, date_to or LAST_DAY)).fetchall()
+        except Exception as error:
+            return JSONDefaultResponse(data=[], error=True, details=f'Database error: {error}').json()
+
+    return JSONDefaultResponse(data=[{
+        group_by:   key,
+        'units':    units,
+        'revenue':  revenue,
+        'sales':    sales
+    } for key, units, revenue, sales in rows], error=False, details='Executed successfully').json()
+
+def get_top_sellers(date_from: str = None, date_to: str = None, by: str = 'revenue', limit: int = 10):
+    """
+    :param date_from:   first day (YYYY-MM-DD), None - since the first sale
+    :param date_to:     last day (YYYY-MM-DD), None - till today
+    :param by:          revenue or units
+    :param limit:       number of products
+    :return:            JSONDefaultResponse with list of {product_id, name, units, revenue}
+
+    """
+    if by not in TOP_SELLERS_BY:
+        return JSONDefaultResponse(data=[], error=True,
+                                   details=f"by should be one of: {', '.join(TOP_SELLERS_BY)}").json()
+
+    sql_query = f'''
+        SELECT SalesDaily.product_id, Products.name, SUM(units) AS units, SUM(revenue) AS revenue
+        FROM SalesDaily
+        LEFT JOIN Products ON Products.id = SalesDaily.product_id
+        WHERE day >= ? AND day <= ?
+        GROUP BY SalesDaily.product_id
+        ORDER BY {by} DESC, SalesDaily.product_id
+        LIMIT ?
+    '''
+
+    with get_connection() as connection:
+        try:
+            with query_timer('analytics_top_sellers'):
+                rows = connection.execute(sql_query, (date_from or FIRST_DAY, date_to or LAST_DAY, limit)).fetchall()
+        except Exception as error:
+            return JSONDefaultResponse(data=[], error=True, details=f'Database error: {error}').json()
+
+    return JSONDefaultResponse(data=[{
+        'product_id':   product_id,
+        'name':         name,
+        'units':        units,
+        'revenue':      revenue
+    } for product_id, name, units, revenue in rows], error=False, details='Executed successfully').json()
+
+def get_stock_turnover(date_from: str = None, date_to: str = None, limit: int = 100):
+    """
+    :param date_from:   first day (YYYY-MM-DD), None - since the first sale
+    :param date_to:     last day (YYYY-MM-DD), None - till today
+    :param limit:       number of products
+    :return:            JSONDefaultResponse with list of {product_id, name, sold, supplied, stock, turnover}
+
+    Turnover is units sold divided by average stock of the period. Average stock is the mean
+    of opening stock (current stock + sold - supplied) and current stock, so for periods
+    not ending today it is an estimate. Products with the highest turnover go first
+    """
+    sql_query = '''
+        WITH Sold AS (
+            SELECT product_id, SUM(units) AS units
+            FROM SalesDaily
+            WHERE day >= ? AND day <= ?
+            GROUP BY product_id
+        ), Supplied AS (
+            SELECT product_id, SUM(units) AS units
+            FROM SuppliesDaily
+            WHERE day >= ? AND day <= ?
+            GROUP BY product_id
+        ), Moved AS (
+            SELECT product_id FROM Sold
+            UNION
+            SELECT product_id FROM Supplied
+        )
+        SELECT Moved.product_id, Products.name, COALESCE(Sold.units, 0), COALESCE(Supplied.units, 0),
+               COALESCE(Products.quantity, 0)
+        FROM Moved
+        LEFT JOIN Products ON Products.id = Moved.product_id
+        LEFT JOIN Sold ON Sold.product_id = Moved.product_id
+        LEFT JOIN Supplied ON Supplied.product_id = Moved.product_id
+    '''
+
+    period = (date_from or FIRST_DAY, date_to or LAST_DAY)
+
+    with get_connection() as connection:
+        try:
+            with query_timer('analytics_turnover'):
+                rows = connection.execute(sql_query, period + period).fetchall()
+        except Exception as error:
+            return JSONDefaultResponse(data=[], error=True, details=f'Database error: {error}').json()
+
+    result = []
+    for product_id, name, sold, supplied, stock in rows:
+        average_stock = stock + (sold - supplied) / 2
+        result.append({
+            'product_id':   product_id,
+            'name':         name,
+            'sold':         sold,
+            'supplied':     supplied,
+            'stock':        stock,
+            'turnover':     round(sold / average_stock, 4) if average_stock > 0 else None
+        })
+
+    result.sort(key=lambda line: (line['turnover'] is None, -(line['turnover'] or 0), line['product_id']))
+
+    return JSONDefaultResponse(data=result[:limit], error=False, details='Executed successfully').json()
+
+
+if __name__ == '__main__':
+    with get_connection() as connection:
+        with transaction(connection):
+            counts = rebuild_rollups(connection)
+
+    print('Rollups rebuilt: ' + ', '.join(f'{table} {count} rows' for table, count in counts.items()))
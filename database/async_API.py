@@ -0,0 +1,162 @@
+"""
+Async mirror of database/API.py
+
+Every function runs its synchronous counterpart on a dedicated bounded thread pool,
+so blocking SQLite work never stalls the event loop. The executor size matches the
+connection pool size, so worker threads do not wait for connections.
+Sales and supplies are queued to the group commit writer (see database/writer.py)
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from classes import Admin, Customer, Product
+from config import DATABASE_EXECUTOR_WORKERS, WRITER_MAX_BATCH, WRITER_MAX_DELAY
+from database import API, analytics
+from database.passwords import verify_password
+from database.writer import GroupCommitWriter
+
+
+_executor: ThreadPoolExecutor = None
+_writer: GroupCommitWriter = None
+
+
+def init_executor() -> ThreadPoolExecutor:
+    """
+    :return:    database executor
+
+    The function creates the database executor. It is called on app startup
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DATABASE_EXECUTOR_WORKERS,
+                                       thread_name_prefix='database')
+    return _executor
+
+def close_executor():
+    """
+    :return:    Nothing
+
+    The function waits for running queries and shuts the executor down. It is called on app shutdown
+    """
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+def init_writer() -> GroupCommitWriter:
+    """
+    :return:    writer task of sales and supplies
+
+    The function starts the group commit writer. It is called on app startup (in the event loop)
+    """
+    global _writer
+
+    if _writer is None:
+        _writer = GroupCommitWriter(functools.partial(run, API.apply_writes), WRITER_MAX_BATCH, WRITER_MAX_DELAY)
+        _writer.start()
+    return _writer
+
+async def close_writer():
+    """
+    :return:    Nothing
+
+    The function applies queued writes and stops the writer. It is called on app shutdown
+    """
+    global _writer
+
+    if _writer is not None:
+        await _writer.stop()
+        _writer = None
+
+async def write(command: str, *args):
+    """
+    :param command:     write command name (see API.WRITE_COMMANDS)
+    :return:            JSONDefaultResponse of the command
+
+    The command is queued to the writer. Without writer (i.e. API is used outside of the app)
+    it is applied in its own transaction
+    """
+    if _writer is None:
+        return await run(API.apply_write, command, *args)
+    return await _writer.submit(command, *args)
+
+async def run(function, *args, **kwargs):
+    """
+    :param function:    blocking function to call
+    :return:            function result
+
+    The function runs given blocking function on the database executor
+    """
+    executor = _executor if _executor is not None else init_executor()
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+async def check_admin_password(admin: Admin) -> bool:
+    """
+    :param admin:   admin data
+    :return:        True if admin exists and the password is correct and False otherwise
+
+    The hash is read on the database executor and verified on the default thread pool,
+    so slow hashing doesn't hold a database connection
+    """
+    password_hash = await run(API.get_admin_password_hash, admin.id)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, verify_password, admin.password, password_hash)
+
+async def get_available_products(**filters):
+    return await run(API.get_available_products, **filters)
+
+async def search_products(query: str, limit: int = 20, in_stock: bool = True, prefix: bool = True):
+    return await run(API.search_products, query, limit, in_stock, prefix)
+
+async def get_photos(product_id: str, size: str = 'original'):
+    return await run(API.get_photos, product_id, size)
+
+async def store_photo(variants: dict) -> str:
+    return await run(API.store_photo, variants)
+
+async def sweep_photos() -> int:
+    return await run(API.sweep_photos)
+
+async def supply_product(product: Product, admin_id: str, photo_hashes: dict = None):
+    return await write('supply_product', product, admin_id, photo_hashes)
+
+async def sale_product(product: Product, customer: Customer):
+    return await write('sale_product', product, customer)
+
+async def sale_products(items: list, customer: Customer):
+    return await write('sale_products', items, customer)
+
+async def import_products(products: list, admin_id: str):
+    return await write('import_products', products, admin_id)
+
+async def get_revenue(group_by: str = 'day', date_from: str = None, date_to: str = None):
+    return await run(analytics.get_revenue, group_by, date_from, date_to)
+
+async def get_top_sellers(date_from: str = None, date_to: str = None, by: str = 'revenue', limit: int = 10):
+    return await run(analytics.get_top_sellers, date_from, date_to, by, limit)
+
+async def get_stock_turnover(date_from: str = None, date_to: str = None, limit: int = 100):
+    return await run(analytics.get_stock_turnover, date_from, date_to, limit)
+
+async def iter_export(table: str, updated_since: str = None, batch_size: int = 500):
+    """
+    :return:    async generator of row batches, see API.iter_export
+
+    Every batch is fetched on the database executor
+    """
+    batches = API.iter_export(table, updated_since, batch_size)
+    try:
+        while True:
+            batch = await run(next, batches, None)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        await run(batches.close)
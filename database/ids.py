@@ -0,0 +1,229 @@
+"""
+Time-ordered unique IDs (Snowflake-style)
+
+64-bit number: 42 bits of milliseconds since EPOCH_MS, 10 bits of node (worker) number
+and 12 bits of sequence inside a millisecond, written as 13 characters of Crockford's base32.
+IDs generated later are greater, so new rows go to the end of B-tree indexes
+
+Every process writing to the database needs its own node. Unless ID_NODE is set, the process
+leases a free one in IdNodes table once on startup (claim_node), renews the lease with
+its own task (renew_node) and releases it on shutdown. Nodes of crashed processes are freed
+when their lease expires
+"""
+import os
+import secrets
+import socket
+import threading
+import time
+
+from config import ID_NODE, ID_NODE_LEASE_TTL
+from database.pool import get_connection, transaction
+
+
+EPOCH_MS        = 1704067200000     # 2024-01-01 00:00:00 UTC
+NODE_BITS       = 10
+SEQUENCE_BITS   = 12
+ALPHABET        = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ID_LENGTH       = 13
+
+
+class IDGenerator:
+    """
+    Thread-safe generator of time-ordered IDs
+
+    :param node:    node number (0-1023). Every process writing to the same database
+                    should have its own number. None - set later with set_node
+
+    """
+    def __init__(self, node: int = None):
+        self._pid       = None
+        self._node      = None
+        self._last_ms   = -1
+        self._sequence  = 0
+        self._lock      = threading.Lock()
+
+        if node is not None:
+            self.set_node(node)
+
+    @property
+    def node(self) -> int:
+        """
+        :return:    node number of this process, None if it is not set
+
+        """
+        return self._node if self._pid == os.getpid() else None
+
+    def set_node(self, node: int):
+        """
+        :param node:    node number (0-1023) of this process, None - no node
+        :return:        Nothing
+
+        In case of invalid number it will raise ValueError
+        """
+        if node is not None and not 0 <= node < (1 << NODE_BITS):
+            raise ValueError(f'ID node should be 0-{(1 << NODE_BITS) - 1}')
+
+        with self._lock:
+            self._pid = os.getpid()
+            self._node = node
+
+    def next(self) -> int:
+        """
+        :return:    new unique 64-bit ID
+
+        If clock goes backwards or the sequence of a millisecond is exhausted, the generator
+        moves on to the next millisecond itself instead of waiting for the clock
+
+        In case of node not set in this process it will raise an exception
+        """
+        with self._lock:
+            # A forked process doesn't inherit the node of its parent
+            if self._node is None or self._pid != os.getpid():
+                raise Exception('Database error: ID node is not claimed by this process (see claim_node)')
+
+            now_ms = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) % (1 << SEQUENCE_BITS)
+                if self._sequence == 0:
+                    now_ms += 1
+            else:
+                self._sequence = 0
+
+            self._last_ms = now_ms
+
+            return (now_ms << (NODE_BITS + SEQUENCE_BITS)) | (self._node << SEQUENCE_BITS) | self._sequence
+
+
+def encode(number: int) -> str:
+    """
+    :param number:  64-bit ID
+    :return:        fixed length base32 string, ordered the same way as numbers
+
+    """
+    characters = []
+    for _ in range(ID_LENGTH):
+        characters.append(ALPHABET[number & 31])
+        number >>= 5
+    return ''.join(reversed(characters))
+
+
+_generator  = IDGenerator(ID_NODE)
+_owner      = None  # owner of the node lease taken by this process
+
+
+def _lease_node() -> tuple:
+    """
+    :return:    (node, owner) of the lowest free node, leased for ID_NODE_LEASE_TTL seconds
+
+    Expired leases (of crashed processes) are removed first
+
+    In case of no free nodes it will raise an exception
+    """
+    sql_query_select = '''
+        SELECT node
+        FROM IdNodes
+        ORDER BY node
+    '''
+    sql_query_insert = '''
+        INSERT INTO IdNodes
+        (node, owner, expires_at)
+        VALUES (?, ?, ?)
+    '''
+
+    owner = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(8)}'
+    now = time.time()
+
+    with get_connection() as connection:
+        with transaction(connection):
+            connection.execute('DELETE FROM IdNodes WHERE expires_at < ?', (now, ))
+            taken = {row[0] for row in connection.execute(sql_query_select)}
+
+            node = next((node for node in range(1 << NODE_BITS) if node not in taken), None)
+            if node is None:
+                raise Exception('Database error: all ID nodes are taken')
+
+            connection.execute(sql_query_insert, (node, owner, now + ID_NODE_LEASE_TTL))
+
+    return node, owner
+
+def claim_node() -> int:
+    """
+    :return:    node number of this process
+
+    The function leases the lowest free node in IdNodes table for ID_NODE_LEASE_TTL seconds.
+    It is called once on app startup (and by scripts generating IDs), further calls of
+    the same process return its node. With ID_NODE set that node is used without a lease
+
+    In case of no free nodes it will raise an exception
+    """
+    global _owner
+
+    if ID_NODE is not None:
+        _generator.set_node(ID_NODE)
+        return ID_NODE
+
+    if _generator.node is not None:
+        return _generator.node
+
+    node, _owner = _lease_node()
+    _generator.set_node(node)
+    return node
+
+def renew_node():
+    """
+    :return:    Nothing
+
+    The function extends the lease of the node of this process in place. It is called by
+    the lease task of the app every ID_NODE_RENEW_INTERVAL seconds.
+    Only if the lease is lost (e.g. the process was stopped for longer than ID_NODE_LEASE_TTL
+    and another process took the node) the process switches to a newly leased node.
+    The node is replaced at once, so IDs generated meanwhile never fail
+    """
+    global _owner
+
+    node = _generator.node
+    if _owner is None or node is None:
+        return
+
+    sql_query_update = '''
+        UPDATE IdNodes
+        SET expires_at = ?
+        WHERE node = ? AND owner = ?
+    '''
+
+    expires_at = time.time() + ID_NODE_LEASE_TTL
+
+    with get_connection() as connection:
+        with transaction(connection):
+            renewed = connection.execute(sql_query_update, (expires_at, node, _owner)).rowcount
+
+    if not renewed:
+        node, _owner = _lease_node()
+        _generator.set_node(node)
+
+def release_node():
+    """
+    :return:    Nothing
+
+    The function frees the node of this process. It is called on app shutdown
+    """
+    global _owner
+
+    node = _generator.node
+    if _owner is None or node is None:
+        return
+
+    with get_connection() as connection:
+        with transaction(connection):
+            connection.execute('DELETE FROM IdNodes WHERE node = ? AND owner = ?', (node, _owner))
+
+    _owner = None
+    _generator.set_node(None)
+
+def generate_id() -> str:
+    """
+    :return:    unique time-ordered ID (13 characters)
+
+    """
+    return encode(_generator.next())
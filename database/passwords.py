@@ -0,0 +1,74 @@
+"""
+Salted password hashes of admins
+
+Hashes are PBKDF2-HMAC-SHA256 with random 16-byte salt, written as
+pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>. Hashing is deliberately slow (CPU-bound),
+so async code verifies passwords in a thread pool (see async_API.check_admin_password)
+
+New admin can be added with `python -m database.passwords`
+"""
+import hashlib
+import hmac
+import os
+
+from config import PASSWORD_HASH_ITERATIONS
+
+
+ALGORITHM   = 'pbkdf2_sha256'
+SALT_BYTES  = 16
+
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """
+    :param password:    plain password
+    :param iterations:  PBKDF2 iterations
+    :return:            salted hash to store in the database
+
+    """
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+    return f'{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}'
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    :param password:        plain password
+    :param password_hash:   stored hash (see hash_password). None - unknown admin
+    :return:                True if the password matches
+
+    For an unknown admin a dummy hash is computed anyway, so the response time
+    doesn't tell whether the admin exists
+    """
+    if password_hash is None:
+        hash_password(password)
+        return False
+
+    try:
+        algorithm, iterations, salt, digest = password_hash.split('$')
+        if algorithm != ALGORITHM:
+            return False
+        expected = bytes.fromhex(digest)
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(actual, expected)
+
+def is_hash(value: str) -> bool:
+    """
+    :param value:   stored password
+    :return:        True if the value is already a hash (not a plain password)
+
+    """
+    return value.startswith(ALGORITHM + '$')
+
+
+if __name__ == '__main__':
+    import getpass
+
+    from classes import Admin
+    from database.API import add_admin
+
+    admin_id = input('Admin ID: ')
+    password = getpass.getpass('Password: ')
+    print(add_admin(Admin(id=admin_id, password=password)))
@@ -0,0 +1,228 @@
+import sqlite3
+import queue
+import threading
+from contextlib import contextmanager
+
+from config import DATABASE_PATH, DATABASE_POOL_SIZE, DATABASE_POOL_TIMEOUT, DATABASE_PRAGMAS
+import metrics
+
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections
+
+    Connections are opened lazily (up to max_size) and configured once at open time
+    (WAL journal mode and tuned pragmas). Callers check a connection out with
+    pool.connection() and it is returned to the pool when the block ends.
+
+    """
+    def __init__(self, database_path: str, max_size: int, timeout: float = None, pragmas: dict = None):
+        self.database_path  = database_path
+        self.max_size       = max_size
+        self.timeout        = timeout
+        self.pragmas        = pragmas or {}
+
+        self._idle      = queue.LifoQueue(maxsize=max_size)
+        self._lock      = threading.Lock()
+        self._opened    = 0
+        self._closed    = False
+
+    def _open(self) -> sqlite3.Connection:
+        """
+        :return:    new configured SQLite3 connection
+
+        """
+        connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        metrics.connections_opened.inc()
+
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        for pragma, value in self.pragmas.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        cursor.close()
+
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        :return:    connection checked out from the pool
+
+        The function reuses an idle connection if there is one, opens a new one if the pool
+        is not full yet and waits for a free connection otherwise
+
+        In case of timeout it will raise an exception
+        """
+        if self._closed:
+            raise Exception('Database error: connection pool is closed')
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.max_size
+            if can_open:
+                self._opened += 1
+
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception('Database error: no free connections in the pool')
+
+    def release(self, connection: sqlite3.Connection):
+        """
+        :param connection:  connection previously returned by acquire()
+        :return:            Nothing
+
+        The function rolls back any unfinished transaction and puts the connection back
+        """
+        if connection.in_transaction:
+            connection.rollback()
+
+        if self._closed:
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+            return
+
+        self._idle.put_nowait(connection)
+
+    def stats(self) -> dict:
+        """
+        :return:    dict with numbers of open, idle and checked out connections
+
+        """
+        idle = self._idle.qsize()
+
+        return {
+            'open':     self._opened,
+            'idle':     idle,
+            'in_use':   self._opened - idle,
+        }
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """
+        :return:    Nothing
+
+        The function closes all idle connections. Connections that are checked out
+        at the moment are closed when they are released
+        """
+        self._closed = True
+
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool() -> ConnectionPool:
+    """
+    :return:    application connection pool
+
+    The function creates the application-wide pool. It is called on app startup
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DATABASE_PATH, DATABASE_POOL_SIZE,
+                                   timeout=DATABASE_POOL_TIMEOUT,
+                                   pragmas=DATABASE_PRAGMAS)
+        return _pool
+
+def close_pool():
+    """
+    :return:    Nothing
+
+    The function closes the application-wide pool. It is called on app shutdown
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_connection():
+    """
+    :return:    context manager with pooled SQLite3 connection
+
+    If the pool has not been created yet (i.e. API is used outside of the app)
+    it will be created on first use
+    """
+    pool = _pool if _pool is not None else init_pool()
+    return pool.connection()
+
+def pool_stats() -> dict:
+    """
+    :return:    stats of the application-wide pool (see ConnectionPool.stats), empty if there is no pool
+
+    """
+    pool = _pool
+    return pool.stats() if pool is not None else {}
+
+@contextmanager
+def transaction(connection: sqlite3.Connection):
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            context manager
+
+    The function starts write transaction with BEGIN IMMEDIATE: the write lock is taken at once,
+    so data read inside the block can't be changed by other connections until commit.
+    The transaction is committed when the block ends or rolled back in case of exception
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    else:
+        with metrics.query_timer('commit'):
+            connection.commit()
+
+@contextmanager
+def savepoint(connection: sqlite3.Connection, name: str = 'command'):
+    """
+    :param connection:  SQLite3 connection with database (in a transaction)
+    :param name:        savepoint name
+    :return:            context manager
+
+    Changes made inside the block are rolled back alone in case of exception,
+    the rest of the transaction is kept
+    """
+    connection.execute(f'SAVEPOINT {name}')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute(f'ROLLBACK TO {name}')
+        connection.execute(f'RELEASE {name}')
+        raise
+    else:
+        connection.execute(f'RELEASE {name}')
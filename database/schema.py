@@ -0,0 +1,503 @@
+"""
+Versioned database schema
+
+Every migration is a list of steps: SQL strings or functions taking a connection.
+The number of applied migrations is kept in PRAGMA user_version, pending ones are applied
+in order on app startup (or with `python -m database.schema`), each in its own transaction
+"""
+import sqlite3
+import hashlib
+
+from database.analytics import rebuild_rollups
+from database.API import EXPORT_QUERIES, catalog_query
+from database.pool import get_connection, transaction
+from database.passwords import hash_password, is_hash
+
+
+def _move_photos_to_store(connection: sqlite3.Connection):
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            Nothing
+
+    Migration step: copies photo_1..photo_3 of every product into ProductPhotos (deduplicated by hash)
+    and drops these columns. SQLite older than 3.35 can't drop columns, there they are set to NULL
+    """
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(Products)')]
+    if 'photo_1' not in columns:
+        return
+
+    cursor = connection.execute('''
+        SELECT Products.id, photo_1, photo_2, photo_3, (
+            SELECT MAX(operation_date)
+            FROM Supplies
+            WHERE product_id = Products.id
+        )
+        FROM Products
+        WHERE photo_1 IS NOT NULL OR photo_2 IS NOT NULL OR photo_3 IS NOT NULL
+    ''')
+
+    while True:
+        rows = cursor.fetchmany(100)
+        if not rows:
+            break
+
+        for product_id, *photos, supply_date in rows:
+            for slot, photo in enumerate(photos, start=1):
+                if photo is None:
+                    continue
+
+                photo_hash = hashlib.sha256(photo).hexdigest()
+                connection.execute('''
+                    INSERT OR IGNORE INTO ProductPhotos (hash, data, size, created_at)
+                    VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ''', (photo_hash, photo, len(photo), supply_date))
+                connection.execute('''
+                    INSERT OR REPLACE INTO ProductPhotoLinks (product_id, slot, hash)
+                    VALUES (?, ?, ?)
+                ''', (product_id, slot, photo_hash))
+
+    try:
+        for column in ('photo_1', 'photo_2', 'photo_3'):
+            connection.execute(f'ALTER TABLE Products DROP COLUMN {column}')
+    except sqlite3.OperationalError:
+        connection.execute('UPDATE Products SET photo_1 = NULL, photo_2 = NULL, photo_3 = NULL')
+
+def _hash_admin_passwords(connection: sqlite3.Connection):
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            Nothing
+
+    Migration step: replaces plain passwords of admins with salted hashes
+    """
+    rows = connection.execute('SELECT id, password_hash FROM Admins').fetchall()
+
+    for admin_id, password in rows:
+        if not is_hash(password):
+            connection.execute('UPDATE Admins SET password_hash = ? WHERE id = ?',
+                               (hash_password(password), admin_id))
+
+
+MIGRATIONS = [
+    # 1: tables
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS Products (
+                id          TEXT PRIMARY KEY,
+                name        TEXT NOT NULL,
+                price       INTEGER NOT NULL,
+                quantity    INTEGER NOT NULL,
+                photo_1     BLOB,
+                photo_2     BLOB,
+                photo_3     BLOB
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS Admins (
+                id          TEXT PRIMARY KEY,
+                password    TEXT NOT NULL
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS Customers (
+                email       TEXT PRIMARY KEY,
+                name        TEXT
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS Sales (
+                id              TEXT PRIMARY KEY,
+                product_id      TEXT NOT NULL,
+                quantity        INTEGER NOT NULL,
+                price           INTEGER NOT NULL,
+                user_email      TEXT,
+                city            TEXT,
+                address         TEXT,
+                operation_date  TEXT NOT NULL
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS Supplies (
+                id              TEXT PRIMARY KEY,
+                product_id      TEXT NOT NULL,
+                admin_id        TEXT NOT NULL,
+                quantity        INTEGER NOT NULL,
+                price           INTEGER NOT NULL,
+                operation_date  TEXT NOT NULL
+            )
+        ''',
+    ],
+    # 2: indexes for the hot queries
+    [
+        # Catalog (get_available_products): partial covering indexes of products in stock
+        '''
+            CREATE INDEX IF NOT EXISTS Products_in_stock
+            ON Products (id, name, price, quantity)
+            WHERE quantity != 0
+        ''',
+        # Databases of versions before migrations got Products_in_stock_price (price, id) from
+        # ensure_indexes on startup. It is replaced by the covering index below, a fresh database
+        # doesn't have it and the statement does nothing
+        'DROP INDEX IF EXISTS Products_in_stock_price',
+        '''
+            CREATE INDEX IF NOT EXISTS Products_in_stock_by_price
+            ON Products (price, id, name, quantity)
+            WHERE quantity != 0
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Products_in_stock_name
+            ON Products (name)
+            WHERE quantity != 0
+        ''',
+        # Sales and supplies of a product, incremental exports (updated_since)
+        '''
+            CREATE INDEX IF NOT EXISTS Sales_product_date
+            ON Sales (product_id, operation_date)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Sales_operation_date
+            ON Sales (operation_date)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Supplies_product
+            ON Supplies (product_id)
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Supplies_operation_date
+            ON Supplies (operation_date)
+        ''',
+    ],
+    # 3: photos are moved from Products rows to content-addressed store
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS ProductPhotos (
+                hash        TEXT PRIMARY KEY,
+                data        BLOB NOT NULL,
+                size        INTEGER NOT NULL,
+                created_at  TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS ProductPhotoLinks (
+                product_id  TEXT NOT NULL,
+                slot        INTEGER NOT NULL,
+                hash        TEXT NOT NULL,
+                PRIMARY KEY (product_id, slot)
+            ) WITHOUT ROWID
+        ''',
+        _move_photos_to_store,
+    ],
+    # 4: pre-sized variants of photos (thumb, medium, WebP), stored in ProductPhotos too
+    [
+        '''
+            ALTER TABLE ProductPhotos
+            ADD COLUMN media_type TEXT NOT NULL DEFAULT 'image/jpeg'
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS ProductPhotoVariants (
+                hash            TEXT NOT NULL,
+                variant         TEXT NOT NULL,
+                variant_hash    TEXT NOT NULL,
+                PRIMARY KEY (hash, variant)
+            ) WITHOUT ROWID
+        ''',
+    ],
+    # 5: drafts of supplied products shared by workers (drafts.SQLiteDraftStore)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS Drafts (
+                token       TEXT PRIMARY KEY,
+                data        TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            )
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Drafts_expires_at
+            ON Drafts (expires_at)
+        ''',
+    ],
+    # 6: admin sessions shared by workers (sessions.SQLiteSessionStore)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS Sessions (
+                token       TEXT PRIMARY KEY,
+                admin       TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            )
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS Sessions_expires_at
+            ON Sessions (expires_at)
+        ''',
+    ],
+    # 7: salted password hashes, sessions keep only admin ID (old ones had plain passwords)
+    [
+        'ALTER TABLE Admins RENAME COLUMN password TO password_hash',
+        _hash_admin_passwords,
+        'DELETE FROM Sessions',
+        'ALTER TABLE Sessions RENAME COLUMN admin TO admin_id',
+    ],
+    # 8: daily rollups of sales and supplies for analytics (database.analytics), backfilled from history
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS SalesDaily (
+                day         TEXT NOT NULL,
+                product_id  TEXT NOT NULL,
+                city        TEXT NOT NULL,
+                units       INTEGER NOT NULL,
+                revenue     INTEGER NOT NULL,
+                sales       INTEGER NOT NULL,
+                PRIMARY KEY (day, product_id, city)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS SuppliesDaily (
+                day         TEXT NOT NULL,
+                product_id  TEXT NOT NULL,
+                units       INTEGER NOT NULL,
+                cost        INTEGER NOT NULL,
+                supplies    INTEGER NOT NULL,
+                PRIMARY KEY (day, product_id)
+            ) WITHOUT ROWID
+        ''',
+        rebuild_rollups,
+    ],
+    # 9: responses of sales and supplies by Idempotency-Key (idempotency.py)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+                key         TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                response    TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE INDEX IF NOT EXISTS IdempotencyKeys_expires_at
+            ON IdempotencyKeys (expires_at)
+        ''',
+    ],
+    # 10: full-text search of product names (API.search_products), kept in sync by triggers
+    [
+        '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ProductsSearch
+            USING fts5 (
+                name,
+                content = 'Products',
+                content_rowid = 'rowid',
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '1 2 3'
+            )
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_insert
+            AFTER INSERT ON Products
+            BEGIN
+                INSERT INTO ProductsSearch (rowid, name) VALUES (new.rowid, new.name);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_delete
+            AFTER DELETE ON Products
+            BEGIN
+                INSERT INTO ProductsSearch (ProductsSearch, rowid, name) VALUES ('delete', old.rowid, old.name);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_update
+            AFTER UPDATE OF name ON Products
+            BEGIN
+                INSERT INTO ProductsSearch (ProductsSearch, rowid, name) VALUES ('delete', old.rowid, old.name);
+                INSERT INTO ProductsSearch (rowid, name) VALUES (new.rowid, new.name);
+            END
+        ''',
+        # Index of existing products
+        "INSERT INTO ProductsSearch (ProductsSearch) VALUES ('rebuild')",
+    ],
+    # 11: node numbers of generated IDs leased by worker processes (database/ids.py)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS IdNodes (
+                node        INTEGER PRIMARY KEY,
+                owner       TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            )
+        ''',
+    ],
+    # 12: keyset of incremental exports (API.iter_export) is (operation_date, id)
+    [
+        'DROP INDEX IF EXISTS Sales_operation_date',
+        '''
+            CREATE INDEX IF NOT EXISTS Sales_operation_date_id
+            ON Sales (operation_date, id)
+        ''',
+        'DROP INDEX IF EXISTS Supplies_operation_date',
+        '''
+            CREATE INDEX IF NOT EXISTS Supplies_operation_date_id
+            ON Supplies (operation_date, id)
+        ''',
+    ],
+    # 13: full-text search keys products by explicit search_rowid: implicit rowid of Products
+    # (TEXT primary key) may be changed by VACUUM, which would silently break the index
+    [
+        'DROP TRIGGER IF EXISTS Products_search_insert',
+        'DROP TRIGGER IF EXISTS Products_search_delete',
+        'DROP TRIGGER IF EXISTS Products_search_update',
+        'DROP TABLE IF EXISTS ProductsSearch',
+        'ALTER TABLE Products ADD COLUMN search_rowid INTEGER',
+        'UPDATE Products SET search_rowid = rowid',
+        '''
+            CREATE UNIQUE INDEX IF NOT EXISTS Products_search_rowid
+            ON Products (search_rowid)
+        ''',
+        '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ProductsSearch
+            USING fts5 (
+                name,
+                content = 'Products',
+                content_rowid = 'search_rowid',
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '1 2 3'
+            )
+        ''',
+        # New products get the next key, whatever columns the insert gives
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_insert
+            AFTER INSERT ON Products
+            BEGIN
+                UPDATE Products
+                SET search_rowid = (SELECT IFNULL(MAX(search_rowid), 0) + 1 FROM Products)
+                WHERE id = new.id;
+                INSERT INTO ProductsSearch (rowid, name) SELECT search_rowid, name FROM Products WHERE id = new.id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_delete
+            AFTER DELETE ON Products
+            BEGIN
+                INSERT INTO ProductsSearch (ProductsSearch, rowid, name) VALUES ('delete', old.search_rowid, old.name);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS Products_search_update
+            AFTER UPDATE OF name ON Products
+            BEGIN
+                INSERT INTO ProductsSearch (ProductsSearch, rowid, name) VALUES ('delete', old.search_rowid, old.name);
+                INSERT INTO ProductsSearch (rowid, name) VALUES (new.search_rowid, new.name);
+            END
+        ''',
+        "INSERT INTO ProductsSearch (ProductsSearch) VALUES ('rebuild')",
+    ],
+]
+
+
+# Hot queries which must not scan whole tables (see full_scans). Catalog and export queries
+# are built by API itself. The catalog without limit reads all products in stock by design
+# (it is served from a snapshot), so its pages are checked
+HOT_QUERIES = {
+    'catalog_page':             catalog_query(limit=50, after=('', ''))[0],
+    'catalog_page_desc':        catalog_query(limit=50, after=('', ''), order='desc')[0],
+    'catalog_by_price':         catalog_query(limit=50, after=(0, ''), sort='price')[0],
+    'catalog_by_price_desc':    catalog_query(limit=50, after=(0, ''), sort='price', order='desc')[0],
+    'catalog_by_name':          catalog_query(name_prefix='a')[0],
+    'photos':           'SELECT ProductPhotoLinks.slot, ProductPhotos.data FROM Products '
+                        'LEFT JOIN ProductPhotoLinks ON ProductPhotoLinks.product_id = Products.id '
+                        'LEFT JOIN ProductPhotoVariants ON ProductPhotoVariants.hash = ProductPhotoLinks.hash '
+                        'AND ProductPhotoVariants.variant = ? '
+                        'LEFT JOIN ProductPhotos ON ProductPhotos.hash = '
+                        'COALESCE(ProductPhotoVariants.variant_hash, ProductPhotoLinks.hash) '
+                        'WHERE Products.id = ?',
+    'admin':            'SELECT password_hash FROM Admins WHERE id = ?',
+    'update_quantity':  'UPDATE Products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?',
+    'product_sales':    'SELECT * FROM Sales WHERE product_id = ? AND operation_date >= ?',
+    'product_supplies': 'SELECT MAX(operation_date) FROM Supplies WHERE product_id = ?',
+    'draft':            'SELECT data FROM Drafts WHERE token = ? AND expires_at >= ?',
+    'expired_drafts':   'DELETE FROM Drafts WHERE expires_at < ?',
+    'session':          'SELECT admin_id FROM Sessions WHERE token = ? AND expires_at >= ?',
+    'expired_sessions': 'DELETE FROM Sessions WHERE expires_at < ?',
+    'idempotency_key':  'SELECT fingerprint, response FROM IdempotencyKeys WHERE key = ? AND expires_at >= ?',
+    'expired_keys':     'DELETE FROM IdempotencyKeys WHERE expires_at < ?',
+    'search':           'SELECT Products.id FROM ProductsSearch '
+                        'JOIN Products ON Products.search_rowid = ProductsSearch.rowid '
+                        'WHERE ProductsSearch MATCH ? AND (? = 0 OR Products.quantity != 0) '
+                        'ORDER BY ProductsSearch.rank LIMIT ?',
+    'rollup_sales':     'UPDATE SalesDaily SET units = units + ? WHERE day = ? AND product_id = ? AND city = ?',
+    'rollup_supplies':  'UPDATE SuppliesDaily SET units = units + ? WHERE day = ? AND product_id = ?',
+    'revenue':          'SELECT product_id, SUM(revenue) FROM SalesDaily WHERE day >= ? AND day <= ? '
+                        'GROUP BY product_id',
+    'supplied':         'SELECT product_id, SUM(units) FROM SuppliesDaily WHERE day >= ? AND day <= ? '
+                        'GROUP BY product_id',
+}
+
+for table, (keyset, sql_query, since_query) in EXPORT_QUERIES.items():
+    HOT_QUERIES[f'export_{table}'] = sql_query
+    if since_query is not None:
+        HOT_QUERIES[f'export_{table}_since'] = since_query
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            number of applied migrations
+
+    """
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            schema version after migration
+
+    The function applies pending migrations. Several workers may call it at once:
+    the version is checked again after the write lock is taken
+
+    In case of problems it will raise an exception
+    """
+    while get_version(connection) < len(MIGRATIONS):
+        with transaction(connection):
+            version = get_version(connection)
+            if version >= len(MIGRATIONS):
+                break
+
+            try:
+                for step in MIGRATIONS[version]:
+                    if callable(step):
+                        step(connection)
+                    else:
+                        connection.execute(step)
+            except Exception as error:
+                raise Exception(f'Database error: migration {version + 1} failed ({error})')
+
+            # PRAGMA doesn't accept parameters
+            connection.execute(f'PRAGMA user_version = {version + 1}')
+
+    connection.execute('PRAGMA optimize')
+    return get_version(connection)
+
+def full_scans(connection: sqlite3.Connection) -> dict:
+    """
+    :param connection:  SQLite3 connection with database
+    :return:            dict of hot queries whose plan scans a whole table: name -> plan lines
+
+    Should be empty with an up to date schema
+    """
+    result = {}
+
+    for name, sql_query in HOT_QUERIES.items():
+        parameters = (None, ) * sql_query.count('?')
+        plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql_query, parameters)]
+
+        # Walking a whole index ("SCAN Products USING INDEX ...") is a full scan too.
+        # Virtual tables (full-text search, json_each) are scanned by their own index
+        scans = [line for line in plan if line.startswith('SCAN') and 'VIRTUAL TABLE' not in line]
+        if scans:
+            result[name] = plan
+
+    return result
+
+
+if __name__ == '__main__':
+    with get_connection() as connection:
+        print(f'Schema version: {migrate(connection)}')
+
+        for name, plan in full_scans(connection).items():
+            print(f'Full scan in {name}: {plan}')
@@ -0,0 +1,109 @@
+"""
+Single-writer group commit
+
+SQLite allows one writer at a time, so sales and supplies of a worker are not written
+by concurrent transactions fighting for the lock. They are queued to one writer task,
+which takes all queued commands (waiting max_delay for more after the first one) and applies
+them in one transaction, every command in its own savepoint (see API.apply_writes).
+One commit per batch instead of one per request, and each caller gets its own result
+"""
+import asyncio
+
+import metrics
+
+
+class GroupCommitWriter:
+    """
+    Writer task applying queued write commands in batches
+
+    :param apply:       async function applying list of (command, args) and returning list of results
+    :param max_batch:   max commands per transaction
+    :param max_delay:   seconds to wait for more commands after the first one
+
+    """
+    def __init__(self, apply, max_batch: int, max_delay: float):
+        self.apply      = apply
+        self.max_batch  = max_batch
+        self.max_delay  = max_delay
+
+        self._queue = asyncio.Queue()
+        self._task  = None
+
+    def start(self):
+        """
+        :return:    Nothing
+
+        Should be called in the running event loop (app startup)
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        :return:    Nothing
+
+        The function applies already queued commands and stops the writer task
+        """
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+    async def submit(self, command: str, *args):
+        """
+        :param command:     write command name (see API.WRITE_COMMANDS)
+        :return:            result of the command
+
+        """
+        if self._task is None:
+            raise Exception('Database error: writer is not started')
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((command, args, future))
+        return await future
+
+    def _take(self, batch: list) -> bool:
+        """
+        :param batch:   list to append queued commands to
+        :return:        False if stop was requested
+
+        """
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                return False
+            batch.append(item)
+        return True
+
+    async def _run(self):
+        running = True
+        while running:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            if self.max_delay > 0 and self._queue.empty():
+                await asyncio.sleep(self.max_delay)
+            running = self._take(batch)
+
+            # Callers which gave up (e.g. client disconnected) are not written
+            batch = [(command, args, future) for command, args, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            metrics.write_batch_size.observe(len(batch))
+            try:
+                results = await self.apply([(command, args) for command, args, future in batch])
+            except Exception as error:
+                for command, args, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for (command, args, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,217 @@
+"""
+Drafts of products being supplied, one per admin session
+
+An admin fills a draft step by step (/transfer_text, /transfer_photos, /upload_photo)
+and /supply turns it into a product. Drafts expire DRAFT_TTL seconds after the last change
+and are limited in size and number.
+
+MemoryDraftStore keeps drafts in the worker process, SQLiteDraftStore keeps them
+in Drafts table, so they are shared by all workers (uvicorn --workers N)
+"""
+import json
+import time
+from collections import OrderedDict
+
+from config import DRAFT_BACKEND, DRAFT_TTL, DRAFT_MAX_COUNT, DRAFT_MAX_BYTES
+from database.pool import get_connection, transaction
+from database import async_API
+
+
+def _merge(draft: dict, fields: dict, max_bytes: int) -> dict:
+    """
+    :param draft:       current draft
+    :param fields:      new values. Dicts (e.g. photo_hashes) are merged with current ones
+    :param max_bytes:   size limit of serialized draft
+    :return:            updated draft
+
+    In case of too large draft it will raise ValueError
+    """
+    draft = dict(draft)
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(draft.get(key), dict):
+            value = {**draft[key], **value}
+        draft[key] = value
+
+    if len(json.dumps(draft)) > max_bytes:
+        raise ValueError(f'Draft is larger than {max_bytes} bytes')
+
+    return draft
+
+
+class MemoryDraftStore:
+    """
+    Drafts in memory of the worker process. Suitable for a single worker
+
+    :param ttl:         draft lifetime in seconds after the last change
+    :param max_count:   maximal number of drafts. The oldest ones are dropped when it's exceeded
+    :param max_bytes:   maximal size of one draft serialized to JSON
+
+    """
+    def __init__(self, ttl: float, max_count: int, max_bytes: int):
+        self.ttl        = ttl
+        self.max_count  = max_count
+        self.max_bytes  = max_bytes
+
+        self._drafts    = OrderedDict()     # token -> (draft, expires_at), oldest first
+
+    async def get(self, token: str) -> dict:
+        """
+        :param token:   session token
+        :return:        draft or empty dict
+
+        """
+        entry = self._drafts.get(token)
+        if entry is None or entry[1] < time.monotonic():
+            return {}
+        return dict(entry[0])
+
+    async def update(self, token: str, fields: dict) -> dict:
+        """
+        :param token:   session token
+        :param fields:  new values of the draft
+        :return:        updated draft
+
+        In case of too large draft it will raise ValueError
+        """
+        draft = _merge(await self.get(token), fields, self.max_bytes)
+
+        self._drafts.pop(token, None)
+        self._drafts[token] = (draft, time.monotonic() + self.ttl)
+
+        await self.sweep()
+        while len(self._drafts) > self.max_count:
+            self._drafts.popitem(last=False)
+
+        return dict(draft)
+
+    async def delete(self, token: str):
+        self._drafts.pop(token, None)
+
+    async def sweep(self) -> int:
+        """
+        :return:    number of removed expired drafts
+
+        """
+        now = time.monotonic()
+        removed = 0
+        # Every change moves a draft to the end, so expired ones are at the beginning
+        while self._drafts:
+            token, (draft, expires_at) = next(iter(self._drafts.items()))
+            if expires_at >= now:
+                break
+            del self._drafts[token]
+            removed += 1
+        return removed
+
+
+class SQLiteDraftStore:
+    """
+    Drafts in Drafts table of the database, shared by all worker processes
+
+    :param ttl:         draft lifetime in seconds after the last change
+    :param max_count:   maximal number of drafts. The oldest ones are dropped when it's exceeded
+    :param max_bytes:   maximal size of one draft serialized to JSON
+
+    """
+    def __init__(self, ttl: float, max_count: int, max_bytes: int):
+        self.ttl        = ttl
+        self.max_count  = max_count
+        self.max_bytes  = max_bytes
+
+    @staticmethod
+    def _get(connection, token: str) -> dict:
+        sql_query = '''
+            SELECT data
+            FROM Drafts
+            WHERE token = ? AND expires_at >= ?
+        '''
+        row = connection.execute(sql_query, (token, time.time())).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _get_draft(self, token: str) -> dict:
+        with get_connection() as connection:
+            return self._get(connection, token)
+
+    def _update_draft(self, token: str, fields: dict) -> dict:
+        with get_connection() as connection:
+            with transaction(connection):
+                draft = _merge(self._get(connection, token), fields, self.max_bytes)
+
+                connection.execute('''
+                    INSERT OR REPLACE INTO Drafts (token, data, expires_at)
+                    VALUES (?, ?, ?)
+                ''', (token, json.dumps(draft), time.time() + self.ttl))
+
+                self._sweep(connection)
+                connection.execute('''
+                    DELETE FROM Drafts
+                    WHERE token IN (
+                        SELECT token
+                        FROM Drafts
+                        ORDER BY expires_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_count, ))
+
+        return draft
+
+    def _delete_draft(self, token: str):
+        with get_connection() as connection:
+            with transaction(connection):
+                connection.execute('DELETE FROM Drafts WHERE token = ?', (token, ))
+
+    @staticmethod
+    def _sweep(connection) -> int:
+        return connection.execute('DELETE FROM Drafts WHERE expires_at < ?', (time.time(), )).rowcount
+
+    def _sweep_drafts(self) -> int:
+        with get_connection() as connection:
+            with transaction(connection):
+                return self._sweep(connection)
+
+    async def get(self, token: str) -> dict:
+        """
+        :param token:   session token
+        :return:        draft or empty dict
+
+        """
+        return await async_API.run(self._get_draft, token)
+
+    async def update(self, token: str, fields: dict) -> dict:
+        """
+        :param token:   session token
+        :param fields:  new values of the draft
+        :return:        updated draft
+
+        Read and write are done in one transaction, so concurrent changes are not lost
+        In case of too large draft it will raise ValueError
+        """
+        return await async_API.run(self._update_draft, token, fields)
+
+    async def delete(self, token: str):
+        await async_API.run(self._delete_draft, token)
+
+    async def sweep(self) -> int:
+        """
+        :return:    number of removed expired drafts
+
+        """
+        return await async_API.run(self._sweep_drafts)
+
+
+DRAFT_STORES = {
+    'memory':   MemoryDraftStore,
+    'sqlite':   SQLiteDraftStore,
+}
+
+
+def create_draft_store(backend: str = DRAFT_BACKEND):
+    """
+    :param backend: 'memory' or 'sqlite'
+    :return:        draft store configured with DRAFT_* settings
+
+    """
+    if backend not in DRAFT_STORES:
+        raise ValueError(f"Draft backend should be one of: {', '.join(DRAFT_STORES)}")
+
+    return DRAFT_STORES[backend](DRAFT_TTL, DRAFT_MAX_COUNT, DRAFT_MAX_BYTES)
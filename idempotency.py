@@ -0,0 +1,136 @@
+"""
+Idempotency keys of sales and supplies
+
+A client may send Idempotency-Key header with /sale, /sales/batch and supply requests and
+retry with the same key (e.g. after timeout). The first request is applied once, retries get
+its response back without touching Products or Sales.
+
+The key and the response are saved in IdempotencyKeys table in the transaction of the write itself
+(see API._idempotent), so a retry on another worker or after restart finds it. Every worker also keeps
+responses in memory (one dict lookup for a retry) and shares one write between concurrent
+duplicates. Only successful responses are saved: failed requests change nothing and can be retried.
+Keys expire IDEMPOTENCY_TTL seconds after the first request
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+from cache import LRUCache
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_KEY_MAX_LENGTH
+from database.API import IDEMPOTENCY_CONFLICT
+from database.pool import get_connection, transaction
+from database import async_API
+
+
+def fingerprint(*values) -> str:
+    """
+    :param values:  request data (JSON serializable)
+    :return:        hash of the request, so a key can't be reused with another request
+
+    """
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Responses of writes by idempotency key
+
+    :param ttl:         key lifetime in seconds
+    :param max_bytes:   size of responses kept in worker memory
+
+    """
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+
+        self._responses = LRUCache(max_bytes, ttl=ttl, sizeof=lambda entry: len(entry[1]))
+        self._in_flight = {}    # key -> (fingerprint, future)
+
+    @staticmethod
+    def _replay(request_fingerprint: str, entry: tuple) -> dict:
+        stored_fingerprint, response = entry
+        if request_fingerprint is not None and stored_fingerprint != request_fingerprint:
+            raise ValueError(IDEMPOTENCY_CONFLICT)
+        return json.loads(response)
+
+    def _sweep_keys(self) -> int:
+        with get_connection() as connection:
+            with transaction(connection):
+                return connection.execute('DELETE FROM IdempotencyKeys WHERE expires_at < ?',
+                                          (time.time(), )).rowcount
+
+    async def run(self, key: str, request_fingerprint: str, perform) -> dict:
+        """
+        :param key:                 idempotency key (scoped by caller, e.g. sale:<key>)
+        :param request_fingerprint: hash of the request (see fingerprint). None - the request
+                                    can't be fingerprinted, it gets any saved response of the key
+        :param perform:             async function performing the request. It gets write function
+                                    (async, like async_API.write) which saves the key with the write
+        :return:                    JSONDefaultResponse of the first request with this key
+
+        In case of invalid key or key used with another request it will raise ValueError
+        """
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValueError(f'Idempotency-Key should be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters long')
+
+        while True:
+            entry = self._responses.get(key)
+            if entry is not None:
+                return self._replay(request_fingerprint, entry)
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+
+            if request_fingerprint is not None and in_flight[0] != request_fingerprint:
+                raise ValueError(IDEMPOTENCY_CONFLICT)
+            try:
+                return await asyncio.shield(in_flight[1])
+            except asyncio.CancelledError:
+                # The first request was cancelled (e.g. its client disconnected), not this one.
+                # Its write may be committed already, so the request is performed again
+                # and the key in the database returns the saved response (see API._idempotent)
+                if in_flight[1].cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        async def write(command: str, *args) -> dict:
+            return await async_API.write('idempotent', key, request_fingerprint, time.time() + self.ttl,
+                                         command, *args)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (request_fingerprint, future)
+        try:
+            response = await perform(write)
+            if response['error'] and response['details'] == IDEMPOTENCY_CONFLICT:
+                raise ValueError(IDEMPOTENCY_CONFLICT)
+
+            if not response['error'] and request_fingerprint is not None:
+                self._responses.put(key, (request_fingerprint, json.dumps(response)))
+            future.set_result(response)
+            return response
+        except Exception as error:
+            future.set_exception(error)
+            # Mark exception as retrieved if there were no concurrent duplicates
+            future.exception()
+            raise
+        finally:
+            # Cancelled: concurrent duplicates perform the request themselves
+            if not future.done():
+                future.cancel()
+            del self._in_flight[key]
+
+    async def sweep(self) -> int:
+        """
+        :return:    number of removed expired keys
+
+        """
+        return await async_API.run(self._sweep_keys)
+
+
+def create_idempotency_store() -> IdempotencyStore:
+    """
+    :return:    idempotency store configured with IDEMPOTENCY_* settings
+
+    """
+    return IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_BYTES)
@@ -0,0 +1,167 @@
+"""
+Image pipeline for uploaded product photos
+
+Every photo is decoded once, validated and turned into pre-sized variants
+(thumb and medium, optionally WebP copies of them) next to the original.
+The work is CPU-heavy, so it runs in a process pool and doesn't block request handling
+
+Pillow is optional: without it photos are only checked to be JPG/PNG/WebP
+and stored without variants (photo endpoints fall back to the original)
+"""
+import asyncio
+import base64
+import binascii
+import io
+import multiprocessing
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+from config import PHOTO_MAX_BYTES, PHOTO_MAX_PIXELS, PHOTO_VARIANTS, PHOTO_WEBP, PHOTO_QUALITY, IMAGE_WORKERS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG':  'image/png',
+    'WEBP': 'image/webp',
+}
+
+SIGNATURES = {
+    b'\xff\xd8\xff':        'image/jpeg',
+    b'\x89PNG\r\n\x1a\n':   'image/png',
+}
+
+
+def _media_type_by_signature(data: bytes) -> str:
+    for signature, media_type in SIGNATURES.items():
+        if data.startswith(signature):
+            return media_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def _encode(image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=PHOTO_QUALITY, optimize=True)
+    else:
+        image.save(buffer, image_format, quality=PHOTO_QUALITY)
+    return buffer.getvalue()
+
+def process_photo(photo) -> dict:
+    """
+    :param photo:   raw image bytes, base64 encoded string or pathlib.Path of uploaded file
+    :return:        dict variant -> {'data': bytes, 'media_type': str}
+
+    Variants are 'original' plus PHOTO_VARIANTS names (thumb, medium) and their '_webp' versions
+    if PHOTO_WEBP is enabled. Variants are JPG images fitted into given size, turned upright
+    by EXIF orientation of the photo (variants don't keep EXIF)
+    If the photo is a file, the original is returned as {'path': str, 'media_type': str}
+    and is not loaded into memory
+
+    In case of invalid image it will raise ValueError
+    """
+    path = None
+    if isinstance(photo, pathlib.Path):
+        path = photo
+        with open(path, 'rb') as file:
+            header = file.read(16)
+        size = path.stat().st_size
+    else:
+        if isinstance(photo, str):
+            try:
+                photo = base64.b64decode(photo, validate=True)
+            except (binascii.Error, ValueError):
+                raise ValueError('Photo is not a valid base64 string')
+        header = photo[:16]
+        size = len(photo)
+
+    if size > PHOTO_MAX_BYTES:
+        raise ValueError(f'Photo is larger than {PHOTO_MAX_BYTES} bytes')
+
+    def original(media_type: str) -> dict:
+        if path is not None:
+            return {'path': str(path), 'media_type': media_type}
+        return {'data': photo, 'media_type': media_type}
+
+    if Image is None:
+        media_type = _media_type_by_signature(header)
+        if media_type is None:
+            raise ValueError('Photo should be JPG, PNG or WebP image')
+        return {'original': original(media_type)}
+
+    try:
+        image = Image.open(path if path is not None else io.BytesIO(photo))
+        if image.format not in MEDIA_TYPES:
+            raise ValueError('Photo should be JPG, PNG or WebP image')
+        if image.width * image.height > PHOTO_MAX_PIXELS:
+            raise ValueError(f'Photo is larger than {PHOTO_MAX_PIXELS} pixels')
+        image.load()
+    except ValueError:
+        raise
+    except Exception:
+        raise ValueError('Photo is not a valid image')
+
+    variants = {'original': original(MEDIA_TYPES[image.format])}
+
+    image = ImageOps.exif_transpose(image)
+    for name, max_size in PHOTO_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_size, max_size))
+
+        variants[name] = {'data': _encode(resized, 'JPEG'), 'media_type': 'image/jpeg'}
+        if PHOTO_WEBP:
+            variants[name + '_webp'] = {'data': _encode(resized, 'WEBP'), 'media_type': 'image/webp'}
+
+    return variants
+
+
+_executor: ProcessPoolExecutor = None
+
+
+def init_executor() -> ProcessPoolExecutor:
+    """
+    :return:    image processing pool. It is created on app startup
+
+    Workers are spawned, not forked: a fork of the app would copy its threads' locks
+    (database pool, executors) in whatever state they are at the moment
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+def close_executor():
+    """
+    :return:    Nothing. The pool is shut down on app shutdown
+
+    """
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+async def process_photos(photos: dict) -> dict:
+    """
+    :param photos:  dict photo_N -> raw bytes, base64 string or file path (None values are skipped)
+    :return:        dict photo_N -> variants (see process_photo)
+
+    Photos are processed in parallel in the process pool
+
+    In case of invalid image it will raise ValueError
+    """
+    executor = _executor if _executor is not None else init_executor()
+    loop = asyncio.get_running_loop()
+
+    keys = [key for key, photo in photos.items() if photo is not None]
+    results = await asyncio.gather(*[loop.run_in_executor(executor, process_photo, photos[key])
+                                     for key in keys])
+
+    return dict(zip(keys, results))
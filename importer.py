@@ -0,0 +1,188 @@
+"""
+Bulk import of products (/admin-panel/import)
+
+A delivery is a CSV file with header or NDJSON (one JSON object per line) with fields
+name, price, quantity and optional photo_1..photo_3: names of images in a zip archive
+uploaded with it. Rows are read and validated batch by batch, so the file is never
+loaded into memory, and every batch is supplied in one transaction (API.import_products)
+"""
+import csv
+import io
+import json
+import zipfile
+
+from config import PHOTO_MAX_BYTES
+from database.API import PHOTO_SLOTS
+
+
+FORMATS = ('csv', 'ndjson')
+
+EXTENSIONS = {
+    '.csv':     'csv',
+    '.ndjson':  'ndjson',
+    '.jsonl':   'ndjson',
+}
+
+CONTENT_TYPES = {
+    'text/csv':                 'csv',
+    'application/x-ndjson':     'ndjson',
+    'application/jsonl':        'ndjson',
+}
+
+
+def guess_format(filename: str = None, content_type: str = None) -> str:
+    """
+    :param filename:        name of uploaded file
+    :param content_type:    Content-Type of upload
+    :return:                csv, ndjson or None if the format is unknown
+
+    """
+    if filename:
+        for extension, file_format in EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return file_format
+
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+
+    return None
+
+def _integer(value, name: str, minimum: int) -> int:
+    if isinstance(value, str):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            raise ValueError(f'{name} should be an integer')
+    elif isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} should be an integer')
+
+    if value < minimum:
+        raise ValueError(f'{name} should be at least {minimum}')
+    return value
+
+def validate_row(row: dict) -> dict:
+    """
+    :param row:     parsed CSV row or JSON object
+    :return:        dict with name, price, quantity and photos (photo_N -> file name in the archive)
+
+    In case of invalid row it will raise ValueError
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Row should be a JSON object')
+
+    name = row.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('name is required')
+
+    photos = {}
+    for key in PHOTO_SLOTS:
+        photo = row.get(key)
+        if photo is None or photo == '':
+            continue
+        if not isinstance(photo, str):
+            raise ValueError(f'{key} should be a file name')
+        photos[key] = photo.strip()
+
+    return {
+        'name':     name.strip(),
+        'price':    _integer(row.get('price'), 'price', 0),
+        'quantity': _integer(row.get('quantity'), 'quantity', 1),
+        'photos':   photos
+    }
+
+
+def _csv_rows(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    finally:
+        # The upload is closed by its owner
+        text.detach()
+
+def _ndjson_rows(file):
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, ValueError('Line is not valid JSON')
+
+def read_batches(file, file_format: str, batch_size: int, max_rows: int):
+    """
+    :param file:        binary file with CSV or NDJSON
+    :param file_format: csv or ndjson
+    :param batch_size:  rows per batch
+    :param max_rows:    max rows in the file
+    :return:            generator of batches: lists of (line number, validated row or ValueError)
+
+    Malformed rows are returned as errors, malformed files (wrong encoding, too many rows)
+    raise ValueError when the reader gets to the problem
+    """
+    rows = _csv_rows(file) if file_format == 'csv' else _ndjson_rows(file)
+
+    batch = []
+    count = 0
+    try:
+        for line, row in rows:
+            count += 1
+            if count > max_rows:
+                raise ValueError(f'Import is limited to {max_rows} rows')
+
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                batch.append((line, validate_row(row)))
+            except ValueError as error:
+                batch.append((line, error))
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except csv.Error as error:
+        raise ValueError(f'Malformed CSV: {error}')
+    finally:
+        rows.close()
+
+    if batch:
+        yield batch
+
+
+class PhotoArchive:
+    """
+    Zip archive with photos of imported products
+
+    :param file:    seekable binary file with the archive
+
+    In case of invalid archive it will raise ValueError
+    """
+    def __init__(self, file):
+        try:
+            self._zip = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise ValueError('Photos should be a zip archive')
+
+    def read(self, name: str) -> bytes:
+        """
+        :param name:    file name in the archive
+        :return:        file content
+
+        In case of missing or too large file it will raise ValueError
+        """
+        try:
+            info = self._zip.getinfo(name)
+        except KeyError:
+            raise ValueError(f'No photo {name} in the archive')
+
+        if info.file_size > PHOTO_MAX_BYTES:
+            raise ValueError(f'Photo {name} is larger than {PHOTO_MAX_BYTES} bytes')
+
+        try:
+            return self._zip.read(info)
+        except (zipfile.BadZipFile, NotImplementedError) as error:
+            raise ValueError(f'Photo {name} can\'t be extracted: {error}')
+
+    def close(self):
+        self._zip.close()
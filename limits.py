@@ -0,0 +1,45 @@
+"""
+Request body limits checked before the body is read
+
+FastAPI reads form bodies (spooling uploaded files to disk) before calling the handler,
+so handlers can only check the size of uploads they have already received. The middleware
+rejects requests declaring a larger Content-Length at once. Bodies without Content-Length
+(chunked) are passed through, handlers streaming them still stop at their own limits
+"""
+from classes import JSONDefaultResponse
+from responses import FastJSONResponse
+
+
+class BodyLimitMiddleware:
+    """
+    ASGI middleware answering 413 to requests with Content-Length over the limit of their path
+
+    :param limits:  dict path -> max body bytes. A path also limits the paths under it
+                    (/admin-panel/upload_photo limits /admin-panel/upload_photo/photo_1)
+
+    """
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    def _limit(self, path: str) -> int:
+        for prefix, max_bytes in self.limits.items():
+            if path == prefix or path.startswith(prefix + '/'):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self._limit(scope['path'])
+        if max_bytes is not None:
+            content_length = dict(scope['headers']).get(b'content-length')
+            if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+                result = JSONDefaultResponse(data=[], error=True, details=f'Request is larger than {max_bytes} bytes')
+                response = FastJSONResponse(result.json(), status_code=413, headers={'Connection': 'close'})
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
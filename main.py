@@ -1,13 +1,117 @@
-from itertools import product
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import hashlib
+import datetime
+import email.utils
+import logging
+import pathlib
+import tempfile
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse, Response
-from fastapi import Cookie
+from fastapi.responses import Response, StreamingResponse
+from fastapi import Cookie, Header, Query, Request, Form, File, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from database.API import *
+from database.pool import init_pool, close_pool, get_connection, pool_stats
+from database.schema import migrate
+from database import async_API, ids
 from classes import *
+from config import PHOTO_CACHE_CONTROL, PHOTO_CACHE_MAX_BYTES, PHOTO_CACHE_TTL, PHOTO_SWEEP_INTERVAL
+from config import CATALOG_CACHE_MAX_BYTES, CATALOG_CACHE_TTL, CATALOG_MAX_PAGE_SIZE, SEARCH_MAX_LIMIT
+from config import EXPORT_BATCH_SIZE, ANALYTICS_MAX_LIMIT
+from config import SESSION_TTL, SESSION_SWEEP_INTERVAL, ID_NODE_RENEW_INTERVAL
+from config import PHOTO_VARIANTS, PHOTO_MAX_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_DIR, UPLOAD_FORM_BYTES
+from config import IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS, IMPORT_MAX_BYTES, IMAGE_WORKERS
+from cache import LRUCache
+from responses import FastJSONResponse, dumps
+import metrics
+from drafts import create_draft_store
+from sessions import create_session_store
+from idempotency import create_idempotency_store, fingerprint
+from limits import BodyLimitMiddleware
+import images
+import importer
 
-app = FastAPI()
+
+logger = logging.getLogger(__name__)
+
+
+async def _sweep_expired():
+    """
+    Background task removing expired sessions, drafts and idempotency keys
+    every SESSION_SWEEP_INTERVAL seconds. A failed sweep doesn't stop the others
+    """
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        for name, store in (('sessions', sessions), ('drafts', drafts), ('idempotency keys', idempotency)):
+            try:
+                await store.sweep()
+            except Exception:
+                # Database may be busy, the next sweep will retry
+                logger.exception(f'Sweep of expired {name} failed')
+
+async def _renew_node_lease():
+    """
+    Background task extending the lease of the ID node every ID_NODE_RENEW_INTERVAL seconds
+    (see ids.renew_node). It doesn't wait for the sweeps, so slow ones can't let the lease expire
+    """
+    while True:
+        await asyncio.sleep(ID_NODE_RENEW_INTERVAL)
+        try:
+            await async_API.run(ids.renew_node)
+        except Exception:
+            # Database may be busy, the lease outlives a few failed renewals
+            logger.exception('Renewal of ID node lease failed')
+
+async def _sweep_photos():
+    """
+    Background task removing photos uploaded but never supplied every PHOTO_SWEEP_INTERVAL seconds
+    (see API.sweep_photos)
+    """
+    while True:
+        await asyncio.sleep(PHOTO_SWEEP_INTERVAL)
+        try:
+            await async_API.sweep_photos()
+        except Exception:
+            # Database may be busy, the next sweep will retry
+            logger.exception('Sweep of photos of no product failed')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup and shutdown hook: the database schema is migrated and ID node is claimed on startup,
+    the connection pool, executor and writer live as long as the app
+    """
+    init_pool()
+    with get_connection() as connection:
+        migrate(connection)
+    ids.claim_node()
+    async_API.init_executor()
+    async_API.init_writer()
+    images.init_executor()
+    sweeper = asyncio.create_task(_sweep_expired())
+    photo_sweeper = asyncio.create_task(_sweep_photos())
+    lease = asyncio.create_task(_renew_node_lease())
+    yield
+    lease.cancel()
+    photo_sweeper.cancel()
+    sweeper.cancel()
+    await async_API.close_writer()
+    images.close_executor()
+    async_API.close_executor()
+    ids.release_node()
+    close_pool()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Innermost, so CORS and metrics middlewares see rejected uploads too
+app.add_middleware(BodyLimitMiddleware, limits={
+    '/admin-panel/upload_photo':    PHOTO_MAX_BYTES + UPLOAD_FORM_BYTES,
+    '/admin-panel/supply_product':  len(PHOTO_SLOTS) * PHOTO_MAX_BYTES + UPLOAD_FORM_BYTES,
+})
 
 from fastapi.middleware.cors import CORSMiddleware
 app.add_middleware(
@@ -17,29 +121,194 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 
 # GET Requests processing
 
+def _etag(data: bytes) -> str:
+    """
+    :param data:    response body
+    :return:        strong ETag made of body's content hash
+
+    """
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    :param if_none_match:   If-None-Match header sent by client
+    :param etag:            current ETag of resource
+    :return:                True if client already has the resource
+
+    """
+    if not if_none_match:
+        return False
+
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+async def _load_catalog(key):
+    """
+    :param key:     catalog cache key: tuple of (parameter, value) pairs of get_available_products
+    :return:        catalog snapshot: serialized JSON body and its ETag
+
+    Failed requests are not cached: the function raises ValueError in case of invalid parameters
+    and an exception with details in case of database errors
+    """
+    response = await async_API.get_available_products(**dict(key))
+    if response['error']:
+        raise Exception(response['details'])
+
+    body = dumps(response)
+
+    return {
+        'body': body,
+        'etag': _etag(body)
+    }
+
+catalog_cache = LRUCache(max_bytes=CATALOG_CACHE_MAX_BYTES, ttl=CATALOG_CACHE_TTL,
+                         sizeof=lambda snapshot: len(snapshot['body']))
+
+def _invalidate_catalog():
+    """
+    Drops catalog snapshots. Should be called after every committed supply or sale
+    """
+    catalog_cache.clear()
+
 @app.get('/products')
-async def get_catalog():
+async def get_catalog(limit: int = Query(None, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+                      cursor: str = None,
+                      sort: str = 'id',
+                      order: str = 'asc',
+                      min_price: int = None,
+                      max_price: int = None,
+                      name_prefix: str = None,
+                      min_quantity: int = None,
+                      fields: str = None,
+                      if_none_match: str = Header(None)):
     """
+    :param limit:           page size. If not given, all products are returned
+    :param cursor:          next_cursor from previous page
+    :param sort:            id or price
+    :param order:           asc or desc
+    :param min_price:       minimal price
+    :param max_price:       maximal price
+    :param name_prefix:     beginning of product name (case-sensitive)
+    :param min_quantity:    minimal quantity in stock
+    :param fields:          comma separated fields to return (id, name, price, quantity)
+    :return: list with ids, names, quantities and price of available products
 
-    :return: list with ids, names, quantities and price of all available products
+    The response is served from pre-serialized snapshot which is rebuilt after supplies and sales.
+    Clients can revalidate it with If-None-Match header and get 304 if catalog has not changed
 
-    In case of errors the function returns 500-error with details
+    In case of invalid parameters (sort, order, fields, cursor) the function returns 422-error,
+    in case of database errors 500-error, both with JSONDefaultResponse with details
 
     """
+    key = (
+        ('limit',           limit),
+        ('page_cursor',     cursor),
+        ('sort',            sort),
+        ('order',           order),
+        ('min_price',       min_price),
+        ('max_price',       max_price),
+        ('name_prefix',     name_prefix),
+        ('min_quantity',    min_quantity),
+        ('fields',          tuple(field.strip() for field in fields.split(',')) if fields else None),
+    )
+
     try:
-        response = get_available_products()
-        return JSONResponse(response)
+        snapshot = await catalog_cache.get_or_load(key, _load_catalog)
+    except ValueError as error:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(),
+                                status_code=422)
     except Exception as error:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {error}")
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(),
+                                status_code=500)
+
+    headers = {
+        'ETag':             snapshot['etag'],
+        'Cache-Control':    'no-cache'
+    }
+
+    if _etag_matches(if_none_match, snapshot['etag']):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=snapshot['body'], media_type='application/json', headers=headers)
+
+
+
+@app.get('/products/search')
+async def search(q: str, limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT), in_stock: bool = True,
+                 prefix: bool = True):
+    """
+    :param q:           search text (words of product name)
+    :param limit:       max number of products
+    :param in_stock:    return only products in stock
+    :param prefix:      match the last word as beginning of a word (for autocomplete)
+    :return:            JSONDefaultResponse with products (id, name, price, quantity), the most relevant first
+
+    Declared before /products/{id}, so "search" is not taken for product ID
+
+    """
+    return FastJSONResponse(await async_API.search_products(q, limit, in_stock, prefix))
+
+def _cache_photo(photo: dict):
+    """
+    :param photo:   photo from get_photos (data, hash and created_at) or None
+    :return:        cache entry with photo, its ETag and Last-Modified header value
+
+    """
+    if photo is None:
+        return None
+
+    entry = {
+        'data':             photo['data'],
+        'media_type':       photo['media_type'],
+        'etag':             '"' + photo['hash'][:32] + '"',
+        'last_modified':    None
+    }
+
+    if photo['created_at']:
+        modified = datetime.datetime.fromisoformat(photo['created_at'])
+        entry['last_modified'] = email.utils.format_datetime(modified.replace(tzinfo=datetime.timezone.utc),
+                                                             usegmt=True)
+    return entry
+
+def _photos_size(product_photos: dict) -> int:
+    return sum(len(photo['data']) for photo in product_photos.values() if photo is not None)
+
+async def _load_product_photos(key: tuple):
+    """
+    :param key: product's unique ID and photo variant (original, thumb, medium, thumb_webp...)
+    :return:    dict with cache entries for photo_1, photo_2 and photo_3 or None if there is no such product
+
+    """
+    id, variant = key
+    photos = await async_API.get_photos(id, variant)
+    if photos is None:
+        return None
+
+    return {
+        'photo_1': _cache_photo(photos[0]) if len(photos) > 0 else None,
+        'photo_2': _cache_photo(photos[1]) if len(photos) > 1 else None,
+        'photo_3': _cache_photo(photos[2]) if len(photos) > 2 else None
+    }
 
+product_photos_cache = LRUCache(max_bytes=PHOTO_CACHE_MAX_BYTES, ttl=PHOTO_CACHE_TTL, sizeof=_photos_size)
 
+PHOTO_SIZES = ['original'] + list(PHOTO_VARIANTS)
 
-product_photos_cache: dict = {}
+metrics.register_caches({
+    'catalog':          catalog_cache,
+    'product_photos':   product_photos_cache,
+})
+metrics.register_pool(pool_stats)
+
+def _invalidate_product_photos(id: str):
+    for size in PHOTO_SIZES:
+        product_photos_cache.invalidate((id, size))
+        product_photos_cache.invalidate((id, size + '_webp'))
 
 @app.get('/products/{id}')
 async def get_product_photos(id: str):
@@ -50,48 +319,82 @@ async def get_product_photos(id: str):
 
     The function creates cache with photos data for product with given ID
     If product has not enough photos (less than 3) it will cache None-value
-    If there is absolutely no photos available it will return 404-error
+    If there is no product with such ID it will return 404-error
     In other cases (such as database error) it will return 500-error with details
 
+    Calling it is optional: photo requests load photos into the cache on miss
+
     """
     try:
-        photos = get_photos(id)
-
-        product_photos_cache[id] = {
-            'photo_1': photos[0] if len(photos) > 0 else None,
-            'photo_2': photos[1] if len(photos) > 1 else None,
-            'photo_3': photos[2] if len(photos) > 2 else None
-        }
-
-        return {'message': 'Photos cached successfully!'}
-    except IndexError:
-        raise HTTPException(status_code=404, detail="Not enough photos available")
+        product_photos = await product_photos_cache.get_or_load((id, 'original'), _load_product_photos)
     except Exception as error:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {error}")
 
-async def get_photo(id: str, photo_key: str):
+    if product_photos is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    return FastJSONResponse({'message': 'Photos cached successfully!'})
+
+async def get_photo(id: str, photo_key: str, photo_format: str = None, if_none_match: str = None,
+                    size: str = 'original'):
     """
-    :param id:          product's unique ID
-    :param photo_key:   photo_1, photo_2 or photo_3 to get photo with such numbers
-    :return:            product's photo with photo_key from cache. Could return None if there is no photo
+    :param id:              product's unique ID
+    :param photo_key:       photo_1, photo_2 or photo_3 to get photo with such numbers
+    :param photo_format:    'base64' to get base64 encoded string instead of raw JPG (legacy clients),
+                            'webp' to get WebP version of thumb or medium variant
+    :param if_none_match:   If-None-Match header sent by client
+    :param size:            original, thumb or medium
+    :return:                product's photo with photo_key from cache. Could return None if there is no photo
+
+    The function takes data from cache, loading product's photos from database on miss.
+    If there is no product with given ID or there is no photo under such number
+    the function will return error with status code 204
+
+    Raw photos are sent with ETag (content hash), Last-Modified and Cache-Control headers.
+    If client already has the photo with the same ETag the function returns 304 without body
 
-    The function takes data from cache. If there is no cache for the product with given ID or
-    there is no photo under such number (i.e. user requests photo_4) the function will return error
-    with status code 204
+    Thumb and medium variants are precomputed on upload. Photos uploaded before
+    the image pipeline have no variants, for them the original is returned
 
     """
-    product_photos = product_photos_cache.get(id)
+    if size not in PHOTO_SIZES:
+        raise HTTPException(status_code=422, detail=f"size should be one of: {', '.join(PHOTO_SIZES)}")
+
+    variant = size
+    if photo_format == 'webp' and size != 'original':
+        variant = size + '_webp'
+
+    try:
+        product_photos = await product_photos_cache.get_or_load((id, variant), _load_product_photos)
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {error}")
+
+    if not product_photos or not product_photos.get(photo_key):
+        return Response(status_code=204)
+
+    photo = product_photos[photo_key]
 
-    if product_photos and product_photos.get(photo_key):
-        return Response(content=product_photos[photo_key], media_type="image/jpg")
+    if photo_format == 'base64':
+        return Response(content=base64.b64encode(photo['data']), media_type="text/plain")
 
-    return Response(status_code=204)
+    headers = {
+        'ETag':             photo['etag'],
+        'Cache-Control':    PHOTO_CACHE_CONTROL
+    }
+    if photo['last_modified']:
+        headers['Last-Modified'] = photo['last_modified']
+
+    if _etag_matches(if_none_match, photo['etag']):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=photo['data'], media_type=photo['media_type'], headers=headers)
 
 
 
 """
 
-:return base64-encoded UTF-8 string or None
+:return image of given size (?size=original, thumb or medium), base64-encoded UTF-8 string
+        (with ?format=base64) or None
     
 Functions may return errors if there was problem with caching
 For details watch comments for get_photos(id, photo_key)
@@ -99,28 +402,38 @@ For details watch comments for get_photos(id, photo_key)
 """
 
 @app.get('/products/{id}/photo_1')
-async def get_photo_1(id: str):
+async def get_photo_1(id: str, format: str = None, size: str = 'original', if_none_match: str = Header(None)):
     """
     Function to get first photo
-    :returns base64 encoded UTF-8 string (encoded JPG)
+    :returns image (or base64 encoded UTF-8 string with ?format=base64), ?size=thumb for thumbnail
     """
-    return await get_photo(id, 'photo_1')
+    return await get_photo(id, 'photo_1', format, if_none_match, size)
 
 @app.get('/products/{id}/photo_2')
-async def get_photo_2(id: str):
+async def get_photo_2(id: str, format: str = None, size: str = 'original', if_none_match: str = Header(None)):
     """
     Function to get second photo
-    :returns base64 encoded UTF-8 string (encoded JPG)
+    :returns image (or base64 encoded UTF-8 string with ?format=base64), ?size=thumb for thumbnail
     """
-    return await get_photo(id, 'photo_2')
+    return await get_photo(id, 'photo_2', format, if_none_match, size)
 
 @app.get('/products/{id}/photo_3')
-async def get_photo_3(id: str):
+async def get_photo_3(id: str, format: str = None, size: str = 'original', if_none_match: str = Header(None)):
     """
     Function to get third photo
-    :returns base64 encoded UTF-8 string (encoded JPG)
+    :returns image (or base64 encoded UTF-8 string with ?format=base64), ?size=thumb for thumbnail
     """
-    return await get_photo(id, 'photo_3')
+    return await get_photo(id, 'photo_3', format, if_none_match, size)
+
+@app.get('/metrics')
+async def get_metrics():
+    """
+    :return: metrics of this worker in Prometheus text format
+
+    HTTP requests by route, durations of database queries, connection pool state
+    and hit ratios of catalog and photo caches
+    """
+    return Response(content=metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 
@@ -129,95 +442,488 @@ async def get_photo_3(id: str):
 
 # POST Requests processing
 
-admin_sessions: dict = {}
+sessions = create_session_store()
 
 @app.post('/admin-panel/login')
-async def login(admin: Admin, response: Response):
+async def login(admin: Admin):
     """
     :param admin:       admin class
-    :param response:    response class
     :return:            JSONDefaultResponse
 
     The function processes login. If admin logged into successfully it will remember it
     setting information in Cookie and return session token
     In case of problem with logging it will return default error 'Incorrect login or password'
 
-    The duration of session is 20 minutes. After that, admin will log out automatically
+    The duration of session is SESSION_TTL (20 minutes). After that, admin will log out automatically
 
     """
-    if not check_admin_password(admin):
+    if not await async_API.check_admin_password(admin):
         result = JSONDefaultResponse(data=[], error=True, details='Incorrect login or password')
-        return JSONResponse(result.json())
+        return FastJSONResponse(result.json())
 
     else:
-        session_token = str(uuid.uuid4())[:8] # generate new token
-        admin_sessions[session_token] = admin
-
-        response.set_cookie(key='session_token', value=session_token, httponly=True, secure=True, expires=1200)
+        session_token = await sessions.create(admin.id)
 
         result = JSONDefaultResponse(data=[{
             'token': session_token
         }], error=False, details='Successfully authorized')
 
-        return JSONResponse(result.json())
+        response = FastJSONResponse(result.json())
+        response.set_cookie(key='session_token', value=session_token, httponly=True, secure=True,
+                            expires=SESSION_TTL)
+        return response
+
+drafts = create_draft_store()
+idempotency = create_idempotency_store()
+
+async def _idempotent(scope: str, idempotency_key: str, request_fingerprint: str, perform) -> dict:
+    """
+    :param scope:               namespace of keys (sale, supply:<admin ID>)
+    :param idempotency_key:     Idempotency-Key header. None - the request is not deduplicated
+    :param request_fingerprint: hash of the request (see idempotency.fingerprint)
+    :param perform:             async function performing the request with given write function
+    :return:                    JSONDefaultResponse of the first request with this key
+
+    In case of invalid key or key used with another request it will raise ValueError
+    """
+    if idempotency_key is None:
+        return await perform(async_API.write)
+    return await idempotency.run(f'{scope}:{idempotency_key}', request_fingerprint, perform)
+
+def _key_error(error: ValueError) -> FastJSONResponse:
+    return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(), status_code=422)
+
+async def _supply_draft(admin_id: str, draft: dict, write=async_API.write) -> dict:
+    """
+    :param admin_id:    ID of authorized admin supplier
+    :param draft:       product draft (name, quantity, price and photo_hashes)
+    :param write:       function applying write command (see _idempotent)
+    :return:            JSONDefaultResponse
+
+    """
+    staged_product = Product(id='', name=draft['name'], quantity=draft['quantity'],
+                             price=draft['price'], photos={})
+    photo_hashes = {key: photo_hash for key, photo_hash in draft.get('photo_hashes', {}).items()
+                    if photo_hash is not None}
 
-product = {}
+    result = await write('supply_product', staged_product, admin_id, photo_hashes)
+    if not result['error']:
+        _invalidate_product_photos(result['data']['product_id'])
+        _invalidate_catalog()
+    return result
 
 @app.post('/admin-panel/supply')
-async def supply(session_token = Cookie()):
+async def supply(session_token = Cookie(), idempotency_key: str = Header(None)):
     """
     :param session_token:       Cookie session token
+    :param idempotency_key:     Idempotency-Key header. A retry with the same key gets
+                                the response of the first supply and supplies nothing
     :return:                    JSONDefaultResponse
 
     The function gets new product (name, price, quantity and photos) without ID
-    and supplies it into the database.
+    from the draft of the session and supplies it into the database.
+    The draft is removed after successful supply
 
     In case of problems it will return JSONDefaultResponse with errors
 
     """
-    admin = admin_sessions.get(session_token)
-    if admin and bool(product):
-        result = supply_product(product, admin)
-        return result
-    else:
+    admin_id = await sessions.get(session_token)
+    if not admin_id:
         result = JSONDefaultResponse(data=[], error=True, details='Not authorized')
-        return result.json()
+        return FastJSONResponse(result.json())
+
+    draft = await drafts.get(session_token)
+
+    async def perform(write):
+        if 'name' not in draft:
+            # The draft is removed by the first supply, so a retry finds no draft.
+            # It still goes through the key, which returns the response of the first supply
+            return await write('reject', 'Product is not given, use /transfer_text')
+
+        result = await _supply_draft(admin_id, draft, write)
+        if not result['error']:
+            await drafts.delete(session_token)
+        return result
+
+    request_fingerprint = fingerprint('supply', draft) if 'name' in draft else None
+    try:
+        result = await _idempotent(f'supply:{admin_id}', idempotency_key, request_fingerprint, perform)
+    except ValueError as error:
+        return _key_error(error)
+    return FastJSONResponse(result)
 
 
 @app.post('/admin-panel/transfer_text')
-async def get_text_data(data: Product):
+async def get_text_data(data: Product, session_token = Cookie(None)):
+    if not await sessions.get(session_token):
+        return FastJSONResponse(JSONDefaultResponse(error=True, details='Not authorized').json())
+
     try:
-        product['name']     = data.name
-        product['quantity'] = data.quantity
-        product['price']    = data.price
+        await drafts.update(session_token, {
+            'name':     data.name,
+            'quantity': data.quantity,
+            'price':    data.price
+        })
 
-        return JSONDefaultResponse(error=False,
-                                   details='OK').json()
+        return FastJSONResponse(JSONDefaultResponse(error=False,
+                                                    details='OK').json())
     except Exception as error:
-        return JSONDefaultResponse(error=True,
-                                   details=str(error)).json()
+        return FastJSONResponse(JSONDefaultResponse(error=True,
+                                                    details=str(error)).json())
+
+async def _store_photos(photos: dict) -> dict:
+    """
+    :param photos:  dict photo_N -> raw bytes, base64 string or file path (None values are skipped)
+    :return:        dict photo_N -> hash of stored photo
+
+    Photos are decoded, validated and resized (see images.py) in the image process pool
+    and put into the photo store
+
+    In case of invalid image it will raise ValueError
+    """
+    processed = await images.process_photos(photos)
+
+    photo_hashes = {}
+    for key, variants in processed.items():
+        photo_hashes[key] = await async_API.store_photo(variants)
+    return photo_hashes
 
 @app.post('/admin-panel/transfer_photos')
-async def get_text_data(photo_1: str, photo_2: str = None, photo_3: str = None):
+async def get_text_data(photo_1: str, photo_2: str = None, photo_3: str = None, session_token = Cookie(None)):
+    """
+    Photos replace all photos of the draft
+    """
+    if not await sessions.get(session_token):
+        return FastJSONResponse(JSONDefaultResponse(error=True, details='Not authorized').json())
+
     try:
-        product['photos'] = {
+        photo_hashes = await _store_photos({
             'photo_1': photo_1,
             'photo_2': photo_2,
             'photo_3': photo_3
-        }
+        })
 
-        return JSONDefaultResponse(error=False,
-                                   details='OK').json()
+        await drafts.update(session_token, {
+            'photo_hashes': {key: photo_hashes.get(key) for key in PHOTO_SLOTS}
+        })
+
+        return FastJSONResponse(JSONDefaultResponse(error=False,
+                                                    details='OK').json())
     except Exception as error:
-        return JSONDefaultResponse(error=True,
-                                   details=str(error)).json()
+        return FastJSONResponse(JSONDefaultResponse(error=True,
+                                                    details=str(error)).json())
+
+async def _spool_upload(chunks, max_bytes: int = PHOTO_MAX_BYTES, name: str = 'Photo') -> pathlib.Path:
+    """
+    :param chunks:      async iterator of uploaded bytes
+    :param max_bytes:   size limit of the upload
+    :param name:        what is uploaded (for error details)
+    :return:            path to temporary file with the upload
+
+    The function writes the upload to disk chunk by chunk. If it is larger than max_bytes
+    the file is removed and ValueError is raised without reading the rest
+    """
+    spool = tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, prefix='upload_', delete=False)
+    path = pathlib.Path(spool.name)
+
+    try:
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f'{name} is larger than {max_bytes} bytes')
+            await run_in_threadpool(spool.write, chunk)
+
+        spool.close()
+        return path
+    except BaseException:
+        spool.close()
+        path.unlink(missing_ok=True)
+        raise
+
+async def _upload_file_chunks(upload: StarletteUploadFile):
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+@app.post('/admin-panel/upload_photo/{slot}')
+async def upload_photo(slot: str, request: Request, session_token = Cookie(None)):
+    """
+    :param slot:            photo_1, photo_2 or photo_3
+    :param request:         request with image: raw body (Content-Type image/*)
+                            or multipart/form-data with the image in 'file' field
+    :param session_token:   Cookie session token
+    :return:                JSONDefaultResponse with hash of stored photo
+
+    The function streams uploaded image to a temporary file (never holding it in memory),
+    processes it in the image pool and copies it into the photo store in chunks.
+    The photo is put into the draft and attached to the product on /supply
+
+    Uploads larger than PHOTO_MAX_BYTES are rejected with 413: by Content-Length before the body
+    is read (see limits.py), otherwise as soon as the limit is exceeded
+
+    """
+    if not await sessions.get(session_token):
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details='Not authorized').json())
+
+    if slot not in PHOTO_SLOTS:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True,
+                                                    details=f"Slot should be one of: {', '.join(PHOTO_SLOTS)}").json())
+
+    path = None
+    try:
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            form = await request.form(max_files=1)
+            upload = form.get('file')
+            if not isinstance(upload, StarletteUploadFile):
+                raise ValueError('Form should contain image in "file" field')
+            path = await _spool_upload(_upload_file_chunks(upload))
+        else:
+            path = await _spool_upload(request.stream())
+
+        photo_hash = (await _store_photos({slot: path}))[slot]
+
+        await drafts.update(session_token, {'photo_hashes': {slot: photo_hash}})
+
+        return FastJSONResponse(JSONDefaultResponse(data=[{'slot': slot, 'hash': photo_hash}], error=False, details='OK').json())
+
+    except ValueError as error:
+        status_code = 413 if 'larger than' in str(error) else 400
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(),
+                            status_code=status_code)
+    except Exception as error:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json())
+    finally:
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+@app.post('/admin-panel/supply_product')
+async def supply_product_at_once(name: str = Form(), quantity: int = Form(), price: int = Form(),
+                                 photo_1: UploadFile = File(), photo_2: UploadFile = File(None),
+                                 photo_3: UploadFile = File(None), session_token = Cookie(None),
+                                 idempotency_key: str = Header(None)):
+    """
+    :param name:            product name
+    :param quantity:        product quantity
+    :param price:           product price
+    :param photo_1:         image file. Can't be None
+    :param photo_2:         image file
+    :param photo_3:         image file
+    :param session_token:   Cookie session token
+    :param idempotency_key: Idempotency-Key header. A retry with the same key gets
+                            the response of the first supply and supplies nothing
+    :return:                JSONDefaultResponse
+
+    The function supplies a product in one multipart/form-data request
+    instead of /transfer_text, /transfer_photos and /supply. The draft of the session is not used
+
+    Requests with Content-Length over the size of 3 photos are rejected with 413 before the form is read
+
+    """
+    admin_id = await sessions.get(session_token)
+    if not admin_id:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details='Not authorized').json())
+
+    paths = {}
+
+    async def perform(write):
+        for key, upload in zip(PHOTO_SLOTS, (photo_1, photo_2, photo_3)):
+            if upload is not None:
+                paths[key] = await _spool_upload(_upload_file_chunks(upload))
+
+        photo_hashes = await _store_photos(paths)
+
+        return await _supply_draft(admin_id, {
+            'name':         name,
+            'quantity':     quantity,
+            'price':        price,
+            'photo_hashes': photo_hashes
+        }, write)
+
+    try:
+        result = await _idempotent(f'supply:{admin_id}', idempotency_key,
+                                   fingerprint('supply_product', name, quantity, price), perform)
+        return FastJSONResponse(result)
+
+    except ValueError as error:
+        if 'larger than' in str(error):
+            status_code = 413
+        elif 'Idempotency-Key' in str(error):
+            status_code = 422
+        else:
+            status_code = 400
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(),
+                            status_code=status_code)
+    except Exception as error:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json())
+    finally:
+        for path in paths.values():
+            path.unlink(missing_ok=True)
+
+async def _store_archive_photos(archive: importer.PhotoArchive, names: set, photo_hashes: dict):
+    """
+    :param archive:         photos of the import, None if not given
+    :param names:           file names of photos to store
+    :param photo_hashes:    dict file name -> hash of stored photo or exception, updated in place
+    :return:                Nothing
+
+    Photos are read from the archive and processed IMAGE_WORKERS at a time,
+    so only a few of them are in memory at once
+    """
+    if archive is None:
+        photo_hashes.update((name, ValueError('Photos archive is not given')) for name in names)
+        return
+
+    async def store(name: str) -> str:
+        photo = await run_in_threadpool(archive.read, name)
+        return (await _store_photos({name: photo}))[name]
+
+    names = sorted(names)
+    for start in range(0, len(names), IMAGE_WORKERS):
+        group = names[start:start + IMAGE_WORKERS]
+        photo_hashes.update(zip(group, await asyncio.gather(*[store(name) for name in group],
+                                                            return_exceptions=True)))
+
+async def _import_batches(file, file_format: str, archive: importer.PhotoArchive, admin_id: str, report: list):
+    """
+    :param file:        binary file with CSV or NDJSON
+    :param file_format: csv or ndjson
+    :param archive:     photos of the import, None if not given
+    :param admin_id:    ID of authorized admin supplier
+    :param report:      list the result of every row is appended to
+    :return:            Nothing
+
+    Every batch of valid rows is supplied in one transaction. If the file turns out
+    to be malformed, ValueError is raised and already imported batches stay
+    """
+    photo_hashes = {}
+
+    batches = importer.read_batches(file, file_format, IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS)
+    try:
+        while (batch := await run_in_threadpool(next, batches, None)) is not None:
+            await _store_archive_photos(archive, {name for line, row in batch if isinstance(row, dict)
+                                                  for name in row['photos'].values()} - photo_hashes.keys(),
+                                        photo_hashes)
+
+            products = []
+            for line, row in batch:
+                entry = {'line': line, 'product_id': None, 'error': False, 'details': 'OK'}
+                report.append(entry)
+
+                if isinstance(row, ValueError):
+                    entry.update(error=True, details=str(row))
+                    continue
+
+                failed = [photo_hashes[name] for name in row['photos'].values()
+                          if isinstance(photo_hashes[name], Exception)]
+                if failed:
+                    entry.update(error=True, details=str(failed[0]))
+                    continue
+
+                products.append((entry, {
+                    'name':         row['name'],
+                    'price':        row['price'],
+                    'quantity':     row['quantity'],
+                    'photo_hashes': {key: photo_hashes[name] for key, name in row['photos'].items()}
+                }))
+
+            if not products:
+                continue
+
+            result = await async_API.import_products([product for entry, product in products], admin_id)
+            if result['error']:
+                for entry, product in products:
+                    entry.update(error=True, details=result['details'])
+                continue
+
+            for (entry, product), line in zip(products, result['data']):
+                entry['product_id'] = line['product_id']
+            _invalidate_catalog()
+    finally:
+        await run_in_threadpool(batches.close)
+
+@app.post('/admin-panel/import')
+async def import_delivery(request: Request, file_format: str = Query(None, alias='format'),
+                          session_token = Cookie(None)):
+    """
+    :param request:         request with products: raw CSV/NDJSON body (Content-Type text/csv
+                            or application/x-ndjson) or multipart/form-data with the file
+                            in 'products' field and optional zip of photos in 'photos' field
+    :param file_format:     csv or ndjson. By default it is guessed by file name or Content-Type
+    :param session_token:   Cookie session token
+    :return:                JSONDefaultResponse with result of every row:
+                            line, product_id (if created), error and details
+
+    Every product is supplied as with /supply_product, but rows are validated and inserted
+    in batches of IMPORT_BATCH_SIZE, each batch in one transaction. Invalid rows are reported
+    and skipped, valid ones are imported
+
+    """
+    admin_id = await sessions.get(session_token)
+    if not admin_id:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details='Not authorized').json())
+
+    path = None
+    file = None
+    archive = None
+    report = []
+    try:
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            form = await request.form(max_files=2)
+            upload = form.get('products')
+            if not isinstance(upload, StarletteUploadFile):
+                raise ValueError('Form should contain products file in "products" field')
+            file_format = file_format or importer.guess_format(upload.filename, upload.content_type)
+            if file_format not in importer.FORMATS:
+                raise ValueError(f"format should be one of: {', '.join(importer.FORMATS)}")
+
+            file = upload.file
+            photos = form.get('photos')
+            if isinstance(photos, StarletteUploadFile):
+                archive = await run_in_threadpool(importer.PhotoArchive, photos.file)
+        else:
+            file_format = file_format or importer.guess_format(content_type=content_type)
+            if file_format not in importer.FORMATS:
+                raise ValueError(f"format should be one of: {', '.join(importer.FORMATS)}")
+
+            path = await _spool_upload(request.stream(), IMPORT_MAX_BYTES, 'Import')
+            file = await run_in_threadpool(open, path, 'rb')
+
+        await _import_batches(file, file_format, archive, admin_id, report)
+
+    except ValueError as error:
+        if not report:
+            status_code = 413 if 'larger than' in str(error) else 400
+            return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details=str(error)).json(),
+                                    status_code=status_code)
+        report.append({'line': None, 'product_id': None, 'error': True, 'details': f'Import stopped: {error}'})
+    except Exception as error:
+        report.append({'line': None, 'product_id': None, 'error': True, 'details': f'Import stopped: {error}'})
+    finally:
+        if archive is not None:
+            archive.close()
+        if path is not None:
+            if file is not None:
+                file.close()
+            path.unlink(missing_ok=True)
+
+    created = sum(entry['product_id'] is not None for entry in report)
+    failed = sum(entry['error'] and entry['line'] is not None for entry in report)
+    details = f'{created} products imported, {failed} rows failed'
+    if report and report[-1]['line'] is None:
+        details += '. ' + report[-1]['details']
+
+    return FastJSONResponse(JSONDefaultResponse(data=report, error=any(entry['error'] for entry in report),
+                                                details=details).json())
 
 @app.post('/sale')
-async def sale(data: Product, customer: Customer):
+async def sale(data: Product, customer: Customer, idempotency_key: str = Header(None)):
     """
-    :param data:        product data
-    :param customer:    customer data
-    :return:            JSONDefaultResponse
+    :param data:            product data
+    :param customer:        customer data
+    :param idempotency_key: Idempotency-Key header. A retry with the same key gets
+                            the response of the first sale and sells nothing
+    :return:                JSONDefaultResponse
 
     The function gets data about product (how much customer wants to buy)
     and customer (address and personal info)
@@ -225,5 +931,146 @@ async def sale(data: Product, customer: Customer):
     In case of problems it will return JSONDefaultResponse with errors
 
     """
-    result = sale_product(data, customer)
-    return JSONResponse(result)
+    try:
+        result = await _idempotent('sale', idempotency_key,
+                                   fingerprint('sale', data.model_dump(), customer.model_dump()),
+                                   lambda write: write('sale_product', data, customer))
+    except ValueError as error:
+        return _key_error(error)
+
+    if not result['error']:
+        _invalidate_catalog()
+    return FastJSONResponse(result)
+
+@app.post('/sales/batch')
+async def sale_batch(order: BatchSale, idempotency_key: str = Header(None)):
+    """
+    :param order:           customer data and list of items (product ID and quantity)
+    :param idempotency_key: Idempotency-Key header. A retry with the same key gets
+                            the response of the first order and sells nothing
+    :return:                JSONDefaultResponse with result for every item
+
+    The function sells all items in one transaction. If any item can't be sold
+    nothing is sold and the response contains errors for such items
+
+    """
+    try:
+        result = await _idempotent('sale', idempotency_key, fingerprint('sales', order.model_dump()),
+                                   lambda write: write('sale_products', order.items, order.customer))
+    except ValueError as error:
+        return _key_error(error)
+
+    if not result['error']:
+        _invalidate_catalog()
+    return FastJSONResponse(result)
+
+
+
+# Export (NDJSON streams for synchronization jobs)
+
+async def _ndjson(table: str, updated_since: str):
+    async for batch in async_API.iter_export(table, updated_since, EXPORT_BATCH_SIZE):
+        yield b''.join(dumps(row) + b'\n' for row in batch)
+
+async def export(table: str, session_token: str, updated_since: str = None):
+    """
+    :param table:           products, sales or supplies
+    :param session_token:   Cookie session token
+    :param updated_since:   date (YYYY-MM-DD). Only rows changed since this date are exported
+    :return:                NDJSON stream (one JSON object per line)
+
+    The function streams table rows batch by batch without loading the whole table into memory
+    Admin must be logged into to export data
+
+    """
+    if not await sessions.get(session_token):
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details='Not authorized').json())
+
+    if updated_since is not None:
+        try:
+            updated_since = datetime.date.fromisoformat(updated_since).isoformat()
+        except ValueError:
+            return FastJSONResponse(JSONDefaultResponse(data=[], error=True,
+                                                    details='updated_since should be YYYY-MM-DD').json())
+
+    return StreamingResponse(_ndjson(table, updated_since), media_type='application/x-ndjson')
+
+@app.get('/admin-panel/export/products')
+async def export_products(updated_since: str = None, session_token = Cookie(None)):
+    """
+    Products supplied or sold since updated_since (all products by default)
+    """
+    return await export('products', session_token, updated_since)
+
+@app.get('/admin-panel/export/sales')
+async def export_sales(updated_since: str = None, session_token = Cookie(None)):
+    """
+    Sales made since updated_since (all sales by default)
+    """
+    return await export('sales', session_token, updated_since)
+
+@app.get('/admin-panel/export/supplies')
+async def export_supplies(updated_since: str = None, session_token = Cookie(None)):
+    """
+    Supplies made since updated_since (all supplies by default)
+    """
+    return await export('supplies', session_token, updated_since)
+
+
+
+# Analytics (daily rollups of sales and supplies)
+
+def _parse_period(date_from: str, date_to: str):
+    """
+    :return:    (date_from, date_to) in YYYY-MM-DD or None if any of them is invalid
+
+    """
+    try:
+        return tuple(datetime.date.fromisoformat(date).isoformat() if date is not None else None
+                     for date in (date_from, date_to))
+    except ValueError:
+        return None
+
+async def analytics(function, session_token: str, date_from: str, date_to: str, **arguments):
+    """
+    :param function:        async_API analytics function
+    :param session_token:   Cookie session token
+    :param date_from:       first day (YYYY-MM-DD), all history by default
+    :param date_to:         last day (YYYY-MM-DD), till today by default
+    :return:                JSONDefaultResponse
+
+    Admin must be logged into to see analytics
+    """
+    if not await sessions.get(session_token):
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True, details='Not authorized').json())
+
+    period = _parse_period(date_from, date_to)
+    if period is None:
+        return FastJSONResponse(JSONDefaultResponse(data=[], error=True,
+                                                    details='date_from and date_to should be YYYY-MM-DD').json())
+
+    return FastJSONResponse(await function(date_from=period[0], date_to=period[1], **arguments))
+
+@app.get('/admin-panel/analytics/revenue')
+async def analytics_revenue(group_by: str = 'day', date_from: str = None, date_to: str = None,
+                            session_token = Cookie(None)):
+    """
+    Units, revenue and number of sales by day, product or city
+    """
+    return await analytics(async_API.get_revenue, session_token, date_from, date_to, group_by=group_by)
+
+@app.get('/admin-panel/analytics/top_sellers')
+async def analytics_top_sellers(by: str = 'revenue', limit: int = Query(10, ge=1, le=ANALYTICS_MAX_LIMIT),
+                                date_from: str = None, date_to: str = None, session_token = Cookie(None)):
+    """
+    Products with the highest revenue or units sold
+    """
+    return await analytics(async_API.get_top_sellers, session_token, date_from, date_to, by=by, limit=limit)
+
+@app.get('/admin-panel/analytics/stock_turnover')
+async def analytics_stock_turnover(limit: int = Query(100, ge=1, le=ANALYTICS_MAX_LIMIT),
+                                   date_from: str = None, date_to: str = None, session_token = Cookie(None)):
+    """
+    Units sold and supplied, current stock and turnover of products moved in the period
+    """
+    return await analytics(async_API.get_stock_turnover, session_token, date_from, date_to, limit=limit)
@@ -0,0 +1,267 @@
+"""
+Prometheus metrics
+
+Counters, gauges and histograms are kept in process memory and rendered in Prometheus
+text format by GET /metrics. Recording a value is a dict lookup and an addition under a lock,
+so metrics can be updated on the hot path and from database threads.
+With several workers every worker reports its own metrics
+"""
+import bisect
+import threading
+import time
+
+
+# Bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per label set
+
+    :param name:    metric name
+    :param help:    description
+    :param labels:  label names
+
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name   = name
+        self.help   = help
+        self.labels = labels
+
+        self._values    = {}
+        self._lock      = threading.Lock()
+
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    """
+    Value per label set that can go up and down. If function is given, values are taken
+    from it on every scrape: it should return dict label values -> value
+
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+
+        for label_values, value in self.function().items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """
+    Distribution of observed values (e.g. durations in seconds) per label set
+
+    :param name:    metric name
+    :param help:    description
+    :param labels:  label names
+    :param buckets: upper bounds of buckets
+
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name       = name
+        self.help       = help
+        self.labels     = labels
+        self.buckets    = tuple(buckets)
+
+        self._values    = {}    # label values -> [bucket counts..., sum, count]
+        self._lock      = threading.Lock()
+
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [0] * (len(self.buckets) + 3)
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def time(self, *label_values):
+        """
+        :return:    context manager observing duration of the block in seconds
+
+        """
+        return _Timer(self, label_values)
+
+    def samples(self):
+        with self._lock:
+            values = [(label_values, list(entry)) for label_values, entry in self._values.items()]
+
+        for label_values, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), entry):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labels, label_values, f'le="{_format_value(float(bound))}"'),
+                       cumulative)
+            yield self.name + '_sum', _format_labels(self.labels, label_values), entry[-2]
+            yield self.name + '_count', _format_labels(self.labels, label_values), entry[-1]
+
+
+class _Timer:
+    # Plain class instead of @contextmanager: it is used around every query
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram      = histogram
+        self.label_values   = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+def render() -> str:
+    """
+    :return:    all metrics in Prometheus text exposition format
+
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP
+http_requests = Counter('http_requests_total', 'HTTP requests',
+                        ('method', 'route', 'status'))
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request duration',
+                                  ('method', 'route'))
+http_requests_in_progress = Gauge('http_requests_in_progress', 'HTTP requests being processed',
+                                  ('method', ))
+
+# Database
+query_duration = Histogram('database_query_duration_seconds', 'Duration of named database queries',
+                           ('query', ))
+connections_opened = Counter('database_connections_opened_total', 'SQLite connections opened by the pool')
+write_batch_size = Histogram('database_write_batch_size', 'Sales and supplies committed in one transaction',
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+def query_timer(name: str):
+    """
+    :param name:    query name (catalog, photos, update_quantity, insert_sale...)
+    :return:        context manager observing duration of the block
+
+    """
+    return query_duration.time(name)
+
+def register_pool(function):
+    """
+    :param function:    function returning pool stats (see database.pool.pool_stats)
+    :return:            Nothing
+
+    """
+    Gauge('database_connections', 'SQLite connections of the pool by state', ('state', ),
+          function=lambda: {(state, ): value for state, value in function().items()})
+
+def register_caches(caches: dict):
+    """
+    :param caches:  dict name -> LRUCache
+    :return:        Nothing
+
+    Cache counters are read from LRUCache.stats() on every scrape
+    """
+    def collect(key: str):
+        return lambda: {(name, ): cache.stats()[key] for name, cache in caches.items()}
+
+    Gauge('cache_hits', 'Cache hits', ('cache', ), function=collect('hits'))
+    Gauge('cache_misses', 'Cache misses', ('cache', ), function=collect('misses'))
+    Gauge('cache_evictions', 'Entries evicted from cache', ('cache', ), function=collect('evictions'))
+    Gauge('cache_entries', 'Entries in cache', ('cache', ), function=collect('entries'))
+    Gauge('cache_bytes', 'Size of cached values in bytes', ('cache', ), function=collect('bytes'))
+    Gauge('cache_hit_ratio', 'Cache hits / (hits + misses)', ('cache', ), function=collect('hit_ratio'))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests and their duration by route template
+    (e.g. /products/{id}/photo_1, not the real path), plus requests in progress
+
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        http_requests_in_progress.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            http_requests_in_progress.dec(method)
+
+            # The router puts matched route into scope. Unmatched paths share one label
+            route = scope.get('route')
+            route = route.path if route is not None else 'unmatched'
+
+            http_requests.inc(method, route, status)
+            http_request_duration.observe(duration, method, route)
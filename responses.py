@@ -0,0 +1,35 @@
+"""
+JSON serialization of responses
+
+orjson is optional: without it the standard json module is used (several times slower
+on large catalogs and exports)
+"""
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """
+    :param content: JSON-compatible data (dicts, lists, strings, numbers, None)
+    :return:        compact UTF-8 encoded JSON
+
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with dumps(). It is the default response class of the app:
+    handlers return it directly, so the content is not passed through jsonable_encoder
+
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
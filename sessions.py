@@ -0,0 +1,200 @@
+"""
+Admin sessions
+
+A session is created on login and expires SESSION_TTL seconds later, together with the cookie.
+Expired sessions are not returned and are removed by a periodic sweep (see main.lifespan).
+A session keeps only ID of the admin: the password is checked once on login.
+
+MemorySessionStore keeps sessions in the worker process, SQLiteSessionStore keeps them
+in Sessions table, so they are shared by all workers (uvicorn --workers N) and survive restarts.
+SQLiteSessionStore remembers verified sessions for PRINCIPAL_CACHE_TTL seconds,
+so most admin requests don't query the database
+"""
+import secrets
+import time
+
+from cache import LRUCache
+from config import SESSION_BACKEND, SESSION_TTL, SESSION_MAX_COUNT
+from config import PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_MAX_BYTES
+from database.pool import get_connection, transaction
+from database import async_API
+
+
+def _new_token() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class MemorySessionStore:
+    """
+    Sessions in memory of the worker process. Suitable for a single worker
+
+    :param ttl:         session lifetime in seconds
+    :param max_count:   maximal number of sessions. The oldest ones are dropped when it's exceeded
+
+    """
+    def __init__(self, ttl: float, max_count: int):
+        self.ttl        = ttl
+        self.max_count  = max_count
+
+        self._sessions  = {}    # token -> (admin_id, expires_at), oldest first
+
+    async def create(self, admin_id: str) -> str:
+        """
+        :param admin_id:    ID of logged in admin
+        :return:            new session token
+
+        """
+        token = _new_token()
+        self._sessions[token] = (admin_id, time.monotonic() + self.ttl)
+
+        await self.sweep()
+        while len(self._sessions) > self.max_count:
+            del self._sessions[next(iter(self._sessions))]
+
+        return token
+
+    async def get(self, token: str) -> str:
+        """
+        :param token:   session token
+        :return:        admin ID of the session or None if there is no such session or it expired
+
+        """
+        entry = self._sessions.get(token) if token else None
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    async def delete(self, token: str):
+        self._sessions.pop(token, None)
+
+    async def sweep(self) -> int:
+        """
+        :return:    number of removed expired sessions
+
+        """
+        now = time.monotonic()
+        removed = 0
+        # All sessions live equally long, so expired ones are at the beginning
+        while self._sessions:
+            token, (admin_id, expires_at) = next(iter(self._sessions.items()))
+            if expires_at >= now:
+                break
+            del self._sessions[token]
+            removed += 1
+        return removed
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in Sessions table of the database, shared by all worker processes
+
+    :param ttl:         session lifetime in seconds
+    :param max_count:   maximal number of sessions. The oldest ones are dropped when it's exceeded
+
+    A session deleted by another worker may stay valid in this one for PRINCIPAL_CACHE_TTL seconds
+
+    """
+    def __init__(self, ttl: float, max_count: int):
+        self.ttl        = ttl
+        self.max_count  = max_count
+
+        self._principals = LRUCache(PRINCIPAL_CACHE_MAX_BYTES, ttl=min(ttl, PRINCIPAL_CACHE_TTL))
+
+    def _create_session(self, admin_id: str) -> str:
+        token = _new_token()
+
+        with get_connection() as connection:
+            with transaction(connection):
+                connection.execute('''
+                    INSERT INTO Sessions (token, admin_id, expires_at)
+                    VALUES (?, ?, ?)
+                ''', (token, admin_id, time.time() + self.ttl))
+
+                self._sweep(connection)
+                connection.execute('''
+                    DELETE FROM Sessions
+                    WHERE token IN (
+                        SELECT token
+                        FROM Sessions
+                        ORDER BY expires_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_count, ))
+
+        return token
+
+    def _get_session(self, token: str) -> str:
+        sql_query = '''
+            SELECT admin_id
+            FROM Sessions
+            WHERE token = ? AND expires_at >= ?
+        '''
+
+        with get_connection() as connection:
+            row = connection.execute(sql_query, (token, time.time())).fetchone()
+
+        return row[0] if row else None
+
+    def _delete_session(self, token: str):
+        with get_connection() as connection:
+            with transaction(connection):
+                connection.execute('DELETE FROM Sessions WHERE token = ?', (token, ))
+
+    @staticmethod
+    def _sweep(connection) -> int:
+        return connection.execute('DELETE FROM Sessions WHERE expires_at < ?', (time.time(), )).rowcount
+
+    def _sweep_sessions(self) -> int:
+        with get_connection() as connection:
+            with transaction(connection):
+                return self._sweep(connection)
+
+    async def _load_session(self, token: str) -> str:
+        return await async_API.run(self._get_session, token)
+
+    async def create(self, admin_id: str) -> str:
+        """
+        :param admin_id:    ID of logged in admin
+        :return:            new session token
+
+        """
+        return await async_API.run(self._create_session, admin_id)
+
+    async def get(self, token: str) -> str:
+        """
+        :param token:   session token
+        :return:        admin ID of the session or None if there is no such session or it expired
+
+        """
+        if not token:
+            return None
+        return await self._principals.get_or_load(token, self._load_session)
+
+    async def delete(self, token: str):
+        self._principals.invalidate(token)
+        await async_API.run(self._delete_session, token)
+
+    async def sweep(self) -> int:
+        """
+        :return:    number of removed expired sessions
+
+        """
+        return await async_API.run(self._sweep_sessions)
+
+
+SESSION_STORES = {
+    'memory':   MemorySessionStore,
+    'sqlite':   SQLiteSessionStore,
+}
+
+
+def create_session_store(backend: str = SESSION_BACKEND):
+    """
+    :param backend: 'memory' or 'sqlite'
+    :return:        session store configured with SESSION_* settings
+
+    """
+    if backend not in SESSION_STORES:
+        raise ValueError(f"Session backend should be one of: {', '.join(SESSION_STORES)}")
+
+    return SESSION_STORES[backend](SESSION_TTL, SESSION_MAX_COUNT)
@@ -0,0 +1,26 @@
+import sqlite3
+
+import pytest
+
+from database import pool, ids
+from database.schema import migrate
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    :return:    path of a migrated temporary database used by the application pool
+
+    """
+    database_path = str(tmp_path / 'main.db')
+
+    connection = sqlite3.connect(database_path)
+    migrate(connection)
+    connection.close()
+
+    pool.close_pool()
+    monkeypatch.setattr(pool, 'DATABASE_PATH', database_path)
+    ids.claim_node()
+    yield database_path
+    ids.release_node()
+    pool.close_pool()
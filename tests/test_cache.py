@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from cache import LRUCache
+
+
+def test_waiters_share_one_load():
+    cache = LRUCache(1024, sizeof=len)
+    loads = []
+
+    async def loader(key):
+        loads.append(key)
+        await asyncio.sleep(0.01)
+        return b'value'
+
+    async def main():
+        return await asyncio.gather(*[cache.get_or_load('key', loader) for _ in range(10)])
+
+    assert asyncio.run(main()) == [b'value'] * 10
+    assert loads == ['key']
+
+def test_cancelled_load_is_retried_by_waiters():
+    cache = LRUCache(1024, sizeof=len)
+    loads = []
+
+    async def loader(key):
+        loads.append(key)
+        if len(loads) == 1:
+            await asyncio.sleep(10)
+        return b'value'
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_load('key', loader))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_load('key', loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        # One of the waiters becomes the leader, the others share its load
+        assert await asyncio.wait_for(asyncio.gather(*waiters), 1) == [b'value'] * 3
+
+    asyncio.run(main())
+    assert loads == ['key', 'key']
+
+def test_cancelled_waiter_is_cancelled():
+    cache = LRUCache(1024, sizeof=len)
+
+    async def loader(key):
+        await asyncio.sleep(0.05)
+        return b'value'
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_load('key', loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load('key', loader))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert await leader == b'value'
+
+    asyncio.run(main())
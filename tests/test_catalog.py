@@ -0,0 +1,30 @@
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+import main
+from database.API import _encode_cursor
+
+
+def test_catalog_errors(database):
+    with TestClient(main.app) as client:
+        response = client.get('/products')
+        assert response.status_code == 200
+        assert response.json()['error'] is False
+
+        for parameters in ({'fields': 'foo'}, {'sort': 'name'}, {'order': 'up'}, {'cursor': 'broken'},
+                           {'sort': 'price', 'cursor': _encode_cursor('abc', 'x')},
+                           {'sort': 'price', 'cursor': _encode_cursor(True, 'x')},
+                           {'cursor': _encode_cursor('x', 1)}):
+            response = client.get('/products', params=parameters)
+            assert response.status_code == 422
+            assert response.json()['error'] is True
+
+        connection = sqlite3.connect(database)
+        connection.execute('DROP TABLE Products')
+        connection.close()
+        main._invalidate_catalog()
+
+        response = client.get('/products')
+        assert response.status_code == 500
+        assert response.json()['details'].startswith('Database error')
@@ -0,0 +1,54 @@
+import datetime
+import sqlite3
+
+from classes import Product, Customer
+from database import API
+from database.pool import pool_stats
+
+
+def test_export_is_paginated_by_id(database):
+    product_ids = []
+    for number in range(7):
+        result = API.supply_product(Product(id='', name=f'Product {number}', quantity=5, price=10, photos={}), 'admin')
+        product_ids.append(result['data']['product_id'])
+
+    batches = API.iter_export('products', batch_size=3)
+    rows = []
+    for batch in batches:
+        # No connection is checked out while the consumer handles a batch
+        assert pool_stats()['in_use'] == 0
+        rows.extend(batch)
+
+    assert [len(batch) for batch in API.iter_export('products', batch_size=3)] == [3, 3, 1]
+    assert [row['id'] for row in rows] == sorted(product_ids)
+
+def test_export_since_date(database):
+    customer = Customer(name='A', email='a@example.com', city='Moscow', address='Street 1')
+    product_ids = []
+    for number in range(4):
+        result = API.supply_product(Product(id='', name=f'Product {number}', quantity=5, price=10, photos={}), 'admin')
+        product_ids.append(result['data']['product_id'])
+    API.sale_product(Product(id=product_ids[0], name='', quantity=1, price=10, photos={}), customer)
+
+    today = datetime.date.today().isoformat()
+    tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+
+    assert len([row for batch in API.iter_export('products', today, batch_size=2) for row in batch]) == 4
+    assert [row for batch in API.iter_export('products', tomorrow, batch_size=2) for row in batch] == []
+    assert [len(batch) for batch in API.iter_export('sales', today, batch_size=1)] == [1]
+    assert [len(batch) for batch in API.iter_export('supplies', today, batch_size=2)] == [2, 2]
+
+def test_sales_since_date_are_paginated_by_date_and_id(database):
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.executemany('''
+            INSERT INTO Sales (id, product_id, quantity, price, operation_date)
+            VALUES (?, 'P1', 1, 10, ?)
+        ''', [('S5', '2026-01-01'), ('S1', '2026-01-02'), ('S4', '2026-01-02'), ('S2', '2026-01-03'),
+              ('S3', '2026-01-02'), ('S0', '2026-01-04')])
+    connection.close()
+
+    batches = list(API.iter_export('sales', '2026-01-02', batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row['id'] for batch in batches for row in batch] == ['S1', 'S3', 'S4', 'S2', 'S0']
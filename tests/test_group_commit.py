@@ -0,0 +1,54 @@
+import sqlite3
+
+from classes import Product, Customer
+from database import API
+
+
+CUSTOMER = Customer(name='A', email='a@example.com', city='Moscow', address='Street 1')
+
+
+def _seed(database: str) -> str:
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.execute("INSERT INTO Products (id, name, price, quantity) VALUES ('P1', 'Tea', 10, 5)")
+    connection.close()
+    return 'P1'
+
+def _sale(product_id: str) -> tuple:
+    return 'sale_product', (Product(id=product_id, name='', quantity=1, price=10, photos={}), CUSTOMER)
+
+def _stock(database: str, product_id: str) -> int:
+    connection = sqlite3.connect(database)
+    quantity, = connection.execute('SELECT quantity FROM Products WHERE id = ?', (product_id, )).fetchone()
+    connection.close()
+    return quantity
+
+
+def test_failed_statement_fails_only_its_command(database, monkeypatch):
+    product_id = _seed(database)
+
+    def broken(connection):
+        connection.execute('SELECT * FROM NoSuchTable')
+
+    monkeypatch.setitem(API.WRITE_COMMANDS, 'broken', broken)
+
+    results = API.apply_writes([_sale(product_id), ('broken', ()), _sale(product_id)])
+
+    assert [result['error'] for result in results] == [False, True, False]
+    assert 'no such table' in results[1]['details']
+    assert _stock(database, product_id) == 3
+
+def test_locked_database_fails_the_batch(database, monkeypatch):
+    product_id = _seed(database)
+
+    def locked(connection):
+        error = sqlite3.OperationalError('database is locked')
+        error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+        raise error
+
+    monkeypatch.setitem(API.WRITE_COMMANDS, 'locked', locked)
+
+    results = API.apply_writes([_sale(product_id), ('locked', ()), _sale(product_id)])
+
+    assert all(result['error'] for result in results)
+    assert _stock(database, product_id) == 5
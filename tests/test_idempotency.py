@@ -0,0 +1,96 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from classes import Product, Customer
+from database.API import IDEMPOTENCY_CONFLICT
+from idempotency import IdempotencyStore, fingerprint
+
+
+CUSTOMER = Customer(name='A', email='a@example.com', city='Moscow', address='Street 1')
+
+
+def _seed(database: str) -> str:
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.execute("INSERT INTO Products (id, name, price, quantity) VALUES ('P1', 'Tea', 10, 100)")
+    connection.close()
+    return 'P1'
+
+def _sales(database: str) -> int:
+    connection = sqlite3.connect(database)
+    count, = connection.execute('SELECT COUNT(*) FROM Sales').fetchone()
+    connection.close()
+    return count
+
+def _sale(product_id: str, quantity: int = 1, delay: float = 0):
+    product = Product(id=product_id, name='', quantity=quantity, price=10, photos={})
+    performed = []
+
+    async def perform(write):
+        performed.append(quantity)
+        await asyncio.sleep(delay)
+        return await write('sale_product', product, CUSTOMER)
+
+    return fingerprint('sale', product.model_dump()), perform, performed
+
+
+def test_concurrent_duplicates_share_one_write(database):
+    product_id = _seed(database)
+    store = IdempotencyStore(ttl=60, max_bytes=1024 * 1024)
+    request_fingerprint, perform, performed = _sale(product_id, delay=0.01)
+
+    async def main():
+        return await asyncio.gather(*[store.run('sale:k1', request_fingerprint, perform) for _ in range(10)])
+
+    responses = asyncio.run(main())
+
+    assert len(performed) == 1
+    assert all(response == responses[0] for response in responses)
+    assert not responses[0]['error']
+    assert _sales(database) == 1
+
+def test_key_reused_with_another_request(database):
+    product_id = _seed(database)
+    request_fingerprint, perform, _ = _sale(product_id)
+    other_fingerprint, other_perform, other_performed = _sale(product_id, quantity=2)
+
+    async def main():
+        store = IdempotencyStore(ttl=60, max_bytes=1024 * 1024)
+        await store.run('sale:k1', request_fingerprint, perform)
+        with pytest.raises(ValueError, match=IDEMPOTENCY_CONFLICT):
+            await store.run('sale:k1', other_fingerprint, other_perform)
+        assert other_performed == []
+
+        # Another worker finds the key in the database
+        store = IdempotencyStore(ttl=60, max_bytes=1024 * 1024)
+        with pytest.raises(ValueError, match=IDEMPOTENCY_CONFLICT):
+            await store.run('sale:k1', other_fingerprint, other_perform)
+
+    asyncio.run(main())
+
+    assert _sales(database) == 1
+
+def test_cancelled_first_request(database):
+    product_id = _seed(database)
+    store = IdempotencyStore(ttl=60, max_bytes=1024 * 1024)
+    request_fingerprint, perform, performed = _sale(product_id, delay=0.05)
+
+    async def main():
+        first = asyncio.create_task(store.run('sale:k1', request_fingerprint, perform))
+        await asyncio.sleep(0)
+        retries = [asyncio.create_task(store.run('sale:k1', request_fingerprint, perform)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        # Client of the first request disconnected: retries are not cancelled with it
+        first.cancel()
+        responses = await asyncio.wait_for(asyncio.gather(*retries), 5)
+
+        assert all(not response['error'] for response in responses)
+        assert responses[0] == responses[1] == responses[2]
+
+    asyncio.run(main())
+
+    assert len(performed) == 2
+    assert _sales(database) == 1
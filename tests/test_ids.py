@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import pytest
+
+from database import ids
+from database.ids import IDGenerator, SEQUENCE_BITS
+
+
+def test_ids_increase_when_clock_goes_backwards(monkeypatch):
+    generator = IDGenerator(1)
+    now = time.time()
+    monkeypatch.setattr(ids.time, 'time', lambda: now)
+
+    first = [generator.next() for _ in range(1 << SEQUENCE_BITS)]
+
+    # Clock is stuck behind the last ID: the sequence is exhausted without waiting for the clock
+    now -= 1
+    second = [generator.next() for _ in range(1 << SEQUENCE_BITS)]
+
+    numbers = first + second
+    assert numbers == sorted(numbers)
+    assert len(set(numbers)) == len(numbers)
+
+def test_generator_requires_node():
+    with pytest.raises(Exception, match='not claimed'):
+        IDGenerator().next()
+
+    with pytest.raises(ValueError):
+        IDGenerator(1024)
+
+def test_claim_node_skips_leased_nodes(database, monkeypatch):
+    node = ids.claim_node()
+    assert ids.claim_node() == node
+
+    connection = sqlite3.connect(database)
+    with connection:
+        # Node of a crashed process is taken back after its lease expires
+        connection.execute("INSERT INTO IdNodes VALUES (?, 'other', ?)", (node + 1, time.time() + 60))
+        connection.execute("INSERT INTO IdNodes VALUES (?, 'crashed', ?)", (node + 2, time.time() - 60))
+
+    ids.release_node()
+    assert ids.claim_node() == node
+
+    with connection:
+        connection.execute('DELETE FROM IdNodes WHERE node = ?', (node, ))
+        connection.execute("INSERT INTO IdNodes VALUES (?, 'other', ?)", (node, time.time() + 60))
+
+    # Lease taken by another process: the next free node is claimed without unsetting the node,
+    # so IDs generated meanwhile don't fail
+    nodes = []
+    set_node = ids._generator.set_node
+    monkeypatch.setattr(ids._generator, 'set_node', lambda number: nodes.append(number) or set_node(number))
+
+    ids.renew_node()
+    assert ids.claim_node() == node + 2
+    assert nodes == [node + 2]
+
+    owners = dict(connection.execute('SELECT node, owner FROM IdNodes'))
+    assert owners[node] == owners[node + 1] == 'other'
+    connection.close()
+
+def test_renew_node_extends_lease(database, monkeypatch):
+    node = ids.claim_node()
+
+    connection = sqlite3.connect(database)
+    expires_at, = connection.execute('SELECT expires_at FROM IdNodes WHERE node = ?', (node, )).fetchone()
+
+    now = time.time() + 60
+    monkeypatch.setattr(ids.time, 'time', lambda: now)
+    ids.renew_node()
+
+    assert ids.claim_node() == node
+    renewed, = connection.execute('SELECT expires_at FROM IdNodes WHERE node = ?', (node, )).fetchone()
+    assert renewed == pytest.approx(expires_at + 60, abs=1)
+    connection.close()
@@ -0,0 +1,27 @@
+import asyncio
+import io
+
+from PIL import Image
+
+import images
+
+
+def test_variants_are_upright(monkeypatch):
+    # Camera photo stored sideways: 40x20 pixels with orientation "rotate 90 degrees clockwise"
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 20)).save(buffer, 'JPEG', exif=exif)
+
+    async def process():
+        try:
+            return await images.process_photos({'photo_1': buffer.getvalue()})
+        finally:
+            images.close_executor()
+
+    variants = asyncio.run(process())['photo_1']
+
+    assert variants['original']['data'] == buffer.getvalue()
+    for name in images.PHOTO_VARIANTS:
+        width, height = Image.open(io.BytesIO(variants[name]['data'])).size
+        assert height > width
@@ -0,0 +1,61 @@
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+import main
+from classes import Product
+from config import PHOTO_MAX_BYTES, UPLOAD_FORM_BYTES
+from database import API
+
+
+def _photo(data: bytes) -> dict:
+    return {
+        'original': {'data': data, 'media_type': 'image/jpeg'},
+        'thumb':    {'data': data + b'thumb', 'media_type': 'image/jpeg'},
+    }
+
+def test_upload_rejected_by_content_length(database):
+    with TestClient(main.app) as client:
+        # Not even authorized: the body is rejected before the handler is called
+        response = client.post('/admin-panel/upload_photo/photo_1',
+                               content=b'0' * (PHOTO_MAX_BYTES + UPLOAD_FORM_BYTES + 1),
+                               headers={'Content-Type': 'image/jpeg'})
+        assert response.status_code == 413
+        assert response.json()['error'] is True
+
+        response = client.post('/admin-panel/upload_photo/photo_1', content=b'0',
+                               headers={'Content-Type': 'image/jpeg'})
+        assert response.status_code == 200
+        assert response.json()['details'] == 'Not authorized'
+
+def test_sweep_removes_photos_of_no_product(database):
+    supplied = API.store_photo(_photo(b'supplied'))
+    abandoned = API.store_photo(_photo(b'abandoned'))
+    waiting = API.store_photo(_photo(b'waiting'))
+
+    product = Product(id='', name='Tea', quantity=1, price=10, photos={})
+    assert not API.apply_write('supply_product', product, 'admin', {'photo_1': supplied})['error']
+
+    connection = sqlite3.connect(database)
+    sql_query_age = "UPDATE ProductPhotos SET created_at = datetime('now', '-2 days') WHERE hash != ?"
+    with connection:
+        connection.execute(sql_query_age, (waiting, ))
+
+    # Uploading an old photo again makes it wait for a supply again
+    assert API.store_photo(_photo(b'abandoned')) == abandoned
+    assert API.sweep_photos(3600) == 0
+
+    with connection:
+        connection.execute(sql_query_age, (waiting, ))
+    assert API.sweep_photos(3600) == 2
+    assert API.sweep_photos(3600) == 0
+
+    hashes = {row[0] for row in connection.execute('SELECT hash FROM ProductPhotos')}
+    variants = {row[0] for row in connection.execute('SELECT hash FROM ProductPhotoVariants')}
+    connection.close()
+
+    assert abandoned not in hashes and variants == {supplied, waiting}
+    assert len(hashes) == 4
+
+    photos = API.get_photos(API.get_available_products()['data'][0]['id'], 'thumb')
+    assert photos[0]['data'] == b'suppliedthumb'
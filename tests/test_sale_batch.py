@@ -0,0 +1,37 @@
+import sqlite3
+
+import pytest
+from pydantic import ValidationError
+
+from classes import BatchSale, Customer, SaleItem
+from config import BATCH_SALE_MAX_ITEMS
+from database import API
+
+
+CUSTOMER = Customer(name='A', email='a@example.com', city='Moscow', address='Street 1')
+
+
+def test_order_size_is_limited():
+    items = [{'id': f'P{number}', 'quantity': 1} for number in range(BATCH_SALE_MAX_ITEMS + 1)]
+
+    with pytest.raises(ValidationError):
+        BatchSale(customer=CUSTOMER, items=items)
+
+    assert len(BatchSale(customer=CUSTOMER, items=items[:-1]).items) == BATCH_SALE_MAX_ITEMS
+
+def test_stock_lookup_is_not_limited_by_sql_variables(database):
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.execute("INSERT INTO Products (id, name, price, quantity) VALUES ('P1', 'Tea', 10, 5)")
+    connection.close()
+
+    # More distinct products than SQLITE_MAX_VARIABLE_NUMBER of a default build
+    items = [SaleItem(id='P1', quantity=1)] + [SaleItem(id=f'X{number}', quantity=1) for number in range(40000)]
+    result = API.sale_products(items, CUSTOMER)
+
+    assert result['error']
+    assert result['data'][0]['error'] is False
+    assert all(line['details'].startswith('No products with ID') for line in result['data'][1:])
+
+    result = API.sale_products([SaleItem(id='P1', quantity=2)], CUSTOMER)
+    assert not result['error']
@@ -0,0 +1,68 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from classes import Product, Customer, SaleItem
+from database import API
+
+
+STOCK   = 200
+THREADS = 16
+PRICE   = 10
+
+
+def _seed(database: str, stock: int) -> str:
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.execute("INSERT INTO Products (id, name, price, quantity) VALUES ('P1', 'Tea', ?, ?)",
+                           (PRICE, stock))
+    connection.close()
+    return 'P1'
+
+def _customer(number: int) -> Customer:
+    return Customer(name=f'Customer {number}', email=f'{number}@example.com', city='Moscow', address='Street 1')
+
+def _check_sold_out(database: str, product_id: str):
+    connection = sqlite3.connect(database)
+    quantity, = connection.execute('SELECT quantity FROM Products WHERE id = ?', (product_id, )).fetchone()
+    sold, = connection.execute('SELECT COALESCE(SUM(quantity), 0) FROM Sales WHERE product_id = ?',
+                               (product_id, )).fetchone()
+    units, = connection.execute('SELECT COALESCE(SUM(units), 0) FROM SalesDaily WHERE product_id = ?',
+                                (product_id, )).fetchone()
+    connection.close()
+
+    assert quantity == 0
+    assert sold == STOCK
+    assert units == STOCK
+
+
+def test_sale_product_never_oversells(database):
+    product_id = _seed(database, STOCK)
+
+    # More buyers than units: every unit is sold once, the rest get an error
+    def buy(number: int) -> dict:
+        return API.sale_product(Product(id=product_id, name='', quantity=1, price=PRICE, photos={}),
+                                _customer(number))
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(buy, range(STOCK + THREADS * 4)))
+
+    assert sum(not result['error'] for result in results) == STOCK
+    _check_sold_out(database, product_id)
+
+    connection = sqlite3.connect(database)
+    assert connection.execute('SELECT COUNT(*) FROM Sales').fetchone()[0] == STOCK
+    connection.close()
+
+def test_sale_products_never_oversells(database):
+    product_id = _seed(database, STOCK)
+
+    # Two lines of the same product per order: lines are summed up, 2 units per order
+    def buy(number: int) -> dict:
+        return API.sale_products([SaleItem(id=product_id, quantity=1), SaleItem(id=product_id, quantity=1)],
+                                 _customer(number))
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(buy, range(STOCK)))
+
+    assert sum(not result['error'] for result in results) == STOCK // 2
+    _check_sold_out(database, product_id)
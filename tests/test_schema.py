@@ -0,0 +1,35 @@
+import sqlite3
+
+from database import schema
+from database.API import EXPORT_QUERIES
+from database.schema import MIGRATIONS, HOT_QUERIES, migrate, get_version, full_scans
+
+
+def test_migrate_is_idempotent(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'main.db'))
+
+    assert migrate(connection) == len(MIGRATIONS)
+    assert migrate(connection) == len(MIGRATIONS)
+    assert get_version(connection) == len(MIGRATIONS)
+
+    connection.close()
+
+def test_hot_queries_use_indexes(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'main.db'))
+    migrate(connection)
+
+    assert full_scans(connection) == {}
+
+    connection.close()
+
+def test_index_walk_is_a_full_scan(tmp_path, monkeypatch):
+    connection = sqlite3.connect(str(tmp_path / 'main.db'))
+    migrate(connection)
+
+    # Exports are checked with the queries they run
+    assert HOT_QUERIES['export_sales'] == EXPORT_QUERIES['sales'][1]
+
+    monkeypatch.setattr(schema, 'HOT_QUERIES', {'all_ids': 'SELECT id FROM Products ORDER BY id'})
+    assert list(full_scans(connection)) == ['all_ids']
+
+    connection.close()
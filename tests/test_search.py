@@ -0,0 +1,30 @@
+import sqlite3
+
+from database import API
+
+
+def _search(query: str, prefix: bool = False) -> list:
+    return sorted(product['id'] for product in API.search_products(query, in_stock=False, prefix=prefix)['data'])
+
+def test_search_survives_renumbered_rowids(database):
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.executemany('INSERT INTO Products (id, name, price, quantity) VALUES (?, ?, 10, 1)', [
+            ('P1', 'Green tea'), ('P2', 'Black tea'), ('P3', 'Coffee'), ('P4', 'Teapot')
+        ])
+        connection.execute("DELETE FROM Products WHERE id = 'P2'")
+        connection.execute("UPDATE Products SET name = 'White tea' WHERE id = 'P3'")
+
+        # VACUUM may renumber implicit rowids of a table with TEXT primary key
+        connection.execute('UPDATE Products SET rowid = 1000 - rowid')
+
+    assert _search('tea') == ['P1', 'P3']
+    assert _search('te', prefix=True) == ['P1', 'P3', 'P4']
+    assert _search('coffee') == []
+
+    with connection:
+        connection.execute("INSERT INTO Products (id, name, price, quantity) VALUES ('P5', 'Milk tea', 10, 1)")
+        connection.execute("INSERT INTO ProductsSearch (ProductsSearch) VALUES ('integrity-check')")
+    connection.close()
+
+    assert _search('tea') == ['P1', 'P3', 'P5']
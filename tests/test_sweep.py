@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+import pytest
+
+import main
+
+
+def test_failed_sweep_doesnt_stop_others(monkeypatch, caplog):
+    swept = []
+
+    async def broken():
+        raise Exception('database is locked')
+
+    async def drafts():
+        swept.append('drafts')
+
+    async def idempotency():
+        swept.append('idempotency')
+        # Stops the endless task after the first round
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(main, 'SESSION_SWEEP_INTERVAL', 0)
+    monkeypatch.setattr(main.sessions, 'sweep', broken)
+    monkeypatch.setattr(main.drafts, 'sweep', drafts)
+    monkeypatch.setattr(main.idempotency, 'sweep', idempotency)
+
+    with caplog.at_level(logging.ERROR, logger=main.logger.name):
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main._sweep_expired())
+
+    assert swept == ['drafts', 'idempotency']
+    assert 'Sweep of expired sessions failed' in caplog.text
+    assert 'database is locked' in caplog.text